@@ -0,0 +1,112 @@
+"""
+Benchmark the ex2 customer total: the original concatenated-name filter against the
+CustomerID point lookup used by ex2/ex2_query.
+
+    python benchmarks/bench_ex2_lookup.py --customers 1000000 --lookups 20
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+LEGACY_EX2_SQL = """
+    SELECT
+        (Customer.FirstName || ' ' || Customer.LastName) AS Name,
+        ROUND(SUM(Product.ProductUnitPrice * OrderDetail.QuantityOrdered), 2) AS Total
+    FROM
+        OrderDetail
+    JOIN
+        Customer ON OrderDetail.CustomerID = Customer.CustomerID
+    JOIN
+        Product ON OrderDetail.ProductID = Product.ProductID
+    WHERE
+        (Customer.FirstName || ' ' || Customer.LastName) = ?
+    GROUP BY
+        Customer.CustomerID
+    """
+
+
+def build_database(database_filename, customers, orders_per_customer, products=50, seed=0):
+    """
+    Write a normalized database with the given number of customers straight through SQL.
+    """
+    rnd = random.Random(seed)
+    conn = main.create_connection(database_filename, delete_db=True)
+    with main.bulk_load_settings(conn):
+        cur = conn.cursor()
+        for table_name in ('Region', 'Country', 'Customer', 'ProductCategory', 'Product', 'OrderDetail'):
+            cur.execute(main.TABLE_SCHEMAS[table_name])
+        cur.execute("INSERT INTO Region (Region) VALUES ('Region')")
+        cur.execute("INSERT INTO Country (Country, RegionID) VALUES ('Country', 1)")
+        cur.execute("INSERT INTO ProductCategory (ProductCategory, ProductCategoryDescription) VALUES ('Category', '')")
+        cur.executemany('INSERT INTO Product (ProductName, ProductUnitPrice, ProductCategoryID) VALUES (?, ?, 1)',
+                        [(f'Product {i}', round(rnd.uniform(1, 100), 2)) for i in range(products)])
+        main.insert_in_chunks(cur, 'INSERT INTO Customer (FirstName, LastName, Address, City, CountryID) '
+                                   'VALUES (?, ?, ?, ?, 1)',
+                              ((f'First{i}', f'Last{i}', f'{i} Main St', 'City') for i in range(customers)))
+        main.insert_in_chunks(cur, 'INSERT INTO OrderDetail (CustomerID, ProductID, OrderDate, QuantityOrdered) '
+                                   'VALUES (?, ?, ?, ?)',
+                              ((customer_id, rnd.randint(1, products), f'2014-{rnd.randint(1, 12):02d}-15',
+                                rnd.randint(1, 9))
+                               for customer_id in range(1, customers + 1) for _ in range(orders_per_customer)))
+        main.create_query_indexes(conn)
+    conn.close()
+
+
+def time_calls(function, names):
+    start = time.perf_counter()
+    results = [function(name) for name in names]
+    return (time.perf_counter() - start) / len(names), results
+
+
+def run_lookups(database_filename, names):
+    with main.QueryRunner(database_filename) as runner:
+        start = time.perf_counter()
+        runner.ex2(names[0])
+        print(f"Customer dictionary load: {time.perf_counter() - start:.3f}s (once per process)")
+
+        legacy_seconds, legacy_rows = time_calls(lambda name: runner.run(LEGACY_EX2_SQL, (name,)), names)
+        indexed_seconds, indexed_rows = time_calls(runner.ex2, names)
+
+    if legacy_rows != indexed_rows:
+        print("Result mismatch between the legacy and indexed ex2")
+        return 1
+    print(f"legacy ex2 (name expression): {legacy_seconds * 1000:.3f} ms/call")
+    print(f"indexed ex2 (CustomerID):     {indexed_seconds * 1000:.3f} ms/call")
+    print(f"speedup: {legacy_seconds / indexed_seconds:.0f}x")
+    return 0
+
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--customers', type=int, default=1000000)
+    parser.add_argument('--orders-per-customer', type=int, default=3)
+    parser.add_argument('--lookups', type=int, default=20)
+    parser.add_argument('--database', default=None, help='reuse or create this database file (kept afterwards)')
+    args = parser.parse_args()
+
+    database_filename = args.database or os.path.join(tempfile.mkdtemp(), 'bench_ex2.db')
+    if not os.path.exists(database_filename):
+        start = time.perf_counter()
+        build_database(database_filename, args.customers, args.orders_per_customer)
+        print(f"Built {args.customers} customers in {time.perf_counter() - start:.1f}s: {database_filename}")
+
+    rnd = random.Random(1)
+    names = [f'First{i} Last{i}' for i in rnd.sample(range(args.customers), args.lookups)]
+
+    try:
+        return run_lookups(database_filename, names)
+    finally:
+        if args.database is None:
+            os.remove(database_filename)
+
+
+if __name__ == '__main__':
+    sys.exit(main_benchmark())
@@ -0,0 +1,76 @@
+"""
+Compare the memory held by the parsed order lines: the former list of
+(customer, product, date, quantity) tuples against the OrderColumns store.
+
+    python benchmarks/bench_order_memory.py --lines 200000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from synthetic import write_source_file  # noqa: E402
+
+
+def legacy_orders(data_filename):
+    """
+    Build the order lines the way parse_lines did before OrderColumns.
+    """
+    orders = []
+    with open(data_filename, 'r') as file:
+        next(file)
+        for line in file:
+            data = line.strip().split('\t')
+            customer_name = data[0]
+            for product_name, quantity, order_date in zip(data[5].split(';'), data[9].split(';'),
+                                                          data[10].split(';')):
+                orders.append((customer_name, product_name, order_date, quantity))
+    return orders
+
+
+def columnar_orders(data_filename):
+    return main.parse_data_file(data_filename)['orders']
+
+
+def measure(build, data_filename):
+    """
+    Return (seconds, bytes still allocated by the result, peak bytes) for one build.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    orders = build(data_filename)
+    seconds = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, current, peak, len(orders)
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, default=200000)
+    parser.add_argument('--customers', type=int, default=5000)
+    parser.add_argument('--source', default=None, help='use this source file instead of a generated one')
+    args = parser.parse_args()
+
+    data_filename = args.source or os.path.join(tempfile.mkdtemp(), 'bench_orders.csv')
+    if args.source is None:
+        write_source_file(data_filename, args.lines, args.customers)
+
+    try:
+        for label, build in (('list of tuples', legacy_orders), ('OrderColumns', columnar_orders)):
+            seconds, current, peak, count = measure(build, data_filename)
+            print(f"{label:15} {count} orders: {current / 2 ** 20:8.1f} MiB held "
+                  f"({current / count:6.1f} B/order), peak {peak / 2 ** 20:8.1f} MiB, parsed in {seconds:.2f}s")
+    finally:
+        if args.source is None:
+            os.remove(data_filename)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_benchmark())
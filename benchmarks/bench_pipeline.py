@@ -0,0 +1,203 @@
+"""
+Time step1-step11 and ex1-ex11 on a synthetic source file and write the results as JSON,
+so runs on different commits can be diffed.
+
+    python benchmarks/bench_pipeline.py --lines 200000 --customers 5000 --output before.json
+    python benchmarks/bench_pipeline.py --lines 200000 --customers 5000 --output after.json --compare before.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from synthetic import write_source_file  # noqa: E402
+
+QUERY_NAMES = ['ex1', 'ex2', 'ex3', 'ex4', 'ex5', 'ex6', 'ex7', 'ex8', 'ex9', 'ex10', 'ex11']
+
+
+def pipeline_steps(data_filename, database_filename):
+    """
+    Return (name, callable) for step1 through step11 in order.
+    """
+    return [
+        ('step1', lambda: main.step1_create_region_table(data_filename, database_filename)),
+        ('step2', lambda: main.step2_create_region_to_regionid_dictionary(database_filename)),
+        ('step3', lambda: main.step3_create_country_table(data_filename, database_filename)),
+        ('step4', lambda: main.step4_create_country_to_countryid_dictionary(database_filename)),
+        ('step5', lambda: main.step5_create_customer_table(data_filename, database_filename)),
+        ('step6', lambda: main.step6_create_customer_to_customerid_dictionary(database_filename)),
+        ('step7', lambda: main.step7_create_productcategory_table(data_filename, database_filename)),
+        ('step8', lambda: main.step8_create_productcategory_to_productcategoryid_dictionary(database_filename)),
+        ('step9', lambda: main.step9_create_product_table(data_filename, database_filename)),
+        ('step10', lambda: main.step10_create_product_to_productid_dictionary(database_filename)),
+        ('step11', lambda: main.step11_create_orderdetail_table(data_filename, database_filename)),
+    ]
+
+
+def max_rss_kib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(function, trace_memory):
+    """
+    Run function once and return its timing record.
+    """
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    function()
+    record = {'seconds': time.perf_counter() - start}
+    if trace_memory:
+        record['peak_traced_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    record['max_rss_kib'] = max_rss_kib()
+    return record
+
+
+def run_query(database_filename, query_name, customer_name):
+    conn = main.create_connection(database_filename)
+    try:
+        sql_statement, parameters = main.export_query_statement(conn, query_name, customer_name)
+        return len(conn.execute(sql_statement, parameters).fetchall())
+    finally:
+        conn.close()
+
+
+def run_benchmark(args, work_directory):
+    data_filename = os.path.join(work_directory, 'data.csv')
+    database_filename = os.path.join(work_directory, 'normalized.db')
+
+    start = time.perf_counter()
+    write_source_file(data_filename, args.lines, args.customers, args.products, args.years, args.seed)
+    generate_seconds = time.perf_counter() - start
+
+    main.clear_parsed_data_cache()
+    steps = {}
+    for name, function in pipeline_steps(data_filename, database_filename):
+        steps[name] = measure(function, args.trace_memory)
+
+    conn = sqlite3.connect(database_filename)
+    customer_name = conn.execute("SELECT FirstName || ' ' || LastName FROM Customer ORDER BY CustomerID").fetchone()[0]
+    order_lines = conn.execute("SELECT COUNT(*) FROM OrderDetail").fetchone()[0]
+    conn.close()
+
+    queries = {}
+    for query_name in args.queries:
+        timings = []
+        for _ in range(args.repeat):
+            record = measure(lambda: run_query(database_filename, query_name, customer_name), args.trace_memory)
+            timings.append(record)
+        queries[query_name] = {
+            'seconds': min(record['seconds'] for record in timings),
+            'median_seconds': statistics.median(record['seconds'] for record in timings),
+            'rows': run_query(database_filename, query_name, customer_name),
+            'max_rss_kib': timings[-1]['max_rss_kib'],
+        }
+        if args.trace_memory:
+            queries[query_name]['peak_traced_bytes'] = max(record['peak_traced_bytes'] for record in timings)
+
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'source_bytes': os.path.getsize(data_filename),
+            'generate_seconds': generate_seconds,
+            'order_lines': order_lines,
+        },
+        'parameters': {
+            'lines': args.lines,
+            'customers': args.customers,
+            'products': args.products,
+            'years': args.years,
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'trace_memory': args.trace_memory,
+        },
+        'steps': steps,
+        'queries': queries,
+        'total_step_seconds': sum(record['seconds'] for record in steps.values()),
+        'peak_rss_kib': max_rss_kib(),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None, threshold=1.2, min_delta=0.005):
+    """
+    Print the timings; with a baseline, also the ratio to it, flagging slowdowns above
+    threshold that are also more than min_delta seconds.
+    """
+    for section in ('steps', 'queries'):
+        for name, record in results[section].items():
+            line = f"{name:8} {record['seconds'] * 1000:10.1f} ms"
+            old = (baseline or {}).get(section, {}).get(name)
+            if old and old['seconds']:
+                ratio = record['seconds'] / old['seconds']
+                regression = ratio > threshold and record['seconds'] - old['seconds'] > min_delta
+                line += f"  {ratio:5.2f}x" + ('  REGRESSION' if regression else '')
+            print(line)
+    print(f"steps total {results['total_step_seconds']:.2f}s, peak RSS {results['peak_rss_kib'] / 1024:.0f} MiB")
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, default=100000)
+    parser.add_argument('--customers', type=int, default=2000)
+    parser.add_argument('--products', type=int, default=50)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--queries', nargs='+', default=QUERY_NAMES)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per query; the minimum is reported')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='also record the tracemalloc peak per step and query (slows Python code down)')
+    parser.add_argument('--output', default='bench_pipeline.json')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    parser.add_argument('--threshold', type=float, default=1.2, help='slowdown ratio reported as a regression')
+    parser.add_argument('--min-delta-ms', type=float, default=5.0, help='ignore slowdowns smaller than this')
+    args = parser.parse_args()
+
+    work_directory = tempfile.mkdtemp()
+    try:
+        results = run_benchmark(args, work_directory)
+    finally:
+        shutil.rmtree(work_directory)
+
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2, sort_keys=True)
+        file.write('\n')
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if baseline.get('parameters') != results['parameters']:
+            print("Warning: the baseline was run with different parameters")
+    print_results(results, baseline, args.threshold, args.min_delta_ms / 1000)
+    print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_benchmark())
@@ -0,0 +1,93 @@
+"""
+Load generator for QueryService: fire requests at a fixed concurrency and report
+p50/p99 latency and QPS per exN query.
+
+    python benchmarks/bench_query_service.py --database normalized.db --requests 500 --concurrency 16
+    python benchmarks/bench_query_service.py --customers 100000      # generated database
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from bench_ex2_lookup import build_database  # noqa: E402
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+async def drive(service, query_name, names, requests, concurrency):
+    """
+    Run requests calls of one query from concurrency client tasks and return (latencies, seconds, errors).
+    """
+    latencies = []
+    errors = 0
+    pending = iter(range(requests))
+
+    async def client():
+        nonlocal errors
+        for i in pending:
+            start = time.perf_counter()
+            try:
+                await service.query(query_name, names[i % len(names)] if query_name in ('ex1', 'ex2') else None)
+            except (TimeoutError, sqlite3.Error):
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    return sorted(latencies), time.perf_counter() - start, errors
+
+
+async def run_load(args, names):
+    async with main.QueryService(args.database, pool_size=args.pool_size, max_concurrency=args.concurrency,
+                                 timeout=args.timeout) as service:
+        print(f"{'query':6} {'requests':>8} {'p50 ms':>9} {'p99 ms':>9} {'QPS':>9} {'errors':>6}")
+        for query_name in args.queries:
+            requests = args.requests if query_name in ('ex1', 'ex2') else max(1, args.requests // 10)
+            latencies, seconds, errors = await drive(service, query_name, names, requests, args.concurrency)
+            print(f"{query_name:6} {requests:8d} {percentile(latencies, 0.50) * 1000:9.2f} "
+                  f"{percentile(latencies, 0.99) * 1000:9.2f} {requests / seconds:9.1f} {errors:6d}")
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default=None, help='normalized database to query (default: generate one)')
+    parser.add_argument('--customers', type=int, default=20000, help='customers in the generated database')
+    parser.add_argument('--queries', nargs='+', default=['ex1', 'ex2', 'ex3'])
+    parser.add_argument('--requests', type=int, default=500, help='requests per customer query; aggregates get 1/10')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--pool-size', type=int, default=main.QUERY_SERVICE_POOL_SIZE)
+    parser.add_argument('--timeout', type=float, default=main.QUERY_SERVICE_TIMEOUT)
+    args = parser.parse_args()
+
+    generated = args.database is None
+    if generated:
+        args.database = os.path.join(tempfile.mkdtemp(), 'bench_service.db')
+        build_database(args.database, args.customers, orders_per_customer=5)
+
+    conn = main.create_connection(args.database)
+    names = [row[0] for row in conn.execute("SELECT FirstName || ' ' || LastName FROM Customer")]
+    conn.close()
+    random.Random(0).shuffle(names)
+
+    try:
+        asyncio.run(run_load(args, names))
+    finally:
+        if generated:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(args.database + suffix):
+                    os.remove(args.database + suffix)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_benchmark())
@@ -0,0 +1,63 @@
+"""
+Deterministic synthetic source files in the tab/semicolon format read by the normalization steps.
+The same arguments and seed always produce the same file.
+
+    python benchmarks/synthetic.py data.csv --customers 1000 --products 50 --lines 100000 --years 3
+"""
+import argparse
+import datetime
+import random
+import sys
+
+HEADER = ('Name\tAddress\tCity\tCountry\tRegion\tProductName\tProductCategory\tProductCategoryDescription\t'
+          'ProductUnitPrice\tQuantityOrderded\tOrderDate\n')
+
+REGIONS = 5
+COUNTRIES = 20
+CITIES = 100
+CATEGORIES = 8
+
+
+def write_source_file(data_filename, lines, customers, products=50, years=2, seed=0, max_orders_per_line=8,
+                      first_year=2012):
+    """
+    Write lines source lines for the given number of customers and products, with one to
+    max_orders_per_line orders per line dated across years calendar years from first_year.
+    Every customer keeps one address, country and region, and every product one category and price.
+    """
+    rnd = random.Random(seed)
+    first_day = datetime.date(first_year, 1, 1)
+    days = (datetime.date(first_year + years, 1, 1) - first_day).days
+    with open(data_filename, 'w') as file:
+        file.write(HEADER)
+        for _ in range(lines):
+            customer = rnd.randrange(customers)
+            country = customer % COUNTRIES
+            picked = [rnd.randrange(products) for _ in range(rnd.randint(1, max_orders_per_line))]
+            file.write('\t'.join([
+                f'First{customer} Last{customer}', f'{customer} Main St', f'City{customer % CITIES}',
+                f'Country{country}', f'Region{country % REGIONS}',
+                ';'.join(f'Product {p}' for p in picked),
+                ';'.join(f'Category{p % CATEGORIES}' for p in picked),
+                ';'.join(f'Description {p % CATEGORIES}' for p in picked),
+                ';'.join(f'{1 + p * 0.75:.2f}' for p in picked),
+                ';'.join(str(rnd.randint(1, 20)) for _ in picked),
+                ';'.join((first_day + datetime.timedelta(rnd.randrange(days))).strftime('%Y%m%d') for _ in picked),
+            ]) + '\n')
+
+
+def main_generate():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('output')
+    parser.add_argument('--lines', type=int, default=100000)
+    parser.add_argument('--customers', type=int, default=1000)
+    parser.add_argument('--products', type=int, default=50)
+    parser.add_argument('--years', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    write_source_file(args.output, args.lines, args.customers, args.products, args.years, args.seed)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_generate())
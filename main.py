@@ -5,17 +5,47 @@ import sqlite3
 from sqlite3 import Error
 import os
 import datetime
+import itertools
+import hashlib
+import time
+import contextlib
+import argparse
+import sys
+import concurrent.futures
+import mmap
+import locale
+import array
+import csv
+import json
+import gzip
+import bz2
+import lzma
+import asyncio
+import queue
+import threading
+import collections
+import functools
+import cProfile
+import pstats
+import tracemalloc
 
+try:
+    import numpy as np
+except ImportError:  # optional; only the columnar backend needs it
+    np = None
 
-def create_connection(db_file, delete_db=False):
+
+def create_connection(db_file, delete_db=False, cached_statements=128):
     """
     Create a database connection or delete and recreate it if specified.
+    cached_statements sets the size of the connection's prepared statement cache.
     """
     if delete_db and os.path.exists(db_file):
         os.remove(db_file)
+        invalidate_dimension_cache(db_file)
 
     try:
-        conn = sqlite3.connect(db_file)
+        conn = sqlite3.connect(db_file, cached_statements=cached_statements)
         conn.execute("PRAGMA foreign_keys = 1")
         return conn
     except Error as e:
@@ -26,156 +56,254 @@ def create_connection(db_file, delete_db=False):
 def create_table(conn, create_table_sql, drop_table_name=None):
     """
     Create a table using the provided SQL. Drop it first if the name is provided.
+    Errors are raised, so a failed rewrite is never reported as a successful load.
     """
-    try:
-        c = conn.cursor()
-        if drop_table_name:
+    c = conn.cursor()
+    if drop_table_name:
+        if conn.in_transaction:
+            # a commit here would split the caller's transaction, and PRAGMA foreign_keys is a
+            # no-op inside one; loads that drop referenced tables run under load_transaction
+            c.execute(f"DROP TABLE IF EXISTS {drop_table_name}")
+        else:
+            foreign_keys = c.execute("PRAGMA foreign_keys;").fetchone()[0]
             c.execute("PRAGMA foreign_keys = OFF;")
             c.execute(f"DROP TABLE IF EXISTS {drop_table_name}")
-            conn.commit()
-            c.execute("PRAGMA foreign_keys = ON;")
+            c.execute(f"PRAGMA foreign_keys = {foreign_keys};")
 
-        c.execute(create_table_sql)
-    except Error as e:
-        print(f"Error creating table: {e}")
+    c.execute(create_table_sql)
 
 
-def execute_sql_statement(sql_statement, conn):
+def execute_sql_statement(sql_statement, conn, parameters=(), query_name=None):
     """
-    Execute an SQL query and return the results.
+    Execute an SQL query and return the results. parameters are bound to ? placeholders.
+    query_name labels the query in instrumentation events.
     """
     try:
-        cur = conn.cursor()
-        cur.execute(sql_statement)
-        return cur.fetchall()
+        return run_query(conn, sql_statement, parameters, query_name)
     except Error as e:
         print(f"Error executing SQL statement: {e}")
         return []
 
 
-def step1_create_region_table(data_filename, normalized_database_filename):
+### Instrumentation
+
+QUERY_PROGRESS_INTERVAL = 1000
+PROFILE_TOP_FUNCTIONS = 20
+
+_event_listeners = []
+_profiling = {'cpu': False, 'memory': False}
+_phase_state = threading.local()
+# held by the one phase that is being profiled; cProfile and tracemalloc are process-wide
+_profiling_lock = threading.Lock()
+
+
+def add_event_listener(listener):
     """
-    Create the Region table, populating it with unique, sorted regions from the file.
+    Register a callable that receives every instrumentation event as a dict.
     """
-    # WRITE YOUR CODE HERE
-    conn = create_connection(normalized_database_filename)
-    if not conn:
-        print("Failed to connect.")
-        return
+    _event_listeners.append(listener)
+
+
+def remove_event_listener(listener):
+    _event_listeners.remove(listener)
 
+
+@contextlib.contextmanager
+def event_listener(listener):
+    """
+    Register a listener for the duration of a with block.
+    """
+    add_event_listener(listener)
     try:
-        regions = set()
-        with open(data_filename, 'r') as file:
-            next(file)
-            for line in file:
-                data = line.strip().split('\t')
-                region = data[4]
-                regions.add(region)
+        yield listener
+    finally:
+        remove_event_listener(listener)
 
-        sorted_regions = sorted(regions)
 
-        create_table_sql = '''
-        CREATE TABLE Region (
-            RegionID INTEGER PRIMARY KEY,
-            Region TEXT NOT NULL
-        );
-        '''
-        create_table(conn, create_table_sql, drop_table_name='Region')
+def json_lines_listener(file):
+    """
+    Return a listener that writes each event as one JSON line to an open text file.
+    """
+    def write_event(event):
+        file.write(json.dumps(event, default=str) + '\n')
+    return write_event
 
-        cur = conn.cursor()
-        cur.executemany('INSERT INTO Region (Region) VALUES (?)', [(region,) for region in sorted_regions])
 
-        conn.commit()
-        print("Region table task is successfull.")
-    except FileNotFoundError as e:
-        print(f"File not found: {e}")
-    except Error as e:
-        print(f"Error during operation: {e}")
-    finally:
-        conn.close()
+def emit_event(event):
+    for listener in list(_event_listeners):
+        listener(event)
 
 
-def step2_create_region_to_regionid_dictionary(normalized_database_filename):
-    # WRITE YOUR CODE HERE
-    conn = create_connection(normalized_database_filename)
-    cur = conn.cursor()
-    cur.execute("SELECT RegionID, Region FROM Region")
-    region_to_regionid_dict = {row[1]: row[0] for row in cur.fetchall()}
-    conn.close()
-    return region_to_regionid_dict
+def set_profiling(cpu=False, memory=False):
+    """
+    Opt in to profiling the outermost phase (a step, a load or a query): cpu=True runs it
+    under cProfile and adds the top functions to its event, memory=True adds the tracemalloc peak.
+    Only one phase in the process is profiled at a time. Phases that open on worker threads
+    while it runs, such as the pipeline branches, are timed but not profiled; the tracemalloc
+    peak of the profiled phase includes their allocations, its cProfile functions do not.
+    """
+    _profiling['cpu'] = cpu
+    _profiling['memory'] = memory
 
 
-def step3_create_country_table(data_filename, normalized_database_filename):
+def count(name, value=1):
     """
-    Create the Country table, associating countries with regions.
+    Add value to a counter of the innermost open phase; does nothing outside phases.
     """
-    # Inputs: Name of the data and normalized database filename
-    # Output: None
-    # WRITE YOUR CODE HERE
-    conn = create_connection(normalized_database_filename)
-    region_to_regionid_dict = step2_create_region_to_regionid_dictionary(normalized_database_filename)
+    stack = getattr(_phase_state, 'stack', None)
+    if stack:
+        counters = stack[-1]
+        counters[name] = counters.get(name, 0) + value
 
-    countries = set()
-    with open(data_filename, 'r') as file:
-        next(file)
-        for line in file:
-            data = line.strip().split('\t')
-            country, region = data[3], data[4]
-            countries.add((country, region))
 
-    sorted_countries = sorted(countries)
+def profile_summary(profiler, top=PROFILE_TOP_FUNCTIONS):
+    """
+    Return the top functions of a cProfile run by cumulative time as a list of dicts.
+    """
+    stats = pstats.Stats(profiler).stats
+    ranked = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+    return [{'function': f"{filename}:{line}({function_name})", 'calls': calls,
+             'own_seconds': own_seconds, 'cumulative_seconds': cumulative_seconds}
+            for (filename, line, function_name), (_, calls, own_seconds, cumulative_seconds, _) in ranked]
 
-    create_table_sql = '''
-    CREATE TABLE Country (
-        CountryID INTEGER PRIMARY KEY,
-        Country TEXT NOT NULL,
-        RegionID INTEGER NOT NULL,
-        FOREIGN KEY (RegionID) REFERENCES Region(RegionID)
-    );
-    '''
-    create_table(conn, create_table_sql, drop_table_name='Country')
 
-    cur = conn.cursor()
-    cur.executemany('INSERT INTO Country (Country, RegionID) VALUES (?, ?)',
-                    [(country, region_to_regionid_dict[region]) for country, region in sorted_countries])
+@contextlib.contextmanager
+def phase(name, **fields):
+    """
+    Time a block of the pipeline and emit a 'phase' event when it ends. The yielded dict
+    collects counters (rows, lines, ...) that are reported with the event. Phases nest and
+    the event's path joins the open phase names, e.g. step5/insert.
+    Without registered listeners the block runs untimed.
+    """
+    if not _event_listeners:
+        yield {}
+        return
 
-    conn.commit()
-    conn.close()
+    stack = _phase_state.__dict__.setdefault('stack', [])
+    names = _phase_state.__dict__.setdefault('names', [])
+    profiled = (not stack and (_profiling['cpu'] or _profiling['memory'])
+                and _profiling_lock.acquire(blocking=False))
+    profiler = cProfile.Profile() if profiled and _profiling['cpu'] else None
+    trace_memory = profiled and _profiling['memory']
+    started_tracing = False
+    if trace_memory:
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        else:
+            tracemalloc.start()
+            started_tracing = True
 
+    counters = {}
+    stack.append(counters)
+    names.append(name)
+    event = {'event': 'phase', 'name': name, 'path': '/'.join(names), 'timestamp': time.time()}
+    event.update(fields)
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield counters
+    except BaseException as e:
+        event['error'] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        event['seconds'] = time.perf_counter() - start
+        stack.pop()
+        names.pop()
+        event['counters'] = counters
+        if trace_memory:
+            event['peak_traced_bytes'] = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+        if profiler is not None:
+            event['profile'] = profile_summary(profiler)
+        if profiled:
+            _profiling_lock.release()
+        emit_event(event)
 
-def step4_create_country_to_countryid_dictionary(normalized_database_filename):
-    # WRITE YOUR CODE HERE
-    conn = create_connection(normalized_database_filename)
-    cur = conn.cursor()
-    cur.execute("SELECT CountryID, Country FROM Country")
-    country_to_countryid_dict = {row[1]: row[0] for row in cur.fetchall()}
-    conn.close()
-    return country_to_countryid_dict
 
+def instrumented(name):
+    """
+    Decorator that runs a pipeline function inside phase(name).
+    """
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
 
-def step5_create_customer_table(data_filename, normalized_database_filename):
+
+def run_query(conn, sql_statement, parameters=(), query_name=None, cursor=None):
     """
-    Create the Customer table, associating customers with countries.
+    Execute a statement (on cursor, or a new cursor of conn) and return all rows. With listeners
+    registered it runs inside a 'query' phase that reports execute/fetch time, rows, the traced
+    SQL and the number of SQLite VM steps counted through the progress handler.
     """
-    # WRITE YOUR CODE HERE
-    conn = create_connection(normalized_database_filename)
-    country_to_countryid_dict = step4_create_country_to_countryid_dictionary(normalized_database_filename)
+    cur = cursor if cursor is not None else conn.cursor()
+    if not _event_listeners:
+        cur.execute(sql_statement, parameters)
+        return cur.fetchall()
 
-    customers = set()
-    with open(data_filename, 'r') as file:
-        next(file)
-        for line in file:
-            data = line.strip().split('\t')
-            name_parts = data[0].split()
-            first_name = name_parts[0]
-            last_name = ' '.join(name_parts[1:]) if len(name_parts) > 1 else ''
-            address, city, country = data[1], data[2], data[3]
-            customers.add((first_name, last_name, address, city, country))
+    with phase('query', query=query_name) as counters:
+        progress_calls = [0]
+        traced = []
+
+        def on_progress():
+            progress_calls[0] += 1
+            return 0
+
+        conn.set_progress_handler(on_progress, QUERY_PROGRESS_INTERVAL)
+        conn.set_trace_callback(traced.append)
+        try:
+            start = time.perf_counter()
+            cur.execute(sql_statement, parameters)
+            executed = time.perf_counter()
+            rows = cur.fetchall()
+            counters['execute_seconds'] = executed - start
+            counters['fetch_seconds'] = time.perf_counter() - executed
+        finally:
+            conn.set_progress_handler(None, 0)
+            conn.set_trace_callback(None)
+        counters['rows'] = len(rows)
+        counters['vm_steps'] = progress_calls[0] * QUERY_PROGRESS_INTERVAL
+        counters['statements'] = len(traced)
+        if traced:
+            counters['sql'] = ' '.join(traced[0].split())[:500]
+    return rows
+
+
+### Normalization Engine
+
+ORDERDETAIL_CHUNK_SIZE = 50000
 
-    sorted_customers = sorted(customers, key=lambda x: (x[0], x[1]))
+# open() in text mode decodes with the locale encoding; the byte-level reader matches it
+SOURCE_ENCODING = locale.getpreferredencoding(False)
+MMAP_BLOCK_SIZE = 1 << 22
+# not available on Windows; there the mapped pages simply stay resident until the file is closed
+MMAP_RELEASE = getattr(mmap, 'MADV_DONTNEED', None)
+PARSE_SEGMENT_LIMIT = 1 << 14
 
-    create_table_sql = '''
-    CREATE TABLE Customer (
+TABLE_SCHEMAS = {
+    'Region': '''
+    CREATE TABLE IF NOT EXISTS Region (
+        RegionID INTEGER PRIMARY KEY,
+        Region TEXT NOT NULL
+    );
+    ''',
+    'Country': '''
+    CREATE TABLE IF NOT EXISTS Country (
+        CountryID INTEGER PRIMARY KEY,
+        Country TEXT NOT NULL,
+        RegionID INTEGER NOT NULL,
+        FOREIGN KEY (RegionID) REFERENCES Region(RegionID)
+    );
+    ''',
+    'Customer': '''
+    CREATE TABLE IF NOT EXISTS Customer (
         CustomerID INTEGER PRIMARY KEY,
         FirstName TEXT NOT NULL,
         LastName TEXT NOT NULL,
@@ -184,507 +312,2480 @@ def step5_create_customer_table(data_filename, normalized_database_filename):
         CountryID INTEGER NOT NULL,
         FOREIGN KEY (CountryID) REFERENCES Country(CountryID)
     );
-    '''
-    create_table(conn, create_table_sql, drop_table_name='Customer')
+    ''',
+    'ProductCategory': '''
+    CREATE TABLE IF NOT EXISTS ProductCategory (
+        ProductCategoryID INTEGER PRIMARY KEY,
+        ProductCategory TEXT NOT NULL,
+        ProductCategoryDescription TEXT NOT NULL
+    );
+    ''',
+    'Product': '''
+    CREATE TABLE IF NOT EXISTS Product (
+        ProductID INTEGER PRIMARY KEY,
+        ProductName TEXT NOT NULL,
+        ProductUnitPrice REAL NOT NULL,
+        ProductCategoryID INTEGER NOT NULL,
+        FOREIGN KEY (ProductCategoryID) REFERENCES ProductCategory(ProductCategoryID)
+    );
+    ''',
+    'OrderDetail': '''
+    CREATE TABLE IF NOT EXISTS OrderDetail (
+        OrderID INTEGER PRIMARY KEY,
+        CustomerID INTEGER NOT NULL,
+        ProductID INTEGER NOT NULL,
+        OrderDate TEXT NOT NULL,
+        QuantityOrdered INTEGER NOT NULL,
+        FOREIGN KEY (CustomerID) REFERENCES Customer(CustomerID),
+        FOREIGN KEY (ProductID) REFERENCES Product(ProductID)
+    );
+    ''',
+}
 
-    cur = conn.cursor()
-    cur.executemany('INSERT INTO Customer (FirstName, LastName, Address, City, CountryID) VALUES (?, ?, ?, ?, ?)',
-                    [(c[0], c[1], c[2], c[3], country_to_countryid_dict[c[4]]) for c in sorted_customers])
+_parsed_data_cache = {}
 
-    conn.commit()
-    conn.close()
 
+class OrderColumns:
+    """
+    Compact column store for the raw order lines between parsing and insertion.
+    Customer names, product names and dates are dictionary-encoded: every distinct value is
+    kept once and the lines hold small integer codes in array columns next to the quantities.
+    Iterating yields the same (customer, product, date, quantity) tuples as a list of orders.
+    """
+    __slots__ = ('customer_names', 'product_names', 'order_dates',
+                 'customer_codes', 'product_codes', 'date_codes', 'quantities', '_encoders')
 
-def step6_create_customer_to_customerid_dictionary(normalized_database_filename):
-    # WRITE YOUR CODE HERE
-    conn = create_connection(normalized_database_filename)
-    cur = conn.cursor()
-    cur.execute("SELECT CustomerID, FirstName, LastName FROM Customer")
-    customer_to_customerid_dict = {f"{row[1]} {row[2]}".strip(): row[0] for row in cur.fetchall()}
-    conn.close()
-    return customer_to_customerid_dict
+    def __init__(self):
+        self.customer_names = []
+        self.product_names = []
+        self.order_dates = []
+        self.customer_codes = array.array('I')
+        self.product_codes = array.array('I')
+        self.date_codes = array.array('I')
+        self.quantities = array.array('q')
+        self._encoders = ({}, {}, {})
 
+    def __len__(self):
+        return len(self.quantities)
 
-def step7_create_productcategory_table(data_filename, normalized_database_filename):
+    def __iter__(self):
+        customer_names, product_names, order_dates = self.customer_names, self.product_names, self.order_dates
+        for customer_code, product_code, date_code, quantity in zip(
+                self.customer_codes, self.product_codes, self.date_codes, self.quantities):
+            yield customer_names[customer_code], product_names[product_code], order_dates[date_code], quantity
+
+    def append_line(self, customer_name, product_names, quantities, order_dates):
+        """
+        Append the order lines of one source line: a customer and its ';'-split product,
+        quantity and date lists.
+        """
+        customer_encoder, product_encoder, date_encoder = self._encoders
+        customer_code = customer_encoder.get(customer_name)
+        if customer_code is None:
+            customer_code = customer_encoder[customer_name] = len(self.customer_names)
+            self.customer_names.append(customer_name)
+        for product_name, quantity, order_date in zip(product_names, quantities, order_dates):
+            product_code = product_encoder.get(product_name)
+            if product_code is None:
+                product_code = product_encoder[product_name] = len(self.product_names)
+                self.product_names.append(product_name)
+            date_code = date_encoder.get(order_date)
+            if date_code is None:
+                date_code = date_encoder[order_date] = len(self.order_dates)
+                self.order_dates.append(order_date)
+            self.customer_codes.append(customer_code)
+            self.product_codes.append(product_code)
+            self.date_codes.append(date_code)
+            self.quantities.append(int(quantity))
+
+    def extend(self, other):
+        """
+        Append every order line of another OrderColumns, re-encoding its codes.
+        """
+        customer_map = self._encode_all(0, self.customer_names, other.customer_names)
+        product_map = self._encode_all(1, self.product_names, other.product_names)
+        date_map = self._encode_all(2, self.order_dates, other.order_dates)
+        self.customer_codes.extend(customer_map[code] for code in other.customer_codes)
+        self.product_codes.extend(product_map[code] for code in other.product_codes)
+        self.date_codes.extend(date_map[code] for code in other.date_codes)
+        self.quantities.extend(other.quantities)
+
+    def _encode_all(self, column, values, new_values):
+        encoder = self._encoders[column]
+        codes = []
+        for value in new_values:
+            code = encoder.get(value)
+            if code is None:
+                code = encoder[value] = len(values)
+                values.append(value)
+            codes.append(code)
+        return codes
+
+    def iter_orderdetail_rows(self, customer_to_customerid_dict, product_to_productid_dict):
+        """
+        Yield OrderDetail rows; each distinct name and date is resolved or converted only once.
+        """
+        customer_ids = [customer_to_customerid_dict[name] for name in self.customer_names]
+        product_ids = [product_to_productid_dict[name] for name in self.product_names]
+        order_dates = [convert_order_date(order_date) for order_date in self.order_dates]
+        for customer_code, product_code, date_code, quantity in zip(
+                self.customer_codes, self.product_codes, self.date_codes, self.quantities):
+            yield customer_ids[customer_code], product_ids[product_code], order_dates[date_code], quantity
+
+
+def iter_source_lines(data_filename, start=None, end=None):
     """
-    Create the ProductCategory table.
+    Yield the data lines of the source file (without the header) as str.
+    The file is memory-mapped and cut into line-aligned blocks of about MMAP_BLOCK_SIZE bytes;
+    each block is decoded with a single call and split in place, so no per-line read or
+    decode is done. start/end restrict the scan to a line-aligned byte range.
     """
-    # Inputs: Name of the data and normalized database filename
-    # Output: None
-    # WRITE YOUR CODE HERE
-    conn = create_connection(normalized_database_filename)
+    with open(data_filename, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            position = mapped.find(b'\n') + 1 if start is None else start
+            end = len(mapped) if end is None else end
+            if position == 0:
+                return
+            while position < end:
+                block_end = mapped.rfind(b'\n', position, min(position + MMAP_BLOCK_SIZE, end)) + 1
+                if block_end <= position or position + MMAP_BLOCK_SIZE >= end:
+                    block_end = end
+                block_start = time.perf_counter()
+                lines = mapped[position:block_end].decode(SOURCE_ENCODING).split('\n')
+                if lines[-1] == '':
+                    lines.pop()
+                count('read_seconds', time.perf_counter() - block_start)
+                count('bytes_read', block_end - position)
+                yield from lines
+                if MMAP_RELEASE is not None:
+                    # drop the pages just read from the resident set, so RSS does not grow with the file
+                    release_start = position - position % mmap.PAGESIZE
+                    mapped.madvise(MMAP_RELEASE, release_start, block_end - release_start)
+                position = block_end
 
-    product_categories = set()
-    with open(data_filename, 'r') as file:
-        next(file)  # Skip header row
-        for line in file:
-            data = line.strip().split('\t')
-            categories = data[6].split(';')
-            descriptions = data[7].split(';')
-            for category, description in zip(categories, descriptions):
-                product_categories.add((category, description))
 
-    sorted_product_categories = sorted(product_categories)
+def parse_data_file(data_filename, include_orders=True, start=None, end=None):
+    """
+    Read the source file once, collecting every dimension set and the raw order lines.
+    With include_orders=False the order lines are skipped so they can be streamed separately.
+    """
+    return parse_lines(iter_source_lines(data_filename, start, end), include_orders)
 
-    create_table_sql = '''
-    CREATE TABLE ProductCategory (
-        ProductCategoryID INTEGER PRIMARY KEY,
-        ProductCategory TEXT NOT NULL,
-        ProductCategoryDescription TEXT NOT NULL
-    );
-    '''
-    create_table(conn, create_table_sql, drop_table_name='ProductCategory')
 
-    cur = conn.cursor()
-    cur.executemany('INSERT INTO ProductCategory (ProductCategory, ProductCategoryDescription) VALUES (?, ?)',
-                    sorted_product_categories)
+def parse_lines(lines, include_orders=True):
+    """
+    Collect the dimension sets and raw order lines from an iterable of source lines (no header).
+    The order lines are kept in an OrderColumns store. The distinct column groups are expanded
+    into the dimension sets every PARSE_SEGMENT_LIMIT groups, so without the orders memory
+    follows the number of dimension keys rather than the size of the file.
+    """
+    customer_segments = set()
+    product_segments = set()
+    parsed = None
+    orders = OrderColumns()
+    line_count = 0
 
-    conn.commit()
-    conn.close()
+    with phase('parse.lines') as counters:
+        for line_count, line in enumerate(lines, 1):
+            data = line.strip().split('\t')
+            customer_segments.add((data[0], data[1], data[2], data[3], data[4]))
+            product_segments.add((data[5], data[6], data[7], data[8]))
+            if include_orders:
+                orders.append_line(data[0], data[5].split(';'), data[9].split(';'), data[10].split(';'))
+            if len(product_segments) >= PARSE_SEGMENT_LIMIT or len(customer_segments) >= PARSE_SEGMENT_LIMIT:
+                parsed = expand_segments(customer_segments, product_segments, parsed)
+        counters['lines'] = line_count
+        counters['orders'] = len(orders)
 
+    parsed = expand_segments(customer_segments, product_segments, parsed)
+    parsed['orders'] = orders
+    return parsed
 
-def step8_create_productcategory_to_productcategoryid_dictionary(normalized_database_filename):
-    # WRITE YOUR CODE HERE
-    conn = create_connection(normalized_database_filename)
-    cur = conn.cursor()
-    cur.execute("SELECT ProductCategoryID, ProductCategory FROM ProductCategory")
-    productcategory_to_productcategoryid_dict = {row[1]: row[0] for row in cur.fetchall()}
-    conn.close()
-    return productcategory_to_productcategoryid_dict
+
+def expand_segments(customer_segments, product_segments, dimension_sets=None):
+    """
+    Add the collected column groups to the dimension sets and empty the group sets.
+    """
+    with phase('parse.dimensions') as counters:
+        dimension_sets = build_dimension_sets(customer_segments, product_segments, dimension_sets)
+        counters['customer_groups'] = len(customer_segments)
+        counters['product_groups'] = len(product_segments)
+    customer_segments.clear()
+    product_segments.clear()
+    return dimension_sets
 
 
-def step9_create_product_table(data_filename, normalized_database_filename):
+def build_dimension_sets(customer_segments, product_segments, dimension_sets=None):
     """
-    Create the Product table, associating products with categories.
+    Expand distinct (name, address, city, country, region) and (products, categories,
+    descriptions, prices) column groups into the dimension sets of the normalized tables.
+    With dimension_sets the values are added to those sets, which are returned.
     """
-    # WRITE YOUR CODE HERE
-    conn = create_connection(normalized_database_filename)
-    productcategory_to_productcategoryid_dict = step8_create_productcategory_to_productcategoryid_dictionary(
-        normalized_database_filename)
+    if dimension_sets is None:
+        dimension_sets = {
+            'regions': set(),
+            'countries': set(),
+            'customers': set(),
+            'product_categories': set(),
+            'products': set(),
+        }
+    regions = dimension_sets['regions']
+    countries = dimension_sets['countries']
+    customers = dimension_sets['customers']
+    product_categories = dimension_sets['product_categories']
+    products = dimension_sets['products']
 
-    products = set()
-    with open(data_filename, 'r') as file:
-        next(file)
-        for line in file:
-            data = line.strip().split('\t')
-            product_names = data[5].split(';')
-            categories = data[6].split(';')
-            prices = data[8].split(';')
-            for name, category, price in zip(product_names, categories, prices):
-                products.add((name, float(price), category))
+    for customer_name, address, city, country, region in customer_segments:
+        regions.add(region)
+        countries.add((country, region))
 
-    sorted_products = sorted(products, key=lambda x: x[0])
+        name_parts = customer_name.split()
+        first_name = name_parts[0]
+        last_name = ' '.join(name_parts[1:]) if len(name_parts) > 1 else ''
+        customers.add((first_name, last_name, address, city, country))
 
-    create_table_sql = '''
-    CREATE TABLE Product (
-        ProductID INTEGER PRIMARY KEY,
-        ProductName TEXT NOT NULL,
-        ProductUnitPrice REAL NOT NULL,
-        ProductCategoryID INTEGER NOT NULL,
-        FOREIGN KEY (ProductCategoryID) REFERENCES ProductCategory(ProductCategoryID)
-    );
-    '''
-    create_table(conn, create_table_sql, drop_table_name='Product')
+    for product_names, categories, descriptions, prices in product_segments:
+        categories = categories.split(';')
+        for category, description in zip(categories, descriptions.split(';')):
+            product_categories.add((category, description))
+        for name, category, price in zip(product_names.split(';'), categories, prices.split(';')):
+            products.add((name, float(price), category))
 
-    cur = conn.cursor()
-    cur.executemany('INSERT INTO Product (ProductName, ProductUnitPrice, ProductCategoryID) VALUES (?, ?, ?)',
-                    [(p[0], p[1], productcategory_to_productcategoryid_dict[p[2]]) for p in sorted_products])
+    return dimension_sets
 
-    conn.commit()
-    conn.close()
 
+def find_line_aligned_chunks(data_filename, chunk_count):
+    """
+    Split the data lines of the file (header excluded) into at most chunk_count byte ranges
+    whose boundaries fall on line starts. Returns a list of (start, end) offsets.
+    """
+    with open(data_filename, 'rb') as file:
+        file.readline()
+        data_start = file.tell()
+        file_size = os.fstat(file.fileno()).st_size
+        chunk_size = max(1, (file_size - data_start) // max(1, chunk_count))
 
-def step10_create_product_to_productid_dictionary(normalized_database_filename):
-    # WRITE YOUR CODE HERE
-    conn = create_connection(normalized_database_filename)
-    cur = conn.cursor()
-    cur.execute("SELECT ProductID, ProductName FROM Product")
-    product_to_productid_dict = {row[1]: row[0] for row in cur.fetchall()}
-    conn.close()
-    return product_to_productid_dict
+        boundaries = [data_start]
+        position = data_start + chunk_size
+        while position < file_size:
+            file.seek(position - 1)
+            file.readline()
+            position = file.tell()
+            if position >= file_size:
+                break
+            if position > boundaries[-1]:
+                boundaries.append(position)
+            position += chunk_size
+        boundaries.append(file_size)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
 
 
-def step11_create_orderdetail_table(data_filename, normalized_database_filename):
-    # WRITE YOUR CODE HERE
-    conn = create_connection(normalized_database_filename)
-    customer_to_customerid_dict = step6_create_customer_to_customerid_dictionary(normalized_database_filename)
-    product_to_productid_dict = step10_create_product_to_productid_dictionary(normalized_database_filename)
+def parse_byte_range(data_filename, start, end, include_orders=True):
+    """
+    Parse the lines between two line-aligned byte offsets.
+    Runs in the worker processes of parse_data_file_parallel.
+    """
+    return parse_data_file(data_filename, include_orders, start, end)
 
-    orders = []
-    with open(data_filename, 'r') as file:
-        next(file)
-        for line in file:
-            data = line.strip().split('\t')
-            customer_name = data[0]
-            product_names = data[5].split(';')
-            quantities = data[9].split(';')
-            order_dates = data[10].split(';')
-
-            for product_name, quantity, order_date in zip(product_names, quantities, order_dates):
-                orders.append((
-                    customer_to_customerid_dict[customer_name],
-                    product_to_productid_dict[product_name],
-                    datetime.datetime.strptime(order_date, '%Y%m%d').strftime('%Y-%m-%d'),
-                    int(quantity)
-                ))
-
-    create_table_sql = '''
-    CREATE TABLE OrderDetail (
-        OrderID INTEGER PRIMARY KEY,
-        CustomerID INTEGER NOT NULL,
-        ProductID INTEGER NOT NULL,
-        OrderDate TEXT NOT NULL,
-        QuantityOrdered INTEGER NOT NULL,
-        FOREIGN KEY (CustomerID) REFERENCES Customer(CustomerID),
-        FOREIGN KEY (ProductID) REFERENCES Product(ProductID)
-    );
-    '''
-    create_table(conn, create_table_sql, drop_table_name='OrderDetail')
 
-    cur = conn.cursor()
-    cur.executemany('INSERT INTO OrderDetail (CustomerID, ProductID, OrderDate, QuantityOrdered) VALUES (?, ?, ?, ?)',
-                    orders)
+def parse_data_file_parallel(data_filename, workers=None, include_orders=True):
+    """
+    Parse the source file in worker processes, one line-aligned byte range per task, and merge
+    the partial results. Order lines are concatenated in file order and every dimension table
+    is sorted before IDs are assigned, so the database is byte-identical to a serial load.
+    """
+    workers = workers or os.cpu_count() or 1
+    chunks = find_line_aligned_chunks(data_filename, workers * 4)
+    merged = {
+        'regions': set(),
+        'countries': set(),
+        'customers': set(),
+        'product_categories': set(),
+        'products': set(),
+        'orders': OrderColumns(),
+    }
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        partials = executor.map(parse_byte_range, itertools.repeat(data_filename),
+                                [start for start, end in chunks], [end for start, end in chunks],
+                                itertools.repeat(include_orders))
+        for partial in partials:
+            for key in ('regions', 'countries', 'customers', 'product_categories', 'products'):
+                merged[key] |= partial[key]
+            merged['orders'].extend(partial['orders'])
+    return merged
 
-    conn.commit()
-    conn.close()
 
+def parsed_data_cache_key(data_filename):
+    stat = os.stat(data_filename)
+    return os.path.abspath(data_filename), stat.st_mtime_ns, stat.st_size
 
-def ex1(conn, customer_name):
-    # Simply, you are fetching all the rows for a given CustomerName.
-    # Write an SQL statement that SELECTs From the OrderDetail table and joins with the Customer and Product table.
-    # Pull out the following columns.
-    # Name -- concatenation of FirstName and LastName
-    # ProductName
-    # OrderDate
-    # ProductUnitPrice
-    # QuantityOrdered
-    # Total -- which is calculated from multiplying ProductUnitPrice with QuantityOrdered -- round to two decimal places
-    # HINT: USE customer_to_customerid_dict to map customer name to customer id and then use where clause with CustomerID
-    # WRITE YOUR CODE HERE
-    customer_to_customerid = step6_create_customer_to_customerid_dictionary('normalized.db')
-    customer_id = customer_to_customerid.get(customer_name)
 
-    sql_statement = f"""
-    SELECT 
-        Customer.FirstName || ' ' || Customer.LastName AS Name, 
-        Product.ProductName, 
-        OrderDetail.OrderDate, 
-        Product.ProductUnitPrice, 
-        OrderDetail.QuantityOrdered, 
-        ROUND(Product.ProductUnitPrice * OrderDetail.QuantityOrdered, 2) AS Total
-    FROM 
-        OrderDetail
-    JOIN 
-        Customer ON OrderDetail.CustomerID = Customer.CustomerID
-    JOIN 
-        Product ON OrderDetail.ProductID = Product.ProductID
-    WHERE 
-        OrderDetail.CustomerID = {customer_id};
+def load_data_file(data_filename, include_orders=True):
     """
-    return sql_statement
+    Return the parsed source file, reusing the last parse while the file is unchanged on disk.
+    With include_orders=False a parse without the order lines is enough, and that is what is
+    made when nothing is cached, so the dimension steps never hold the orders in memory.
+    """
+    key = parsed_data_cache_key(data_filename)
+    with phase('parse') as counters:
+        cached = _parsed_data_cache.get(key)
+        counters['cached'] = cached is not None and (cached[0] or not include_orders)
+        if not counters['cached']:
+            _parsed_data_cache.clear()
+            _parsed_data_cache[key] = (include_orders, parse_data_file(data_filename, include_orders))
+    return _parsed_data_cache[key][1]
 
 
-def ex2(conn, CustomerName):
-    # Simply, you are summing the total for a given CustomerName.
-    # Write an SQL statement that SELECTs From the OrderDetail table and joins with the Customer and Product table.
-    # Pull out the following columns.
-    # Name -- concatenation of FirstName and LastName
-    # Total -- which is calculated from multiplying ProductUnitPrice with QuantityOrdered -- sum first and then round to two decimal places
-    # HINT: USE customer_to_customerid_dict to map customer name to customer id and then use where clause with CustomerID
-    # WRITE YOUR CODE HERE
+def cached_order_lines(data_filename):
+    """
+    Return the order lines of the cached parse of the source file, or None when the file is
+    not cached or was parsed without them.
+    """
+    cached = _parsed_data_cache.get(parsed_data_cache_key(data_filename))
+    return cached[1]['orders'] if cached is not None and cached[0] else None
 
-    sql_statement = f"""
-    SELECT 
-        (Customer.FirstName || ' ' || Customer.LastName) AS Name,
-        ROUND(SUM(Product.ProductUnitPrice * OrderDetail.QuantityOrdered), 2) AS Total
-    FROM 
-        OrderDetail
-    JOIN 
-        Customer ON OrderDetail.CustomerID = Customer.CustomerID
-    JOIN 
-        Product ON OrderDetail.ProductID = Product.ProductID
-    WHERE 
-        (Customer.FirstName || ' ' || Customer.LastName) = '{CustomerName}'
-    GROUP BY
-        Customer.CustomerID
+
+def clear_parsed_data_cache():
     """
-    return sql_statement
+    Drop the cached parse of the source file, releasing its order lines.
+    """
+    _parsed_data_cache.clear()
 
 
-def ex3(conn):
-    # Simply, find the total for all the customers
-    # Write an SQL statement that SELECTs From the OrderDetail table and joins with the Customer and Product table.
-    # Pull out the following columns.
-    # Name -- concatenation of FirstName and LastName
-    # Total -- which is calculated from multiplying ProductUnitPrice with QuantityOrdered -- sum first and then round to two decimal places
-    # ORDER BY Total Descending
-    # WRITE YOUR CODE HERE
-    sql_statement = """
-    SELECT 
-        (c.FirstName || ' ' || c.LastName) AS Name,
-        ROUND(SUM(p.ProductUnitPrice * od.QuantityOrdered), 2) AS Total
-    FROM 
-        OrderDetail od
-    JOIN 
-        Product p ON od.ProductID = p.ProductID
-    JOIN 
-        Customer c ON od.CustomerID = c.CustomerID
-    GROUP BY 
-        c.CustomerID
-    ORDER BY 
-        Total DESC
+def iter_order_lines(data_filename):
     """
-    return sql_statement
+    Yield the raw (customer, product, date, quantity) order lines straight from the source file.
+    """
+    for line in iter_source_lines(data_filename):
+        data = line.strip().split('\t')
+        customer_name, product_names, quantities, order_dates = data[0], data[5], data[9], data[10]
+        for product_name, quantity, order_date in zip(product_names.split(';'), quantities.split(';'),
+                                                      order_dates.split(';')):
+            yield customer_name, product_name, order_date, quantity
 
 
-def ex4(conn):
-    # Simply, find the total for all the region
-    # Write an SQL statement that SELECTs From the OrderDetail table and joins with the Customer, Product, Country, and
-    # Region tables.
-    # Pull out the following columns.
-    # Region
-    # Total -- which is calculated from multiplying ProductUnitPrice with QuantityOrdered -- sum first and then round to two decimal places
-    # ORDER BY Total Descending
-    # WRITE YOUR CODE HERE
-    sql_statement = """
-    SELECT 
-        r.Region,
-        ROUND(SUM(p.ProductUnitPrice * od.QuantityOrdered), 2) AS Total
-    FROM 
-        OrderDetail od
-    JOIN 
-        Product p ON od.ProductID = p.ProductID
-    JOIN 
-        Customer c ON od.CustomerID = c.CustomerID
-    JOIN 
-        Country co ON c.CountryID = co.CountryID
-    JOIN 
-        Region r ON co.RegionID = r.RegionID
-    GROUP BY 
-        r.RegionID
-    ORDER BY 
-        Total DESC
+_order_date_cache = {}
+
+
+def convert_order_date(order_date):
     """
-    return sql_statement
+    Convert a YYYYMMDD source date to the YYYY-MM-DD text stored in OrderDetail.OrderDate.
+    Only a handful of distinct dates occur, so each one is validated once and memoized.
+    Anything that is not eight ASCII digits with a four-digit year falls back to strptime,
+    which formats or rejects it exactly as before.
+    """
+    try:
+        return _order_date_cache[order_date]
+    except KeyError:
+        pass
+    if len(order_date) == 8 and order_date.isascii() and order_date.isdigit() and order_date[0] != '0':
+        converted = datetime.date(int(order_date[:4]), int(order_date[4:6]), int(order_date[6:])).isoformat()
+    else:
+        converted = datetime.datetime.strptime(order_date, '%Y%m%d').strftime('%Y-%m-%d')
+    _order_date_cache[order_date] = converted
+    return converted
 
 
-def ex5(conn):
-    # Simply, find the total for all the countries
-    # Write an SQL statement that SELECTs From the OrderDetail table and joins with the Customer, Product, and Country table.
-    # Pull out the following columns.
-    # Country
-    # Total -- which is calculated from multiplying ProductUnitPrice with QuantityOrdered -- sum first and then round
-    # ORDER BY Total Descending
-    # WRITE YOUR CODE HERE
+def iter_orderdetail_rows(orders, customer_to_customerid_dict, product_to_productid_dict):
+    """
+    Yield OrderDetail rows for the raw order lines, mapping names to their surrogate IDs.
+    """
+    if isinstance(orders, OrderColumns):
+        yield from orders.iter_orderdetail_rows(customer_to_customerid_dict, product_to_productid_dict)
+        return
+    date_cache = _order_date_cache
+    for customer_name, product_name, order_date, quantity in orders:
+        order_date = date_cache.get(order_date) or convert_order_date(order_date)
+        yield (
+            customer_to_customerid_dict[customer_name],
+            product_to_productid_dict[product_name],
+            order_date,
+            int(quantity)
+        )
 
-    sql_statement = """
-    SELECT 
-        Country.Country,
-        ROUND(SUM(Product.ProductUnitPrice * OrderDetail.QuantityOrdered), 0) AS Total
-    FROM 
-        OrderDetail
-    JOIN 
-        Customer ON OrderDetail.CustomerID = Customer.CustomerID
-    JOIN 
-        Product ON OrderDetail.ProductID = Product.ProductID
-    JOIN 
-        Country ON Customer.CountryID = Country.CountryID
-    GROUP BY 
-        Country.Country
-    ORDER BY 
-        Total DESC
+
+def insert_in_chunks(cur, insert_sql, rows, chunk_size=ORDERDETAIL_CHUNK_SIZE):
     """
+    Insert rows from any iterable in executemany batches of chunk_size and return the row count.
+    Only one batch is held in memory at a time; committing is left to the caller.
+    """
+    rows = iter(rows)
+    total = 0
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            break
+        cur.executemany(insert_sql, chunk)
+        total += len(chunk)
+        count('chunks')
+    return total
 
-    return sql_statement
 
+def write_region_table(conn, regions):
+    """
+    Recreate the Region table and return the Region to RegionID dictionary.
+    """
+    with phase('sort', table='Region'):
+        sorted_regions = sorted(regions)
 
-def ex6(conn):
-    # Rank the countries within a region based on order total
-    # Output Columns: Region, Country, CountryTotal, TotalRank
-    # Hint: Round the the total
-    # Hint: Sort ASC by Region
-    # WRITE YOUR CODE HERE
+    create_table(conn, TABLE_SCHEMAS['Region'], drop_table_name='Region')
 
-    sql_statement = """
-    WITH CountryTotals AS (
-        SELECT 
-            r.Region,
-            c.Country,
-            ROUND(SUM(od.QuantityOrdered * p.ProductUnitPrice)) AS CountryTotal
-        FROM 
-            OrderDetail od
-            JOIN Customer cu ON od.CustomerID = cu.CustomerID
-            JOIN Country c ON cu.CountryID = c.CountryID
-            JOIN Region r ON c.RegionID = r.RegionID
-            JOIN Product p ON od.ProductID = p.ProductID
-        GROUP BY 
-            r.Region, c.Country
-    )
-    SELECT 
-        Region,
-        Country,
-        CountryTotal,
-        RANK() OVER (PARTITION BY Region ORDER BY CountryTotal DESC) AS TotalRank
-    FROM 
-        CountryTotals
-    ORDER BY 
-        Region ASC, CountryTotal DESC
+    cur = conn.cursor()
+    with phase('insert', table='Region') as counters:
+        cur.executemany('INSERT INTO Region (Region) VALUES (?)', [(region,) for region in sorted_regions])
+        counters['rows'] = len(sorted_regions)
+    return {region: region_id for region_id, region in enumerate(sorted_regions, 1)}
+
+
+def write_country_table(conn, countries, region_to_regionid_dict):
     """
-    return sql_statement
+    Recreate the Country table and return the Country to CountryID dictionary.
+    """
+    with phase('sort', table='Country'):
+        sorted_countries = sorted(countries)
 
+    create_table(conn, TABLE_SCHEMAS['Country'], drop_table_name='Country')
 
-def ex7(conn):
-    # Rank the countries within a region based on order total, BUT only select the TOP country, meaning rank = 1!
-    # Output Columns: Region, Country, Total, TotalRank
-    # Hint: Round the the total
-    # Hint: Sort ASC by Region
-    # HINT: Use "WITH"
-    # WRITE YOUR CODE HERE
+    cur = conn.cursor()
+    with phase('insert', table='Country') as counters:
+        cur.executemany('INSERT INTO Country (Country, RegionID) VALUES (?, ?)',
+                        [(country, region_to_regionid_dict[region]) for country, region in sorted_countries])
+        counters['rows'] = len(sorted_countries)
+    create_query_indexes(conn, 'Country')
+    return {country: country_id for country_id, (country, region) in enumerate(sorted_countries, 1)}
 
-    sql_statement = """
-    WITH CountryTotals AS (
-        SELECT 
-            r.Region,
-            c.Country,
-            ROUND(SUM(od.QuantityOrdered * p.ProductUnitPrice)) AS CountryTotal,
-            RANK() OVER (PARTITION BY r.Region ORDER BY SUM(od.QuantityOrdered * p.ProductUnitPrice) DESC) AS CountryRegionalRank
-        FROM 
-            OrderDetail od
-            JOIN Customer cu ON od.CustomerID = cu.CustomerID
-            JOIN Country c ON cu.CountryID = c.CountryID
-            JOIN Region r ON c.RegionID = r.RegionID
-            JOIN Product p ON od.ProductID = p.ProductID
-        GROUP BY 
-            r.Region, c.Country
-    )
-    SELECT Region, Country, CountryTotal, CountryRegionalRank
-    FROM CountryTotals
-    WHERE CountryRegionalRank = 1
-    ORDER BY Region ASC
+
+def write_customer_table(conn, customers, country_to_countryid_dict):
     """
-    return sql_statement
+    Recreate the Customer table and return the Customer to CustomerID dictionary.
+    """
+    # Sorted by name; the remaining columns break ties so IDs never depend on set iteration order
+    with phase('sort', table='Customer'):
+        sorted_customers = sorted(customers)
 
+    create_table(conn, TABLE_SCHEMAS['Customer'], drop_table_name='Customer')
 
-def ex8(conn):
-    # Sum customer sales by Quarter and year
-    # Output Columns: Quarter,Year,CustomerID,Total
-    # HINT: Use "WITH"
-    # Hint: Round the the total
-    # HINT: YOU MUST CAST YEAR TO TYPE INTEGER!!!!
+    cur = conn.cursor()
+    with phase('insert', table='Customer') as counters:
+        cur.executemany('INSERT INTO Customer (FirstName, LastName, Address, City, CountryID) VALUES (?, ?, ?, ?, ?)',
+                        [(c[0], c[1], c[2], c[3], country_to_countryid_dict[c[4]]) for c in sorted_customers])
+        counters['rows'] = len(sorted_customers)
+    create_query_indexes(conn, 'Customer')
+    return {f"{c[0]} {c[1]}".strip(): customer_id for customer_id, c in enumerate(sorted_customers, 1)}
 
-    # WRITE YOUR CODE HERE
-    sql_statement = """
-    WITH CustomerSales AS (
-        SELECT 
-            CASE 
-                WHEN CAST(SUBSTR(od.OrderDate, 6, 2) AS INTEGER) IN (1, 2, 3) THEN 'Q1'
-                WHEN CAST(SUBSTR(od.OrderDate, 6, 2) AS INTEGER) IN (4, 5, 6) THEN 'Q2'
-                WHEN CAST(SUBSTR(od.OrderDate, 6, 2) AS INTEGER) IN (7, 8, 9) THEN 'Q3'
-                ELSE 'Q4'
-            END AS Quarter,
-            CAST(SUBSTR(od.OrderDate, 1, 4) AS INTEGER) AS Year,
-            od.CustomerID,
-            ROUND(SUM(od.QuantityOrdered * p.ProductUnitPrice)) AS Total
-        FROM 
-            OrderDetail od
-            JOIN Product p ON od.ProductID = p.ProductID
-        GROUP BY 
-            Quarter, Year, od.CustomerID
-    )
-    SELECT Quarter, Year, CustomerID, Total
-    FROM CustomerSales
-    ORDER BY Year, Quarter, CustomerID
+
+def write_productcategory_table(conn, product_categories):
     """
-    return sql_statement
+    Recreate the ProductCategory table and return the ProductCategory to ProductCategoryID dictionary.
+    """
+    with phase('sort', table='ProductCategory'):
+        sorted_product_categories = sorted(product_categories)
 
+    create_table(conn, TABLE_SCHEMAS['ProductCategory'], drop_table_name='ProductCategory')
 
-def ex9(conn):
-    # Rank the customer sales by Quarter and year, but only select the top 5 customers!
-    # Output Columns: Quarter, Year, CustomerID, Total
-    # HINT: Use "WITH"
-    # Hint: Round the the total
-    # HINT: YOU MUST CAST YEAR TO TYPE INTEGER!!!!
-    # HINT: You can have multiple CTE tables;
-    # WITH table1 AS (), table2 AS ()
-    # WRITE YOUR CODE HERE
+    cur = conn.cursor()
+    with phase('insert', table='ProductCategory') as counters:
+        cur.executemany('INSERT INTO ProductCategory (ProductCategory, ProductCategoryDescription) VALUES (?, ?)',
+                        sorted_product_categories)
+        counters['rows'] = len(sorted_product_categories)
+    return {category: category_id for category_id, (category, description) in enumerate(sorted_product_categories, 1)}
 
-    sql_statement = """
-    WITH CustomerSales AS (
-        SELECT 
-            CASE 
-                WHEN CAST(SUBSTR(od.OrderDate, 6, 2) AS INTEGER) IN (1, 2, 3) THEN 'Q1'
-                WHEN CAST(SUBSTR(od.OrderDate, 6, 2) AS INTEGER) IN (4, 5, 6) THEN 'Q2'
-                WHEN CAST(SUBSTR(od.OrderDate, 6, 2) AS INTEGER) IN (7, 8, 9) THEN 'Q3'
-                ELSE 'Q4'
-            END AS Quarter,
-            CAST(SUBSTR(od.OrderDate, 1, 4) AS INTEGER) AS Year,
-            od.CustomerID,
-            ROUND(SUM(od.QuantityOrdered * p.ProductUnitPrice)) AS Total
-        FROM 
-            OrderDetail od
-            JOIN Product p ON od.ProductID = p.ProductID
-        GROUP BY 
-            Quarter, Year, od.CustomerID
-    ),
-    RankedSales AS (
-        SELECT 
-            Quarter, 
-            Year, 
-            CustomerID, 
-            Total,
-            RANK() OVER (PARTITION BY Quarter, Year ORDER BY Total DESC) AS CustomerRank
-        FROM 
-            CustomerSales
-    )
-    SELECT Quarter, Year, CustomerID, Total, CustomerRank
-    FROM RankedSales
-    WHERE CustomerRank <= 5
-    ORDER BY Year, Quarter, CustomerRank
+
+def write_product_table(conn, products, productcategory_to_productcategoryid_dict):
     """
-    return sql_statement
+    Recreate the Product table and return the Product to ProductID dictionary.
+    """
+    with phase('sort', table='Product'):
+        sorted_products = sorted(products)
 
+    create_table(conn, TABLE_SCHEMAS['Product'], drop_table_name='Product')
 
-def ex10(conn):
-    # Rank the monthy sales
-    # Output Columns: Quarter, Year, CustomerID, Total
-    # HINT: Use "WITH"
-    # Hint: Round the the total
+    cur = conn.cursor()
+    with phase('insert', table='Product') as counters:
+        cur.executemany('INSERT INTO Product (ProductName, ProductUnitPrice, ProductCategoryID) VALUES (?, ?, ?)',
+                        [(p[0], p[1], productcategory_to_productcategoryid_dict[p[2]]) for p in sorted_products])
+        counters['rows'] = len(sorted_products)
+    return {p[0]: product_id for product_id, p in enumerate(sorted_products, 1)}
 
-    # WRITE YOUR CODE HERE
 
-    sql_statement = """
-    WITH MonthlySales AS (
-        SELECT 
-            SUM(ROUND(Product.ProductUnitPrice * OrderDetail.QuantityOrdered, 0)) AS Total,
-            CASE CAST(SUBSTR(OrderDetail.OrderDate, 6, 2) AS INTEGER)
-                WHEN 1 THEN 'January'
-                WHEN 2 THEN 'February'
-                WHEN 3 THEN 'March'
-                WHEN 4 THEN 'April'
-                WHEN 5 THEN 'May'
-                WHEN 6 THEN 'June'
-                WHEN 7 THEN 'July'
-                WHEN 8 THEN 'August'
-                WHEN 9 THEN 'September'
-                WHEN 10 THEN 'October'
-                WHEN 11 THEN 'November'
-                WHEN 12 THEN 'December'
-            END AS Month
-        FROM OrderDetail
-        JOIN Product ON OrderDetail.ProductID = Product.ProductID
-        GROUP BY Month
-    )
-    SELECT 
-        Month,
-        Total,
-        ROW_NUMBER() OVER (ORDER BY Total DESC) AS TotalRank
-    FROM MonthlySales
-    ORDER BY Total DESC
+def write_orderdetail_table(conn, orders, customer_to_customerid_dict, product_to_productid_dict,
+                            chunk_size=ORDERDETAIL_CHUNK_SIZE):
     """
-    return sql_statement
+    Recreate the OrderDetail table from the raw (customer, product, date, quantity) order lines.
+    orders may be an OrderColumns store, a list or a generator; rows are inserted chunk by chunk
+    in a single transaction.
+    """
+    create_table(conn, TABLE_SCHEMAS['OrderDetail'], drop_table_name='OrderDetail')
 
+    cur = conn.cursor()
+    with phase('insert', table='OrderDetail') as counters:
+        rows = insert_in_chunks(cur,
+                                'INSERT INTO OrderDetail (CustomerID, ProductID, OrderDate, QuantityOrdered) VALUES (?, ?, ?, ?)',
+                                iter_orderdetail_rows(orders, customer_to_customerid_dict, product_to_productid_dict),
+                                chunk_size)
+        counters['rows'] = rows
+    create_query_indexes(conn, 'OrderDetail')
+    return rows
 
-def ex11(conn):
+
+@contextlib.contextmanager
+def load_transaction(conn):
+    """
+    Run a load that rewrites several related tables over one connection as a single
+    transaction, DROP and CREATE included, so a failure at any point leaves the database as
+    it was. Foreign keys are switched off first: PRAGMA foreign_keys is a no-op inside a
+    transaction, so create_table cannot do it for a referenced table midway through. They
+    are verified once with PRAGMA foreign_key_check before the commit, the transaction is
+    rolled back if any row fails, and the previous setting is restored afterwards. Must be
+    entered outside of a transaction.
+    """
+    cur = conn.cursor()
+    foreign_keys = cur.execute("PRAGMA foreign_keys;").fetchone()[0]
+    cur.execute("PRAGMA foreign_keys = OFF;")
+    try:
+        # explicit, because sqlite3 does not open a transaction for the leading DROP TABLE
+        cur.execute("BEGIN")
+        yield conn
+        violations = cur.execute("PRAGMA foreign_key_check;").fetchall()
+        if violations:
+            raise sqlite3.IntegrityError(f"Foreign key check failed for {len(violations)} rows, first: {violations[0]}")
+        with phase('commit'):
+            conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        cur.execute(f"PRAGMA foreign_keys = {foreign_keys};")
+
+
+@contextlib.contextmanager
+def bulk_load_settings(conn):
+    """
+    Switch a connection to fast bulk-load settings and put the previous ones back afterwards.
+    The rollback journal is kept in memory and syncs are skipped. The load itself runs under
+    load_transaction, so it is still one transaction that is rolled back as a whole if any
+    step or the final foreign key check fails. Must be entered outside of a transaction.
+    """
+    cur = conn.cursor()
+    journal_mode = cur.execute("PRAGMA journal_mode;").fetchone()[0]
+    synchronous = cur.execute("PRAGMA synchronous;").fetchone()[0]
+
+    cur.execute("PRAGMA journal_mode = MEMORY;")
+    cur.execute("PRAGMA synchronous = OFF;")
+    try:
+        with load_transaction(conn):
+            yield conn
+    finally:
+        cur.execute(f"PRAGMA journal_mode = {journal_mode};")
+        cur.execute(f"PRAGMA synchronous = {synchronous};")
+
+
+def timed_write(load_stats, conn, table_name, write_function, *args):
+    """
+    Run a table writer, recording (rows inserted, seconds) for the table in load_stats.
+    """
+    start = time.perf_counter()
+    changes = conn.total_changes
+    with phase('write', table=table_name) as counters:
+        result = write_function(conn, *args)
+        rows = counters['rows'] = conn.total_changes - changes
+    load_stats[table_name] = (rows, time.perf_counter() - start)
+    return result
+
+
+def print_load_report(load_stats):
+    """
+    Print rows, seconds and rows/sec for every table of a load.
+    """
+    for table_name, (rows, seconds) in load_stats.items():
+        rows_per_second = rows / seconds if seconds else float('inf')
+        print(f"{table_name}: {rows} rows in {seconds:.3f}s ({rows_per_second:,.0f} rows/sec)")
+
+
+@instrumented('normalize')
+def normalize_data_file(data_filename, normalized_database_filename, stream_orders=False,
+                        chunk_size=ORDERDETAIL_CHUNK_SIZE, bulk=False, build_sales_fact=False, build_rollups=False,
+                        workers=None):
+    """
+    Build every normalized table from a single read of the source file.
+    With stream_orders=True the order lines are not kept in memory; a second pass streams them
+    into OrderDetail in chunks of chunk_size, keeping memory flat regardless of the file size.
+    The load runs under load_transaction, or bulk_load_settings with bulk=True, so tables of
+    an existing database can be rewritten in place. build_sales_fact=True and
+    build_rollups=True also build the SalesFact and rollup tables; once they exist they are
+    rebuilt on every later load. workers > 1 parses the file with parse_data_file_parallel.
+    Returns the per-table load stats.
+    """
+    conn = create_connection(normalized_database_filename)
+    if not conn:
+        print("Failed to connect.")
+        return
+
+    load_stats = {}
+    try:
+        with bulk_load_settings(conn) if bulk else load_transaction(conn):
+            if workers and workers > 1:
+                parsed = parse_data_file_parallel(data_filename, workers, include_orders=not stream_orders)
+            else:
+                parsed = parse_data_file(data_filename, include_orders=not stream_orders)
+            region_to_regionid_dict = timed_write(load_stats, conn, 'Region', write_region_table,
+                                                  parsed['regions'])
+            country_to_countryid_dict = timed_write(load_stats, conn, 'Country', write_country_table,
+                                                    parsed['countries'], region_to_regionid_dict)
+            customer_to_customerid_dict = timed_write(load_stats, conn, 'Customer', write_customer_table,
+                                                      parsed['customers'], country_to_countryid_dict)
+            productcategory_to_productcategoryid_dict = timed_write(load_stats, conn, 'ProductCategory',
+                                                                    write_productcategory_table,
+                                                                    parsed['product_categories'])
+            product_to_productid_dict = timed_write(load_stats, conn, 'Product', write_product_table,
+                                                    parsed['products'], productcategory_to_productcategoryid_dict)
+            orders = iter_order_lines(data_filename) if stream_orders else parsed['orders']
+            timed_write(load_stats, conn, 'OrderDetail', write_orderdetail_table,
+                        orders, customer_to_customerid_dict, product_to_productid_dict, chunk_size)
+            timed_write(load_stats, conn, 'LoadedSourceLine', write_loaded_line_table, data_filename)
+            if build_sales_fact or table_exists(conn, 'SalesFact'):
+                timed_write(load_stats, conn, 'SalesFact', write_sales_fact_table)
+            if build_rollups or table_exists(conn, 'CustomerTotal'):
+                timed_write(load_stats, conn, 'Rollups', write_rollup_tables)
+            clear_pipeline_state(conn)
+        refresh_order_partitions(normalized_database_filename)
+        print("Normalization task is successfull.")
+        print_load_report(load_stats)
+    except FileNotFoundError as e:
+        print(f"File not found: {e}")
+    except Error as e:
+        print(f"Error during operation: {e}")
+    finally:
+        conn.close()
+        invalidate_dimension_cache(normalized_database_filename)
+    return load_stats
+
+
+### Incremental Load
+
+LOADED_LINE_TABLE_SQL = '''
+CREATE TABLE IF NOT EXISTS LoadedSourceLine (
+    LineDigest BLOB NOT NULL,
+    Occurrence INTEGER NOT NULL,
+    PRIMARY KEY (LineDigest, Occurrence)
+) WITHOUT ROWID;
+'''
+
+SOURCE_LINE_COUNT_SQL = '''
+CREATE TEMP TABLE SourceLineCount (
+    LineDigest BLOB PRIMARY KEY,
+    Occurrences INTEGER NOT NULL
+) WITHOUT ROWID;
+'''
+
+COUNT_SOURCE_LINE_SQL = (
+    "INSERT INTO temp.SourceLineCount (LineDigest, Occurrences) VALUES (?, 1) "
+    "ON CONFLICT (LineDigest) DO UPDATE SET Occurrences = Occurrences + 1"
+)
+
+DIMENSION_LOOKUP_SQL = {
+    'Region': "SELECT RegionID, Region FROM Region",
+    'Country': "SELECT CountryID, Country FROM Country",
+    'Customer': "SELECT CustomerID, FirstName, LastName FROM Customer",
+    'ProductCategory': "SELECT ProductCategoryID, ProductCategory FROM ProductCategory",
+    'Product': "SELECT ProductID, ProductName FROM Product",
+}
+
+
+def read_dimension_dictionary(conn, table_name):
+    """
+    Read the key to surrogate ID dictionary of a dimension table over an open connection.
+    """
+    cur = conn.cursor()
+    cur.execute(DIMENSION_LOOKUP_SQL[table_name])
+    if table_name == 'Customer':
+        return {f"{row[1]} {row[2]}".strip(): row[0] for row in cur.fetchall()}
+    return {row[1]: row[0] for row in cur.fetchall()}
+
+
+def filter_new_lines(conn, lines):
+    """
+    Yield only the source lines that have not been loaded before, recording each new one.
+    Lines are identified by a SHA-1 digest and their occurrence number, the n-th copy of an
+    identical line in the source file, kept in the LoadedSourceLine primary key. Repeated
+    lines are therefore loaded as often as a full load would, and a lookup is a single index
+    probe that never rescans OrderDetail. Occurrences are counted in the temp.SourceLineCount
+    table set up by reset_source_line_counts.
+    """
+    cur = conn.cursor()
+    for line in lines:
+        digest = line_digest(line)
+        cur.execute(COUNT_SOURCE_LINE_SQL + " RETURNING Occurrences", (digest,))
+        occurrence = cur.fetchone()[0]
+        cur.execute('INSERT OR IGNORE INTO LoadedSourceLine (LineDigest, Occurrence) VALUES (?, ?)',
+                    (digest, occurrence))
+        if cur.rowcount == 1:
+            yield line
+
+
+def reset_source_line_counts(conn, data_filename=None, end=None):
+    """
+    Start counting source line occurrences afresh for a load over the connection. When a load
+    resumes at byte offset end of data_filename, the lines before it are counted first, so
+    the lines after it get the occurrence numbers they have in the whole file.
+    """
+    cur = conn.cursor()
+    cur.execute("DROP TABLE IF EXISTS temp.SourceLineCount")
+    cur.execute(SOURCE_LINE_COUNT_SQL)
+    if end is not None:
+        cur.executemany(COUNT_SOURCE_LINE_SQL,
+                        ((line_digest(line),) for line in iter_source_lines(data_filename, None, end)))
+
+
+def line_digest(line):
+    return hashlib.sha1(line.strip().encode('utf-8')).digest()
+
+
+def write_loaded_line_table(conn, data_filename):
+    """
+    Recreate LoadedSourceLine from the lines of a full load, so that a later incremental_load
+    appends exactly the lines the rebuilt OrderDetail does not hold. The checkpoints and
+    quarantined lines of resumable_load describe the replaced history and are cleared with it.
+    """
+    create_table(conn, LOADED_LINE_TABLE_SQL, drop_table_name='LoadedSourceLine')
+    cur = conn.cursor()
+    with phase('insert', table='LoadedSourceLine'):
+        occurrences = collections.Counter(line_digest(line) for line in iter_source_lines(data_filename))
+        # inserted in key order, the WITHOUT ROWID b-tree is appended to instead of split at random
+        cur.executemany('INSERT INTO LoadedSourceLine (LineDigest, Occurrence) VALUES (?, ?)',
+                        ((digest, occurrence) for digest in sorted(occurrences)
+                         for occurrence in range(1, occurrences[digest] + 1)))
+    for table_name in ('LoadCheckpoint', 'QuarantinedSourceLine'):
+        if table_exists(conn, table_name):
+            cur.execute(f"DELETE FROM {table_name}")
+
+
+def append_dimension_rows(conn, table_name, sorted_rows, key_of, insert_sql, params_of):
+    """
+    Insert the rows whose key is not in the table yet and return the updated key to ID dictionary.
+    Existing rows keep their surrogate IDs; new rows take the next IDs in sorted order.
+    """
+    key_to_id = read_dimension_dictionary(conn, table_name)
+    cur = conn.cursor()
+    for row in sorted_rows:
+        key = key_of(row)
+        if key not in key_to_id:
+            cur.execute(insert_sql, params_of(row))
+            key_to_id[key] = cur.lastrowid
+    return key_to_id
+
+
+def create_load_tables(conn):
+    """
+    Create the normalized tables, their query indexes and LoadedSourceLine if they are missing.
+    A LoadedSourceLine keyed on the digest alone is converted, each digest as its first occurrence.
+    """
+    cur = conn.cursor()
+    for table_name in ('Region', 'Country', 'Customer', 'ProductCategory', 'Product', 'OrderDetail'):
+        cur.execute(TABLE_SCHEMAS[table_name])
+    cur.execute("SELECT name FROM pragma_table_info('LoadedSourceLine')")
+    columns = {row[0] for row in cur.fetchall()}
+    if columns and 'Occurrence' not in columns:
+        cur.execute("ALTER TABLE LoadedSourceLine RENAME TO LoadedSourceDigest")
+        cur.execute(LOADED_LINE_TABLE_SQL)
+        cur.execute("INSERT INTO LoadedSourceLine (LineDigest, Occurrence) SELECT LineDigest, 1 FROM LoadedSourceDigest")
+        cur.execute("DROP TABLE LoadedSourceDigest")
+    cur.execute(LOADED_LINE_TABLE_SQL)
+    create_query_indexes(conn)
+
+
+def append_parsed_lines(conn, parsed, chunk_size=ORDERDETAIL_CHUNK_SIZE):
+    """
+    Append the dimension keys and order lines of parsed source lines and return the number of
+    new OrderDetail rows. SalesFact is brought up to date if it exists; committing is left to
+    the caller.
+    """
+    region_to_regionid_dict = append_dimension_rows(
+        conn, 'Region', sorted(parsed['regions']), lambda r: r,
+        'INSERT INTO Region (Region) VALUES (?)', lambda r: (r,))
+    country_to_countryid_dict = append_dimension_rows(
+        conn, 'Country', sorted(parsed['countries']), lambda c: c[0],
+        'INSERT INTO Country (Country, RegionID) VALUES (?, ?)',
+        lambda c: (c[0], region_to_regionid_dict[c[1]]))
+    customer_to_customerid_dict = append_dimension_rows(
+        conn, 'Customer', sorted(parsed['customers']),
+        lambda c: f"{c[0]} {c[1]}".strip(),
+        'INSERT INTO Customer (FirstName, LastName, Address, City, CountryID) VALUES (?, ?, ?, ?, ?)',
+        lambda c: (c[0], c[1], c[2], c[3], country_to_countryid_dict[c[4]]))
+    productcategory_to_productcategoryid_dict = append_dimension_rows(
+        conn, 'ProductCategory', sorted(parsed['product_categories']), lambda c: c[0],
+        'INSERT INTO ProductCategory (ProductCategory, ProductCategoryDescription) VALUES (?, ?)',
+        lambda c: c)
+    product_to_productid_dict = append_dimension_rows(
+        conn, 'Product', sorted(parsed['products']), lambda p: p[0],
+        'INSERT INTO Product (ProductName, ProductUnitPrice, ProductCategoryID) VALUES (?, ?, ?)',
+        lambda p: (p[0], p[1], productcategory_to_productcategoryid_dict[p[2]]))
+
+    new_orders = insert_in_chunks(
+        conn.cursor(),
+        'INSERT INTO OrderDetail (CustomerID, ProductID, OrderDate, QuantityOrdered) VALUES (?, ?, ?, ?)',
+        iter_orderdetail_rows(parsed['orders'], customer_to_customerid_dict, product_to_productid_dict),
+        chunk_size)
+    if table_exists(conn, 'SalesFact'):
+        refresh_sales_fact(conn)
+    return new_orders
+
+
+@instrumented('incremental_load')
+def incremental_load(data_filename, normalized_database_filename, chunk_size=ORDERDETAIL_CHUNK_SIZE):
+    """
+    Append a delta of source lines to the normalized database without rebuilding it.
+    Tables are created if missing, so the first run against an empty database performs the
+    initial load and records its lines. Only unseen lines are parsed into new dimension keys
+    and OrderDetail rows; everything is committed in one transaction.
+    """
+    conn = create_connection(normalized_database_filename)
+    if not conn:
+        print("Failed to connect.")
+        return 0
+
+    try:
+        create_load_tables(conn)
+        reset_source_line_counts(conn)
+        with open(data_filename, 'r') as file:
+            next(file)
+            parsed = parse_lines(filter_new_lines(conn, file))
+        new_orders = append_parsed_lines(conn, parsed, chunk_size)
+        clear_pipeline_state(conn)
+
+        with phase('commit'):
+            conn.commit()
+        refresh_order_partitions(normalized_database_filename)
+        print(f"Incremental load task is successfull: {new_orders} new order lines.")
+        return new_orders
+    except FileNotFoundError as e:
+        print(f"File not found: {e}")
+    except Error as e:
+        conn.rollback()
+        print(f"Error during operation: {e}")
+    finally:
+        conn.close()
+        invalidate_dimension_cache(normalized_database_filename)
+    return 0
+
+
+### Resumable Load
+
+LOAD_CHECKPOINT_BYTES = 1 << 24
+
+SOURCE_FIELD_COUNT = 11
+
+LOAD_CHECKPOINT_TABLE_SQL = '''
+CREATE TABLE IF NOT EXISTS LoadCheckpoint (
+    SourceFile TEXT PRIMARY KEY,
+    ByteOffset INTEGER NOT NULL,
+    LineNumber INTEGER NOT NULL
+);
+'''
+
+QUARANTINE_TABLE_SQL = '''
+CREATE TABLE IF NOT EXISTS QuarantinedSourceLine (
+    SourceFile TEXT NOT NULL,
+    LineNumber INTEGER NOT NULL,
+    Line TEXT NOT NULL,
+    Reason TEXT NOT NULL,
+    PRIMARY KEY (SourceFile, LineNumber)
+);
+'''
+
+
+def source_line_error(line):
+    """
+    Return why a source line cannot be loaded, or None if it is well-formed.
+    Covers what would otherwise abort a load or silently drop order lines: missing fields,
+    customer names that do not map back to their Customer key, ';' lists of different lengths
+    (zip would truncate them) and prices, quantities or dates that do not parse.
+    """
+    data = line.strip().split('\t')
+    if len(data) < SOURCE_FIELD_COUNT:
+        return f"expected {SOURCE_FIELD_COUNT} tab-separated fields, found {len(data)}"
+    customer_name = data[0]
+    if not customer_name or ' '.join(customer_name.split()) != customer_name:
+        return f"customer name {customer_name!r} does not match its Customer key"
+    products, categories, descriptions, prices, quantities, order_dates = (data[i].split(';') for i in range(5, 11))
+    lengths = [len(products), len(categories), len(descriptions), len(prices), len(quantities), len(order_dates)]
+    if len(set(lengths)) > 1:
+        return f"product, category, description, price, quantity and date lists differ in length: {lengths}"
+    for price in prices:
+        try:
+            float(price)
+        except ValueError:
+            return f"invalid price {price!r}"
+    for quantity in quantities:
+        try:
+            int(quantity)
+        except ValueError:
+            return f"invalid quantity {quantity!r}"
+    for order_date in order_dates:
+        try:
+            convert_order_date(order_date)
+        except ValueError:
+            return f"invalid order date {order_date!r}"
+    return None
+
+
+def iter_checkpoint_ranges(data_filename, start=None, checkpoint_bytes=LOAD_CHECKPOINT_BYTES):
+    """
+    Yield line-aligned (start, end) byte ranges of about checkpoint_bytes, from start (by
+    default the first data line) to the end of the file.
+    """
+    with open(data_filename, 'rb') as file:
+        if start is None:
+            file.readline()
+            start = file.tell()
+        file_size = os.fstat(file.fileno()).st_size
+        while start < file_size:
+            file.seek(start + max(1, checkpoint_bytes) - 1)
+            file.readline()
+            end = min(max(file.tell(), start + 1), file_size)
+            yield start, end
+            start = end
+
+
+def read_load_checkpoint(conn, data_filename):
+    """
+    Return the (byte offset, line number) to resume a load of the source file from, or
+    (None, 1) to start after the header. A checkpoint that no longer falls on a line start
+    of the file, e.g. because the file was replaced, is discarded together with the lines
+    quarantined under it.
+    """
+    source_file = os.path.abspath(data_filename)
+    cur = conn.cursor()
+    cur.execute("SELECT ByteOffset, LineNumber FROM LoadCheckpoint WHERE SourceFile = ?", (source_file,))
+    checkpoint = cur.fetchone()
+    if checkpoint is None:
+        return None, 1
+    byte_offset, line_number = checkpoint
+    with open(data_filename, 'rb') as file:
+        valid = 0 < byte_offset <= os.fstat(file.fileno()).st_size
+        if valid:
+            file.seek(byte_offset - 1)
+            valid = file.read(1) == b'\n'
+    if valid:
+        return byte_offset, line_number
+    print(f"Checkpoint of {data_filename} does not match the file any more; loading it from the start.")
+    cur.execute("DELETE FROM LoadCheckpoint WHERE SourceFile = ?", (source_file,))
+    cur.execute("DELETE FROM QuarantinedSourceLine WHERE SourceFile = ?", (source_file,))
+    return None, 1
+
+
+@instrumented('resumable_load')
+def resumable_load(data_filename, normalized_database_filename, checkpoint_bytes=LOAD_CHECKPOINT_BYTES,
+                   chunk_size=ORDERDETAIL_CHUNK_SIZE, restart=False):
+    """
+    Fault-tolerant incremental_load for long loads. Malformed lines are stored in
+    QuarantinedSourceLine with the reason instead of aborting the load, and the file is
+    committed in line-aligned batches of about checkpoint_bytes, each recording the byte
+    offset reached in LoadCheckpoint. Running it again after a crash or interruption resumes
+    from the last committed batch; lines appended to the file since are picked up the same
+    way. restart=True ignores the checkpoint. Lines are still deduplicated through
+    LoadedSourceLine, so rereading a range never duplicates orders.
+    Returns the number of new order lines.
+    """
+    conn = create_connection(normalized_database_filename)
+    if not conn:
+        raise Error(f"Failed to connect to {normalized_database_filename}")
+
+    source_file = os.path.abspath(data_filename)
+    new_orders = 0
+    quarantined_lines = 0
+    try:
+        cur = conn.cursor()
+        create_load_tables(conn)
+        cur.execute(LOAD_CHECKPOINT_TABLE_SQL)
+        cur.execute(QUARANTINE_TABLE_SQL)
+        if restart:
+            cur.execute("DELETE FROM LoadCheckpoint WHERE SourceFile = ?", (source_file,))
+            cur.execute("DELETE FROM QuarantinedSourceLine WHERE SourceFile = ?", (source_file,))
+        start, line_number = read_load_checkpoint(conn, data_filename)
+        reset_source_line_counts(conn, data_filename, start)
+        clear_pipeline_state(conn)
+        conn.commit()
+
+        for batch_start, batch_end in iter_checkpoint_ranges(data_filename, start, checkpoint_bytes):
+            with phase('checkpoint', start=batch_start, end=batch_end) as counters:
+                good_lines = []
+                quarantine_rows = []
+                for line_number, line in enumerate(iter_source_lines(data_filename, batch_start, batch_end),
+                                                   line_number + 1):
+                    reason = source_line_error(line)
+                    if reason is None:
+                        good_lines.append(line)
+                    else:
+                        quarantine_rows.append((source_file, line_number, line.strip(), reason))
+                cur.executemany('INSERT OR REPLACE INTO QuarantinedSourceLine (SourceFile, LineNumber, Line, Reason) '
+                                'VALUES (?, ?, ?, ?)', quarantine_rows)
+                parsed = parse_lines(filter_new_lines(conn, good_lines))
+                batch_orders = append_parsed_lines(conn, parsed, chunk_size)
+                cur.execute('INSERT OR REPLACE INTO LoadCheckpoint (SourceFile, ByteOffset, LineNumber) '
+                            'VALUES (?, ?, ?)', (source_file, batch_end, line_number))
+                with phase('commit'):
+                    conn.commit()
+                counters['orders'] = batch_orders
+                counters['quarantined'] = len(quarantine_rows)
+            new_orders += batch_orders
+            quarantined_lines += len(quarantine_rows)
+        refresh_order_partitions(normalized_database_filename)
+        print(f"Resumable load task is successfull: {new_orders} new order lines, "
+              f"{quarantined_lines} lines quarantined.")
+        return new_orders
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+        invalidate_dimension_cache(normalized_database_filename)
+
+
+### Dimension Cache
+
+_dimension_caches = {}
+
+
+class DimensionCache:
+    """
+    In-memory key to surrogate ID dictionaries for one normalized database file.
+    Each dictionary is read from SQLite once and served from memory under the data_version
+    stamp it was read with. The step that rewrites its table invalidates it, and a write from
+    another connection or process changes the stamp, so either way the next lookup reloads it.
+    hits and misses count lookups per table.
+    """
+
+    def __init__(self, normalized_database_filename):
+        self.normalized_database_filename = normalized_database_filename
+        self.dictionaries = {}
+        self.hits = {}
+        self.misses = {}
+
+    def get(self, table_name, conn=None):
+        """
+        Return the dictionary for a dimension table, loading it on the first request.
+        The dictionary is shared between callers and must be treated as read-only.
+        conn, an open connection to the same database, is read through instead of opening one.
+        """
+        # taken before the read, so a write that lands during it forces another reload
+        stamp = data_version(self.normalized_database_filename)
+        entry = self.dictionaries.get(table_name)
+        if entry is not None and entry[0] == stamp:
+            self.hits[table_name] = self.hits.get(table_name, 0) + 1
+            return entry[1]
+
+        self.misses[table_name] = self.misses.get(table_name, 0) + 1
+        if conn is not None:
+            dictionary = read_dimension_dictionary(conn, table_name)
+        else:
+            conn = create_connection(self.normalized_database_filename)
+            try:
+                dictionary = read_dimension_dictionary(conn, table_name)
+            finally:
+                conn.close()
+        self.dictionaries[table_name] = (stamp, dictionary)
+        return dictionary
+
+    def invalidate(self, table_name=None):
+        """
+        Drop the cached dictionary for one table, or for every table when no name is given.
+        """
+        if table_name is None:
+            self.dictionaries.clear()
+        else:
+            self.dictionaries.pop(table_name, None)
+
+    def stats(self):
+        """
+        Return the hit and miss counters per table.
+        """
+        return {'hits': dict(self.hits), 'misses': dict(self.misses)}
+
+
+def get_dimension_cache(normalized_database_filename):
+    """
+    Return the dimension cache attached to a database path, creating it on first use.
+    """
+    key = os.path.abspath(normalized_database_filename)
+    cache = _dimension_caches.get(key)
+    if cache is None:
+        cache = DimensionCache(normalized_database_filename)
+        _dimension_caches[key] = cache
+    return cache
+
+
+def invalidate_dimension_cache(normalized_database_filename, table_name=None):
+    """
+    Invalidate cached dictionaries after a table of the database has been rewritten.
+    Also bumps the data version, so cached query results of the database go stale.
+    """
+    cache = _dimension_caches.get(os.path.abspath(normalized_database_filename))
+    if cache is not None:
+        cache.invalidate(table_name)
+    bump_data_version(normalized_database_filename)
+
+
+def database_filename(conn):
+    """
+    Return the file of the main database of a connection, or '' for an in-memory database.
+    """
+    return conn.execute("PRAGMA database_list").fetchone()[2]
+
+
+def lookup_customer_id(conn, customer_name):
+    """
+    Return the CustomerID of a customer name in the database of conn, or None.
+    A database file is served from its DimensionCache, loaded over conn on the first lookup
+    and again whenever the data version of the file changes. Inside a transaction conn may
+    see writes that are not in the file yet, so the names are read through conn instead.
+    """
+    filename = database_filename(conn)
+    if not filename or conn.in_transaction:
+        return read_dimension_dictionary(conn, 'Customer').get(customer_name)
+    return get_dimension_cache(filename).get('Customer', conn).get(customer_name)
+
+
+### Query Indexes
+
+QUERY_INDEXES = {
+    'Country': [
+        "CREATE INDEX IF NOT EXISTS idx_Country_RegionID ON Country (RegionID)",
+    ],
+    'Customer': [
+        "CREATE INDEX IF NOT EXISTS idx_Customer_CountryID ON Customer (CountryID)",
+    ],
+    'OrderDetail': [
+        "CREATE INDEX IF NOT EXISTS idx_OrderDetail_CustomerID ON OrderDetail (CustomerID, OrderDate)",
+        "CREATE INDEX IF NOT EXISTS idx_OrderDetail_ProductID ON OrderDetail (ProductID)",
+    ],
+}
+
+
+def create_query_indexes(conn, table_name=None):
+    """
+    Create the secondary indexes used by ex1-ex11 for one table, or for every table.
+    The writers call this after their inserts so the indexes are built once, in bulk.
+    (CustomerID, OrderDate) serves the per-customer lookups of ex1/ex2 and covers the LAG
+    window of ex11; the other indexes back the foreign key joins. No ANALYZE is run, so the
+    full-table aggregates of ex3-ex10 keep their sequential scan of OrderDetail.
+    """
+    cur = conn.cursor()
+    table_names = [table_name] if table_name else list(QUERY_INDEXES)
+    for name in table_names:
+        with phase('index', table=name):
+            for create_index_sql in QUERY_INDEXES.get(name, []):
+                cur.execute(create_index_sql)
+
+
+def drop_query_indexes(conn):
+    """
+    Drop every index created by create_query_indexes.
+    """
+    cur = conn.cursor()
+    for create_index_sqls in QUERY_INDEXES.values():
+        for create_index_sql in create_index_sqls:
+            index_name = create_index_sql.split()[5]
+            cur.execute(f"DROP INDEX IF EXISTS {index_name}")
+
+
+def explain_query_plan(conn, sql_statement):
+    """
+    Return the EXPLAIN QUERY PLAN detail lines for an SQL statement.
+    """
+    cur = conn.cursor()
+    cur.execute(f"EXPLAIN QUERY PLAN {sql_statement}")
+    return [row[3] for row in cur.fetchall()]
+
+
+def query_plan_report(normalized_database_filename, customer_name=None):
+    """
+    Print EXPLAIN QUERY PLAN for ex1-ex11 without and with the query indexes.
+    The indexes are dropped for the "before" plans and recreated afterwards.
+    customer_name defaults to the first customer of the database.
+    """
+    conn = create_connection(normalized_database_filename)
+    if customer_name is None:
+        customer_name = min(read_dimension_dictionary(conn, 'Customer'))
+
+    sql_statements = {
+        'ex1': ex1(conn, customer_name),
+        'ex2': ex2(conn, customer_name),
+    }
+    for query in (ex3, ex4, ex5, ex6, ex7, ex8, ex9, ex10, ex11):
+        sql_statements[query.__name__] = query(conn)
+
+    report = {}
+    try:
+        drop_query_indexes(conn)
+        conn.commit()
+        before = {name: explain_query_plan(conn, sql) for name, sql in sql_statements.items()}
+        create_query_indexes(conn)
+        conn.commit()
+        after = {name: explain_query_plan(conn, sql) for name, sql in sql_statements.items()}
+    finally:
+        conn.close()
+
+    for name in sql_statements:
+        report[name] = {'before': before[name], 'after': after[name]}
+        print(f"{name}:")
+        print("    before: " + "\n            ".join(before[name]))
+        print("    after:  " + "\n            ".join(after[name]))
+    return report
+
+
+### Sales Fact
+
+SALES_FACT_SQL = '''
+CREATE TABLE IF NOT EXISTS SalesFact (
+    OrderID INTEGER PRIMARY KEY,
+    CustomerID INTEGER NOT NULL,
+    ProductID INTEGER NOT NULL,
+    OrderDate TEXT NOT NULL,
+    QuantityOrdered INTEGER NOT NULL,
+    LineTotal REAL NOT NULL,
+    Year INTEGER NOT NULL,
+    Quarter TEXT NOT NULL,
+    Month INTEGER NOT NULL,
+    FOREIGN KEY (OrderID) REFERENCES OrderDetail(OrderID),
+    FOREIGN KEY (CustomerID) REFERENCES Customer(CustomerID),
+    FOREIGN KEY (ProductID) REFERENCES Product(ProductID)
+);
+'''
+
+# OrderID follows the group columns so rows inside a group are summed in the same order as
+# a scan of OrderDetail, which keeps the rounded totals identical to the OrderDetail queries.
+# The customer/country/region rollups (ex3-ex7) scan SalesFact in OrderID order for the same reason.
+SALES_FACT_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_SalesFact_Quarter ON SalesFact (Year, Quarter, CustomerID, OrderID, LineTotal)",
+    "CREATE INDEX IF NOT EXISTS idx_SalesFact_Month ON SalesFact (Month, OrderID, LineTotal)",
+]
+
+
+def table_exists(conn, table_name):
+    """
+    Return True if the table exists in the database of the connection.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,))
+    return cur.fetchone() is not None
+
+
+def refresh_sales_fact(conn):
+    """
+    Append the OrderDetail rows that are not in SalesFact yet and return how many were added.
+    LineTotal and the date parts are computed here once instead of in every query.
+    """
+    cur = conn.cursor()
+    cur.execute('''
+    INSERT INTO SalesFact (OrderID, CustomerID, ProductID, OrderDate, QuantityOrdered,
+                           LineTotal, Year, Quarter, Month)
+    SELECT
+        od.OrderID,
+        od.CustomerID,
+        od.ProductID,
+        od.OrderDate,
+        od.QuantityOrdered,
+        p.ProductUnitPrice * od.QuantityOrdered,
+        CAST(SUBSTR(od.OrderDate, 1, 4) AS INTEGER),
+        'Q' || ((CAST(SUBSTR(od.OrderDate, 6, 2) AS INTEGER) + 2) / 3),
+        CAST(SUBSTR(od.OrderDate, 6, 2) AS INTEGER)
+    FROM
+        OrderDetail od
+        JOIN Product p ON od.ProductID = p.ProductID
+    WHERE
+        od.OrderID > (SELECT COALESCE(MAX(OrderID), 0) FROM SalesFact)
+    ORDER BY
+        od.OrderID
+    ''')
+    return cur.rowcount
+
+
+def write_sales_fact_table(conn):
+    """
+    Recreate the SalesFact table from OrderDetail and build its indexes afterwards.
+    """
+    create_table(conn, SALES_FACT_SQL, drop_table_name='SalesFact')
+    rows = refresh_sales_fact(conn)
+    cur = conn.cursor()
+    for create_index_sql in SALES_FACT_INDEXES:
+        cur.execute(create_index_sql)
+    return rows
+
+
+### Rollups
+
+ROLLUP_SCHEMAS = {
+    'CustomerTotal': '''
+    CREATE TABLE IF NOT EXISTS CustomerTotal (
+        CustomerID INTEGER PRIMARY KEY,
+        Total REAL NOT NULL
+    );
+    ''',
+    'CountryTotal': '''
+    CREATE TABLE IF NOT EXISTS CountryTotal (
+        CountryID INTEGER PRIMARY KEY,
+        Total REAL NOT NULL
+    );
+    ''',
+    'RegionTotal': '''
+    CREATE TABLE IF NOT EXISTS RegionTotal (
+        RegionID INTEGER PRIMARY KEY,
+        Total REAL NOT NULL
+    );
+    ''',
+    'CustomerQuarterTotal': '''
+    CREATE TABLE IF NOT EXISTS CustomerQuarterTotal (
+        Year INTEGER NOT NULL,
+        Quarter TEXT NOT NULL,
+        CustomerID INTEGER NOT NULL,
+        Total REAL NOT NULL,
+        PRIMARY KEY (Year, Quarter, CustomerID)
+    ) WITHOUT ROWID;
+    ''',
+    'MonthTotal': '''
+    CREATE TABLE IF NOT EXISTS MonthTotal (
+        Month INTEGER PRIMARY KEY,
+        Total REAL NOT NULL
+    );
+    ''',
+    'RegionCountryTotal': '''
+    CREATE TABLE IF NOT EXISTS RegionCountryTotal (
+        RegionID INTEGER NOT NULL,
+        CountryID INTEGER PRIMARY KEY,
+        Total REAL NOT NULL
+    );
+    ''',
+}
+
+# Leaderboard indexes: every partition of a ranking query kept in descending total order, so
+# the head of a ranking is an index range read instead of a regroup and sort of all rows.
+ROLLUP_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_RegionCountryTotal_Rank ON RegionCountryTotal (RegionID, Total DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_CustomerQuarterTotal_Rank ON CustomerQuarterTotal (Year, Quarter, Total DESC)",
+]
+
+# Full recomputation of every rollup from OrderDetail, used to build the tables and to check them.
+# MonthTotal sums the rounded line totals, matching ex10.
+ROLLUP_RECOMPUTE_SQL = {
+    'CustomerTotal': '''
+    SELECT od.CustomerID, SUM(p.ProductUnitPrice * od.QuantityOrdered)
+    FROM OrderDetail od NOT INDEXED
+    JOIN Product p ON od.ProductID = p.ProductID
+    GROUP BY od.CustomerID
+    ''',
+    'CountryTotal': '''
+    SELECT c.CountryID, SUM(p.ProductUnitPrice * od.QuantityOrdered)
+    FROM OrderDetail od NOT INDEXED
+    JOIN Product p ON od.ProductID = p.ProductID
+    JOIN Customer c ON od.CustomerID = c.CustomerID
+    GROUP BY c.CountryID
+    ''',
+    'RegionTotal': '''
+    SELECT co.RegionID, SUM(p.ProductUnitPrice * od.QuantityOrdered)
+    FROM OrderDetail od NOT INDEXED
+    JOIN Product p ON od.ProductID = p.ProductID
+    JOIN Customer c ON od.CustomerID = c.CustomerID
+    JOIN Country co ON c.CountryID = co.CountryID
+    GROUP BY co.RegionID
+    ''',
+    'CustomerQuarterTotal': '''
+    SELECT
+        CAST(SUBSTR(od.OrderDate, 1, 4) AS INTEGER) AS Year,
+        'Q' || ((CAST(SUBSTR(od.OrderDate, 6, 2) AS INTEGER) + 2) / 3) AS Quarter,
+        od.CustomerID,
+        SUM(p.ProductUnitPrice * od.QuantityOrdered)
+    FROM OrderDetail od NOT INDEXED
+    JOIN Product p ON od.ProductID = p.ProductID
+    GROUP BY Year, Quarter, od.CustomerID
+    ''',
+    'MonthTotal': '''
+    SELECT CAST(SUBSTR(od.OrderDate, 6, 2) AS INTEGER) AS Month, SUM(ROUND(p.ProductUnitPrice * od.QuantityOrdered, 0))
+    FROM OrderDetail od NOT INDEXED
+    JOIN Product p ON od.ProductID = p.ProductID
+    GROUP BY Month
+    ''',
+    'RegionCountryTotal': '''
+    SELECT co.RegionID, c.CountryID, SUM(p.ProductUnitPrice * od.QuantityOrdered)
+    FROM OrderDetail od NOT INDEXED
+    JOIN Product p ON od.ProductID = p.ProductID
+    JOIN Customer c ON od.CustomerID = c.CustomerID
+    JOIN Country co ON c.CountryID = co.CountryID
+    GROUP BY c.CountryID
+    ''',
+}
+
+# Keeps every rollup current as OrderDetail rows are appended. OrderDetail is recreated by full
+# loads, which drops the trigger; write_rollup_tables rebuilds the rollups and recreates it.
+ROLLUP_TRIGGER_SQL = '''
+CREATE TRIGGER IF NOT EXISTS trg_OrderDetail_Rollups AFTER INSERT ON OrderDetail
+BEGIN
+    INSERT INTO CustomerTotal (CustomerID, Total)
+    VALUES (NEW.CustomerID, (SELECT ProductUnitPrice FROM Product WHERE ProductID = NEW.ProductID) * NEW.QuantityOrdered)
+    ON CONFLICT (CustomerID) DO UPDATE SET Total = Total + excluded.Total;
+
+    INSERT INTO CountryTotal (CountryID, Total)
+    VALUES ((SELECT CountryID FROM Customer WHERE CustomerID = NEW.CustomerID),
+            (SELECT ProductUnitPrice FROM Product WHERE ProductID = NEW.ProductID) * NEW.QuantityOrdered)
+    ON CONFLICT (CountryID) DO UPDATE SET Total = Total + excluded.Total;
+
+    INSERT INTO RegionTotal (RegionID, Total)
+    VALUES ((SELECT co.RegionID FROM Customer c JOIN Country co ON c.CountryID = co.CountryID
+             WHERE c.CustomerID = NEW.CustomerID),
+            (SELECT ProductUnitPrice FROM Product WHERE ProductID = NEW.ProductID) * NEW.QuantityOrdered)
+    ON CONFLICT (RegionID) DO UPDATE SET Total = Total + excluded.Total;
+
+    INSERT INTO CustomerQuarterTotal (Year, Quarter, CustomerID, Total)
+    VALUES (CAST(SUBSTR(NEW.OrderDate, 1, 4) AS INTEGER),
+            'Q' || ((CAST(SUBSTR(NEW.OrderDate, 6, 2) AS INTEGER) + 2) / 3),
+            NEW.CustomerID,
+            (SELECT ProductUnitPrice FROM Product WHERE ProductID = NEW.ProductID) * NEW.QuantityOrdered)
+    ON CONFLICT (Year, Quarter, CustomerID) DO UPDATE SET Total = Total + excluded.Total;
+
+    INSERT INTO MonthTotal (Month, Total)
+    VALUES (CAST(SUBSTR(NEW.OrderDate, 6, 2) AS INTEGER),
+            ROUND((SELECT ProductUnitPrice FROM Product WHERE ProductID = NEW.ProductID) * NEW.QuantityOrdered, 0))
+    ON CONFLICT (Month) DO UPDATE SET Total = Total + excluded.Total;
+
+    INSERT INTO RegionCountryTotal (RegionID, CountryID, Total)
+    SELECT co.RegionID, co.CountryID,
+           (SELECT ProductUnitPrice FROM Product WHERE ProductID = NEW.ProductID) * NEW.QuantityOrdered
+    FROM Customer c JOIN Country co ON c.CountryID = co.CountryID
+    WHERE c.CustomerID = NEW.CustomerID
+    ON CONFLICT (CountryID) DO UPDATE SET Total = Total + excluded.Total;
+END;
+'''
+
+# Per-customer order gaps for ex11: the first and last order dates, and the widest gap between
+# consecutive order dates with the dates that bound it. MaxDaysWithoutOrder stays NULL until a
+# customer has a second order.
+ORDER_GAP_TABLE_SQL = '''
+CREATE TABLE IF NOT EXISTS CustomerOrderGap (
+    CustomerID INTEGER PRIMARY KEY,
+    FirstOrderDate TEXT NOT NULL,
+    LastOrderDate TEXT NOT NULL,
+    MaxDaysWithoutOrder REAL,
+    OrderDate TEXT,
+    PreviousOrderDate TEXT
+);
+'''
+
+# The same LAG window as ex11; among equal gaps it keeps the earliest, as MAX() does there.
+# {where} restricts it to one customer inside the trigger (which cannot use WITH).
+ORDER_GAP_RECOMPUTE_SQL = '''
+    SELECT CustomerID, FirstOrderDate, LastOrderDate, DaysBetweenOrders, OrderDate, PreviousOrderDate
+    FROM (
+        SELECT
+            CustomerID,
+            OrderDate,
+            PreviousOrderDate,
+            JULIANDAY(OrderDate) - JULIANDAY(PreviousOrderDate) AS DaysBetweenOrders,
+            MIN(OrderDate) OVER (PARTITION BY CustomerID) AS FirstOrderDate,
+            MAX(OrderDate) OVER (PARTITION BY CustomerID) AS LastOrderDate,
+            ROW_NUMBER() OVER (
+                PARTITION BY CustomerID
+                ORDER BY JULIANDAY(OrderDate) - JULIANDAY(PreviousOrderDate) DESC NULLS LAST, OrderDate, OrderID
+            ) AS GapRank
+        FROM (
+            SELECT
+                CustomerID,
+                OrderDate,
+                OrderID,
+                LAG(OrderDate) OVER (PARTITION BY CustomerID ORDER BY OrderDate, OrderID) AS PreviousOrderDate
+            FROM OrderDetail
+            {where}
+        )
+    )
+    WHERE GapRank = 1
+'''
+
+# A new order date past either end of a customer's orders adds one gap at that end; a date inside
+# the widest gap splits it, and only then is the customer recomputed from OrderDetail (an index
+# range on idx_OrderDetail_CustomerID). A date anywhere else only narrows a smaller gap.
+ORDER_GAP_SPLIT_WHERE = '''WHERE CustomerID = NEW.CustomerID
+            AND EXISTS (SELECT 1 FROM CustomerOrderGap g
+                        WHERE g.CustomerID = NEW.CustomerID
+                        AND NEW.OrderDate > g.PreviousOrderDate AND NEW.OrderDate < g.OrderDate)'''
+ORDER_GAP_TRIGGER_SQL = f'''
+CREATE TRIGGER IF NOT EXISTS trg_OrderDetail_OrderGap AFTER INSERT ON OrderDetail
+BEGIN
+    INSERT OR REPLACE INTO CustomerOrderGap
+    {ORDER_GAP_RECOMPUTE_SQL.format(where=ORDER_GAP_SPLIT_WHERE)};
+
+    UPDATE CustomerOrderGap
+    SET MaxDaysWithoutOrder = JULIANDAY(NEW.OrderDate) - JULIANDAY(LastOrderDate),
+        OrderDate = NEW.OrderDate,
+        PreviousOrderDate = LastOrderDate
+    WHERE CustomerID = NEW.CustomerID AND NEW.OrderDate >= LastOrderDate
+    AND (MaxDaysWithoutOrder IS NULL OR JULIANDAY(NEW.OrderDate) - JULIANDAY(LastOrderDate) > MaxDaysWithoutOrder);
+
+    UPDATE CustomerOrderGap
+    SET MaxDaysWithoutOrder = JULIANDAY(FirstOrderDate) - JULIANDAY(NEW.OrderDate),
+        OrderDate = FirstOrderDate,
+        PreviousOrderDate = NEW.OrderDate
+    WHERE CustomerID = NEW.CustomerID AND NEW.OrderDate < FirstOrderDate
+    AND (MaxDaysWithoutOrder IS NULL OR JULIANDAY(FirstOrderDate) - JULIANDAY(NEW.OrderDate) >= MaxDaysWithoutOrder);
+
+    UPDATE CustomerOrderGap
+    SET FirstOrderDate = MIN(FirstOrderDate, NEW.OrderDate), LastOrderDate = MAX(LastOrderDate, NEW.OrderDate)
+    WHERE CustomerID = NEW.CustomerID;
+
+    INSERT OR IGNORE INTO CustomerOrderGap (CustomerID, FirstOrderDate, LastOrderDate)
+    VALUES (NEW.CustomerID, NEW.OrderDate, NEW.OrderDate);
+END;
+'''
+
+
+def write_order_gap_table(conn):
+    """
+    Recreate CustomerOrderGap from OrderDetail and install the trigger that maintains it.
+    """
+    cur = conn.cursor()
+    create_table(conn, ORDER_GAP_TABLE_SQL, drop_table_name='CustomerOrderGap')
+    cur.execute(f"INSERT INTO CustomerOrderGap {ORDER_GAP_RECOMPUTE_SQL.format(where='')}")
+    cur.execute(ORDER_GAP_TRIGGER_SQL)
+    return cur.execute("SELECT COUNT(*) FROM CustomerOrderGap").fetchone()[0]
+
+
+def write_rollup_tables(conn):
+    """
+    Recreate every rollup table, CustomerOrderGap included, from OrderDetail and install the
+    triggers that maintain them.
+    """
+    cur = conn.cursor()
+    for table_name, create_table_sql in ROLLUP_SCHEMAS.items():
+        create_table(conn, create_table_sql, drop_table_name=table_name)
+        cur.execute(f"INSERT INTO {table_name} {ROLLUP_RECOMPUTE_SQL[table_name]}")
+    for create_index_sql in ROLLUP_INDEXES:
+        cur.execute(create_index_sql)
+    cur.execute(ROLLUP_TRIGGER_SQL)
+    rows = sum(cur.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0] for table_name in ROLLUP_SCHEMAS)
+    return rows + write_order_gap_table(conn)
+
+
+def rebuild_rollups(normalized_database_filename):
+    """
+    Rebuild every rollup table from scratch in an existing normalized database.
+    Returns the number of rollup rows written.
+    """
+    conn = create_connection(normalized_database_filename)
+    try:
+        rows = write_rollup_tables(conn)
+        with phase('commit'):
+            conn.commit()
+    finally:
+        conn.close()
+    bump_data_version(normalized_database_filename)
+    print(f"Rollups rebuilt: {rows} rows.")
+    return rows
+
+
+def check_rollups(normalized_database_filename, tolerance=1e-6):
+    """
+    Verify every rollup table against a full recomputation from OrderDetail.
+    Returns {rollup: [(key, stored total, recomputed total), ...]} holding only mismatches,
+    so an empty list for every rollup means the rollups are consistent. CustomerOrderGap is
+    checked by check_order_gaps. Returns None if the database has no rollups.
+    """
+    conn = create_connection(normalized_database_filename)
+    cur = conn.cursor()
+    mismatches = {}
+    try:
+        if not table_exists(conn, 'CustomerTotal'):
+            print(f"No rollups in this database: {normalized_database_filename} (build them with rebuild-rollups)")
+            return None
+        for table_name in ROLLUP_SCHEMAS:
+            stored = {row[:-1]: row[-1] for row in cur.execute(f"SELECT * FROM {table_name}").fetchall()}
+            recomputed = {row[:-1]: row[-1] for row in cur.execute(ROLLUP_RECOMPUTE_SQL[table_name]).fetchall()}
+            mismatches[table_name] = [
+                (key, stored.get(key), recomputed.get(key))
+                for key in sorted(set(stored) | set(recomputed))
+                if stored.get(key) is None or recomputed.get(key) is None
+                or abs(stored[key] - recomputed[key]) > tolerance
+            ]
+        mismatches['CustomerOrderGap'] = check_order_gaps(conn)
+        mismatches['Leaderboards'] = check_leaderboards(conn)
+    finally:
+        conn.close()
+
+    for table_name, rows in mismatches.items():
+        print(f"{table_name}: {'OK' if not rows else f'{len(rows)} mismatched keys, first: {rows[0]}'}")
+    return mismatches
+
+
+def check_order_gaps(conn):
+    """
+    Verify CustomerOrderGap against the LAG window recomputed from OrderDetail, and ex11 on
+    the table against the ex11 window query. Returns [(key, stored, recomputed), ...] for the
+    mismatches; the key of the ex11 comparison is the result row number.
+    """
+    cur = conn.cursor()
+    stored = {row[0]: row[1:] for row in cur.execute("SELECT * FROM CustomerOrderGap").fetchall()}
+    recomputed = {row[0]: row[1:] for row in cur.execute(ORDER_GAP_RECOMPUTE_SQL.format(where='')).fetchall()}
+    mismatches = [(key, stored.get(key), recomputed.get(key))
+                  for key in sorted(set(stored) | set(recomputed)) if stored.get(key) != recomputed.get(key)]
+    from_table = cur.execute(ex11(conn, rollup=True)).fetchall()
+    from_window = cur.execute(ex11(conn)).fetchall()
+    mismatches += [(f'ex11 row {index}', table_row, window_row)
+                   for index, (table_row, window_row) in enumerate(itertools.zip_longest(from_table, from_window))
+                   if table_row != window_row]
+    return mismatches
+
+
+def ranked_head(cur, sql_statement, parameters, k, rank_value, tie_key, ties_descending=False):
+    """
+    Read one leaderboard partition in descending total order and assign RANK() values over
+    rank_value(row): equal values share a rank and the next value skips ahead. Rows are
+    fetched lazily and reading stops at the first rank above k (k=None reads them all), so
+    the cost is the top k rows plus their ties. Tied rows are ordered by tie_key, largest
+    first with ties_descending.
+    Returns [(row, rank), ...].
+    """
+    ranked = []
+    previous = None
+    for position, row in enumerate(cur.execute(sql_statement, parameters)):
+        value = rank_value(row)
+        if not ranked or value != previous:
+            rank = position + 1
+            if k is not None and rank > k:
+                break
+            previous = value
+        ranked.append((row, rank))
+    ranked.sort(key=lambda item: tie_key(item[0]), reverse=ties_descending)
+    ranked.sort(key=lambda item: item[1])
+    return ranked
+
+
+def region_leaderboard(conn, k=None, rank_rounded=True):
+    """
+    Countries ranked within each region from the RegionCountryTotal leaderboard, as
+    (Region, Country, CountryTotal, rank) rows ordered by Region. rank_rounded ranks on the
+    rounded total like ex6, otherwise on the exact sum like ex7; region_leaderboard(conn)
+    returns the rows of ex6 and region_leaderboard(conn, 1, rank_rounded=False) those of ex7.
+    """
+    cur = conn.cursor()
+    partition_cur = conn.cursor()
+    rows = []
+    for region_id, region in partition_cur.execute("SELECT RegionID, Region FROM Region ORDER BY Region"):
+        ranked = ranked_head(
+            cur, """
+            SELECT co.Country, t.Total, ROUND(t.Total)
+            FROM RegionCountryTotal t JOIN Country co ON t.CountryID = co.CountryID
+            WHERE t.RegionID = ?
+            ORDER BY t.Total DESC
+            """, (region_id,), k,
+            rank_value=lambda row: row[2] if rank_rounded else row[1],
+            # ex6 returns tied countries in name order, ex7 (window over the GROUP BY) in reverse
+            tie_key=lambda row: row[0], ties_descending=not rank_rounded)
+        rows.extend((region, country, rounded_total, rank) for (country, _, rounded_total), rank in ranked)
+    return rows
+
+
+def quarter_leaderboard(conn, k=5):
+    """
+    The top k customers of every quarter with RANK() ties, read from the CustomerQuarterTotal
+    leaderboard; quarter_leaderboard(conn) returns the rows of ex9, ordered by Year, Quarter
+    and rank with tied customers in CustomerID order.
+    """
+    cur = conn.cursor()
+    rows = []
+    partition = cur.execute("SELECT Year, Quarter FROM CustomerQuarterTotal ORDER BY Year, Quarter LIMIT 1").fetchone()
+    while partition is not None:
+        year, quarter = partition
+        ranked = ranked_head(
+            cur, """
+            SELECT CustomerID, ROUND(Total)
+            FROM CustomerQuarterTotal
+            WHERE Year = ? AND Quarter = ?
+            ORDER BY Total DESC
+            """, partition, k, rank_value=lambda row: row[1], tie_key=lambda row: row[0])
+        rows.extend((quarter, year, customer_id, total, rank) for (customer_id, total), rank in ranked)
+        # two seeks; SQLite does not seek past the current year for WHERE (Year, Quarter) > (?, ?)
+        partition = (cur.execute("SELECT Year, Quarter FROM CustomerQuarterTotal WHERE Year = ? AND Quarter > ? "
+                                 "ORDER BY Quarter LIMIT 1", (year, quarter)).fetchone()
+                     or cur.execute("SELECT Year, Quarter FROM CustomerQuarterTotal WHERE Year > ? "
+                                    "ORDER BY Year, Quarter LIMIT 1", (year,)).fetchone())
+    return rows
+
+
+def check_leaderboards(conn):
+    """
+    Compare the leaderboard answers with the ex6, ex7 and ex9 window queries.
+    Returns [(query, row number, leaderboard row, query row), ...] for the differences.
+    """
+    cur = conn.cursor()
+    mismatches = []
+    for query_name, from_leaderboard, sql_statement in (
+            ('ex6', region_leaderboard(conn), ex6(conn)),
+            ('ex7', region_leaderboard(conn, 1, rank_rounded=False), ex7(conn)),
+            ('ex9', quarter_leaderboard(conn), ex9(conn))):
+        from_query = cur.execute(sql_statement).fetchall()
+        mismatches += [(query_name, index, leaderboard_row, query_row)
+                       for index, (leaderboard_row, query_row)
+                       in enumerate(itertools.zip_longest(from_leaderboard, from_query))
+                       if leaderboard_row != query_row]
+    return mismatches
+
+
+### Normalization Steps
+
+@instrumented('step1')
+def step1_create_region_table(data_filename, normalized_database_filename):
+    """
+    Create the Region table, populating it with unique, sorted regions from the file.
+    """
+    # WRITE YOUR CODE HERE
+    conn = create_connection(normalized_database_filename)
+    if not conn:
+        print("Failed to connect.")
+        return
+
+    try:
+        parsed = load_data_file(data_filename, include_orders=False)
+        write_region_table(conn, parsed['regions'])
+        clear_pipeline_state(conn, ['Region'])
+
+        with phase('commit'):
+            conn.commit()
+        print("Region table task is successfull.")
+    except FileNotFoundError as e:
+        print(f"File not found: {e}")
+    except Error as e:
+        print(f"Error during operation: {e}")
+    finally:
+        conn.close()
+        invalidate_dimension_cache(normalized_database_filename, 'Region')
+
+
+@instrumented('step2')
+def step2_create_region_to_regionid_dictionary(normalized_database_filename):
+    # WRITE YOUR CODE HERE
+    # Served from the dimension cache; the Region table is only read again after it is rewritten.
+    return get_dimension_cache(normalized_database_filename).get('Region')
+
+
+@instrumented('step3')
+def step3_create_country_table(data_filename, normalized_database_filename):
+    """
+    Create the Country table, associating countries with regions.
+    """
+    # Inputs: Name of the data and normalized database filename
+    # Output: None
+    # WRITE YOUR CODE HERE
+    conn = create_connection(normalized_database_filename)
+    region_to_regionid_dict = step2_create_region_to_regionid_dictionary(normalized_database_filename)
+
+    parsed = load_data_file(data_filename, include_orders=False)
+    write_country_table(conn, parsed['countries'], region_to_regionid_dict)
+    clear_pipeline_state(conn, ['Country'])
+
+    with phase('commit'):
+        conn.commit()
+    conn.close()
+    invalidate_dimension_cache(normalized_database_filename, 'Country')
+
+
+@instrumented('step4')
+def step4_create_country_to_countryid_dictionary(normalized_database_filename):
+    # WRITE YOUR CODE HERE
+    return get_dimension_cache(normalized_database_filename).get('Country')
+
+
+@instrumented('step5')
+def step5_create_customer_table(data_filename, normalized_database_filename):
+    """
+    Create the Customer table, associating customers with countries.
+    """
+    # WRITE YOUR CODE HERE
+    conn = create_connection(normalized_database_filename)
+    country_to_countryid_dict = step4_create_country_to_countryid_dictionary(normalized_database_filename)
+
+    parsed = load_data_file(data_filename, include_orders=False)
+    write_customer_table(conn, parsed['customers'], country_to_countryid_dict)
+    clear_pipeline_state(conn, ['Customer'])
+
+    with phase('commit'):
+        conn.commit()
+    conn.close()
+    invalidate_dimension_cache(normalized_database_filename, 'Customer')
+
+
+@instrumented('step6')
+def step6_create_customer_to_customerid_dictionary(normalized_database_filename):
+    # WRITE YOUR CODE HERE
+    return get_dimension_cache(normalized_database_filename).get('Customer')
+
+
+@instrumented('step7')
+def step7_create_productcategory_table(data_filename, normalized_database_filename):
+    """
+    Create the ProductCategory table.
+    """
+    # Inputs: Name of the data and normalized database filename
+    # Output: None
+    # WRITE YOUR CODE HERE
+    conn = create_connection(normalized_database_filename)
+
+    parsed = load_data_file(data_filename, include_orders=False)
+    write_productcategory_table(conn, parsed['product_categories'])
+    clear_pipeline_state(conn, ['ProductCategory'])
+
+    with phase('commit'):
+        conn.commit()
+    conn.close()
+    invalidate_dimension_cache(normalized_database_filename, 'ProductCategory')
+
+
+@instrumented('step8')
+def step8_create_productcategory_to_productcategoryid_dictionary(normalized_database_filename):
+    # WRITE YOUR CODE HERE
+    return get_dimension_cache(normalized_database_filename).get('ProductCategory')
+
+
+@instrumented('step9')
+def step9_create_product_table(data_filename, normalized_database_filename):
+    """
+    Create the Product table, associating products with categories.
+    """
+    # WRITE YOUR CODE HERE
+    conn = create_connection(normalized_database_filename)
+    productcategory_to_productcategoryid_dict = step8_create_productcategory_to_productcategoryid_dictionary(
+        normalized_database_filename)
+
+    parsed = load_data_file(data_filename, include_orders=False)
+    write_product_table(conn, parsed['products'], productcategory_to_productcategoryid_dict)
+    clear_pipeline_state(conn, ['Product'])
+
+    with phase('commit'):
+        conn.commit()
+    conn.close()
+    invalidate_dimension_cache(normalized_database_filename, 'Product')
+
+
+@instrumented('step10')
+def step10_create_product_to_productid_dictionary(normalized_database_filename):
+    # WRITE YOUR CODE HERE
+    return get_dimension_cache(normalized_database_filename).get('Product')
+
+
+@instrumented('step11')
+def step11_create_orderdetail_table(data_filename, normalized_database_filename, stream=False,
+                                    chunk_size=ORDERDETAIL_CHUNK_SIZE, build_sales_fact=False, build_rollups=False):
+    # WRITE YOUR CODE HERE
+    # The order lines come from the cached parse when one holds them (normalize-style callers
+    # such as the pipeline warm it), otherwise they are streamed from the file; stream=True
+    # always streams. Either way they are inserted chunk_size rows at a time, and the cached
+    # parse is released afterwards, since step11 is its last reader.
+    # build_sales_fact=True / build_rollups=True also materialize SalesFact and the rollup tables;
+    # existing ones are always rebuilt.
+    # Streamed lines are only parsed after the old OrderDetail is dropped, so the whole rewrite
+    # runs under load_transaction: a bad line anywhere in the file leaves the database as it was.
+    conn = create_connection(normalized_database_filename)
+    customer_to_customerid_dict = step6_create_customer_to_customerid_dictionary(normalized_database_filename)
+    product_to_productid_dict = step10_create_product_to_productid_dictionary(normalized_database_filename)
+
+    orders = None if stream else cached_order_lines(data_filename)
+    if orders is None:
+        orders = iter_order_lines(data_filename)
+    try:
+        with load_transaction(conn):
+            write_orderdetail_table(conn, orders, customer_to_customerid_dict, product_to_productid_dict, chunk_size)
+            clear_parsed_data_cache()
+            write_loaded_line_table(conn, data_filename)
+            if build_sales_fact or table_exists(conn, 'SalesFact'):
+                write_sales_fact_table(conn)
+            if build_rollups or table_exists(conn, 'CustomerTotal'):
+                write_rollup_tables(conn)
+            clear_pipeline_state(conn, ['OrderDetail'])
+    finally:
+        conn.close()
+    refresh_order_partitions(normalized_database_filename)
+    bump_data_version(normalized_database_filename)
+
+
+def ex1(conn, customer_name):
+    # Simply, you are fetching all the rows for a given CustomerName.
+    # Write an SQL statement that SELECTs From the OrderDetail table and joins with the Customer and Product table.
+    # Pull out the following columns.
+    # Name -- concatenation of FirstName and LastName
+    # ProductName
+    # OrderDate
+    # ProductUnitPrice
+    # QuantityOrdered
+    # Total -- which is calculated from multiplying ProductUnitPrice with QuantityOrdered -- round to two decimal places
+    # HINT: USE customer_to_customerid_dict to map customer name to customer id and then use where clause with CustomerID
+    # WRITE YOUR CODE HERE
+    customer_id = lookup_customer_id(conn, customer_name)
+
+    sql_statement = f"""
+    SELECT 
+        Customer.FirstName || ' ' || Customer.LastName AS Name, 
+        Product.ProductName, 
+        OrderDetail.OrderDate, 
+        Product.ProductUnitPrice, 
+        OrderDetail.QuantityOrdered, 
+        ROUND(Product.ProductUnitPrice * OrderDetail.QuantityOrdered, 2) AS Total
+    FROM 
+        OrderDetail
+    JOIN 
+        Customer ON OrderDetail.CustomerID = Customer.CustomerID
+    JOIN 
+        Product ON OrderDetail.ProductID = Product.ProductID
+    WHERE 
+        OrderDetail.CustomerID = {customer_id if customer_id is not None else 'NULL'}
+    ORDER BY
+        OrderDetail.OrderID;
+    """
+    return sql_statement
+
+
+def ex2(conn, CustomerName):
+    # Simply, you are summing the total for a given CustomerName.
+    # Write an SQL statement that SELECTs From the OrderDetail table and joins with the Customer and Product table.
+    # Pull out the following columns.
+    # Name -- concatenation of FirstName and LastName
+    # Total -- which is calculated from multiplying ProductUnitPrice with QuantityOrdered -- sum first and then round to two decimal places
+    # HINT: USE customer_to_customerid_dict to map customer name to customer id and then use where clause with CustomerID
+    # WRITE YOUR CODE HERE
+    # The name is resolved through the cached dictionary of conn's database so the filter is an
+    # index search on OrderDetail.CustomerID rather than a scan comparing concatenated names.
+    customer_id = lookup_customer_id(conn, CustomerName)
+
+    sql_statement = f"""
+    SELECT 
+        (Customer.FirstName || ' ' || Customer.LastName) AS Name,
+        ROUND(SUM(Product.ProductUnitPrice * OrderDetail.QuantityOrdered), 2) AS Total
+    FROM 
+        OrderDetail
+    JOIN 
+        Customer ON OrderDetail.CustomerID = Customer.CustomerID
+    JOIN 
+        Product ON OrderDetail.ProductID = Product.ProductID
+    WHERE 
+        OrderDetail.CustomerID = {customer_id if customer_id is not None else 'NULL'}
+    GROUP BY
+        Customer.CustomerID
+    """
+    return sql_statement
+
+
+def ex3(conn, sales_fact=False, rollup=False):
+    # Simply, find the total for all the customers
+    # Write an SQL statement that SELECTs From the OrderDetail table and joins with the Customer and Product table.
+    # Pull out the following columns.
+    # Name -- concatenation of FirstName and LastName
+    # Total -- which is calculated from multiplying ProductUnitPrice with QuantityOrdered -- sum first and then round to two decimal places
+    # ORDER BY Total Descending
+    # WRITE YOUR CODE HERE
+    if rollup:
+        sql_statement = """
+    SELECT 
+        (c.FirstName || ' ' || c.LastName) AS Name,
+        ROUND(ct.Total, 2) AS Total
+    FROM 
+        CustomerTotal ct
+    JOIN 
+        Customer c ON ct.CustomerID = c.CustomerID
+    ORDER BY 
+        Total DESC,
+        ct.CustomerID DESC
+    """
+        return sql_statement
+
+    if sales_fact:
+        sql_statement = """
+    SELECT 
+        (c.FirstName || ' ' || c.LastName) AS Name,
+        ROUND(SUM(sf.LineTotal), 2) AS Total
+    FROM 
+        SalesFact sf
+    JOIN 
+        Customer c ON sf.CustomerID = c.CustomerID
+    GROUP BY 
+        c.CustomerID
+    ORDER BY 
+        Total DESC
+    """
+        return sql_statement
+
+    sql_statement = """
+    SELECT 
+        (c.FirstName || ' ' || c.LastName) AS Name,
+        ROUND(SUM(p.ProductUnitPrice * od.QuantityOrdered), 2) AS Total
+    FROM 
+        OrderDetail od
+    JOIN 
+        Product p ON od.ProductID = p.ProductID
+    JOIN 
+        Customer c ON od.CustomerID = c.CustomerID
+    GROUP BY 
+        c.CustomerID
+    ORDER BY 
+        Total DESC
+    """
+    return sql_statement
+
+
+def ex4(conn, sales_fact=False, rollup=False):
+    # Simply, find the total for all the region
+    # Write an SQL statement that SELECTs From the OrderDetail table and joins with the Customer, Product, Country, and
+    # Region tables.
+    # Pull out the following columns.
+    # Region
+    # Total -- which is calculated from multiplying ProductUnitPrice with QuantityOrdered -- sum first and then round to two decimal places
+    # ORDER BY Total Descending
+    # WRITE YOUR CODE HERE
+    if rollup:
+        sql_statement = """
+    SELECT 
+        r.Region,
+        ROUND(rt.Total, 2) AS Total
+    FROM 
+        RegionTotal rt
+    JOIN 
+        Region r ON rt.RegionID = r.RegionID
+    ORDER BY 
+        Total DESC,
+        rt.RegionID DESC
+    """
+        return sql_statement
+
+    if sales_fact:
+        sql_statement = """
+    SELECT 
+        r.Region,
+        ROUND(SUM(sf.LineTotal), 2) AS Total
+    FROM 
+        SalesFact sf
+    JOIN 
+        Customer c ON sf.CustomerID = c.CustomerID
+    JOIN 
+        Country co ON c.CountryID = co.CountryID
+    JOIN 
+        Region r ON co.RegionID = r.RegionID
+    GROUP BY 
+        r.RegionID
+    ORDER BY 
+        Total DESC
+    """
+        return sql_statement
+
+    sql_statement = """
+    SELECT 
+        r.Region,
+        ROUND(SUM(p.ProductUnitPrice * od.QuantityOrdered), 2) AS Total
+    FROM 
+        OrderDetail od
+    JOIN 
+        Product p ON od.ProductID = p.ProductID
+    JOIN 
+        Customer c ON od.CustomerID = c.CustomerID
+    JOIN 
+        Country co ON c.CountryID = co.CountryID
+    JOIN 
+        Region r ON co.RegionID = r.RegionID
+    GROUP BY 
+        r.RegionID
+    ORDER BY 
+        Total DESC
+    """
+    return sql_statement
+
+
+def ex5(conn, sales_fact=False, rollup=False):
+    # Simply, find the total for all the countries
+    # Write an SQL statement that SELECTs From the OrderDetail table and joins with the Customer, Product, and Country table.
+    # Pull out the following columns.
+    # Country
+    # Total -- which is calculated from multiplying ProductUnitPrice with QuantityOrdered -- sum first and then round
+    # ORDER BY Total Descending
+    # WRITE YOUR CODE HERE
+    if rollup:
+        sql_statement = """
+    SELECT 
+        Country.Country,
+        ROUND(SUM(CountryTotal.Total), 0) AS Total
+    FROM 
+        CountryTotal
+    JOIN 
+        Country ON CountryTotal.CountryID = Country.CountryID
+    GROUP BY 
+        Country.Country
+    ORDER BY 
+        Total DESC
+    """
+        return sql_statement
+
+    if sales_fact:
+        sql_statement = """
+    SELECT 
+        Country.Country,
+        ROUND(SUM(SalesFact.LineTotal), 0) AS Total
+    FROM 
+        SalesFact
+    JOIN 
+        Customer ON SalesFact.CustomerID = Customer.CustomerID
+    JOIN 
+        Country ON Customer.CountryID = Country.CountryID
+    GROUP BY 
+        Country.Country
+    ORDER BY 
+        Total DESC
+    """
+        return sql_statement
+
+    sql_statement = """
+    SELECT 
+        Country.Country,
+        ROUND(SUM(Product.ProductUnitPrice * OrderDetail.QuantityOrdered), 0) AS Total
+    FROM 
+        OrderDetail
+    JOIN 
+        Customer ON OrderDetail.CustomerID = Customer.CustomerID
+    JOIN 
+        Product ON OrderDetail.ProductID = Product.ProductID
+    JOIN 
+        Country ON Customer.CountryID = Country.CountryID
+    GROUP BY 
+        Country.Country
+    ORDER BY 
+        Total DESC
+    """
+
+    return sql_statement
+
+
+def ex6(conn, sales_fact=False):
+    # Rank the countries within a region based on order total
+    # Output Columns: Region, Country, CountryTotal, TotalRank
+    # Hint: Round the the total
+    # Hint: Sort ASC by Region
+    # WRITE YOUR CODE HERE
+    if sales_fact:
+        sql_statement = """
+    WITH CountryTotals AS (
+        SELECT 
+            r.Region,
+            c.Country,
+            ROUND(SUM(sf.LineTotal)) AS CountryTotal
+        FROM 
+            SalesFact sf
+            JOIN Customer cu ON sf.CustomerID = cu.CustomerID
+            JOIN Country c ON cu.CountryID = c.CountryID
+            JOIN Region r ON c.RegionID = r.RegionID
+        GROUP BY 
+            r.Region, c.Country
+    )
+    SELECT 
+        Region,
+        Country,
+        CountryTotal,
+        RANK() OVER (PARTITION BY Region ORDER BY CountryTotal DESC) AS TotalRank
+    FROM 
+        CountryTotals
+    ORDER BY 
+        Region ASC, CountryTotal DESC
+    """
+        return sql_statement
+
+    sql_statement = """
+    WITH CountryTotals AS (
+        SELECT 
+            r.Region,
+            c.Country,
+            ROUND(SUM(od.QuantityOrdered * p.ProductUnitPrice)) AS CountryTotal
+        FROM 
+            OrderDetail od
+            JOIN Customer cu ON od.CustomerID = cu.CustomerID
+            JOIN Country c ON cu.CountryID = c.CountryID
+            JOIN Region r ON c.RegionID = r.RegionID
+            JOIN Product p ON od.ProductID = p.ProductID
+        GROUP BY 
+            r.Region, c.Country
+    )
+    SELECT 
+        Region,
+        Country,
+        CountryTotal,
+        RANK() OVER (PARTITION BY Region ORDER BY CountryTotal DESC) AS TotalRank
+    FROM 
+        CountryTotals
+    ORDER BY 
+        Region ASC, CountryTotal DESC
+    """
+    return sql_statement
+
+
+def ex7(conn, sales_fact=False):
+    # Rank the countries within a region based on order total, BUT only select the TOP country, meaning rank = 1!
+    # Output Columns: Region, Country, Total, TotalRank
+    # Hint: Round the the total
+    # Hint: Sort ASC by Region
+    # HINT: Use "WITH"
+    # WRITE YOUR CODE HERE
+    if sales_fact:
+        sql_statement = """
+    WITH CountryTotals AS (
+        SELECT 
+            r.Region,
+            c.Country,
+            ROUND(SUM(sf.LineTotal)) AS CountryTotal,
+            RANK() OVER (PARTITION BY r.Region ORDER BY SUM(sf.LineTotal) DESC) AS CountryRegionalRank
+        FROM 
+            SalesFact sf
+            JOIN Customer cu ON sf.CustomerID = cu.CustomerID
+            JOIN Country c ON cu.CountryID = c.CountryID
+            JOIN Region r ON c.RegionID = r.RegionID
+        GROUP BY 
+            r.Region, c.Country
+    )
+    SELECT Region, Country, CountryTotal, CountryRegionalRank
+    FROM CountryTotals
+    WHERE CountryRegionalRank = 1
+    ORDER BY Region ASC
+    """
+        return sql_statement
+
+    sql_statement = """
+    WITH CountryTotals AS (
+        SELECT 
+            r.Region,
+            c.Country,
+            ROUND(SUM(od.QuantityOrdered * p.ProductUnitPrice)) AS CountryTotal,
+            RANK() OVER (PARTITION BY r.Region ORDER BY SUM(od.QuantityOrdered * p.ProductUnitPrice) DESC) AS CountryRegionalRank
+        FROM 
+            OrderDetail od
+            JOIN Customer cu ON od.CustomerID = cu.CustomerID
+            JOIN Country c ON cu.CountryID = c.CountryID
+            JOIN Region r ON c.RegionID = r.RegionID
+            JOIN Product p ON od.ProductID = p.ProductID
+        GROUP BY 
+            r.Region, c.Country
+    )
+    SELECT Region, Country, CountryTotal, CountryRegionalRank
+    FROM CountryTotals
+    WHERE CountryRegionalRank = 1
+    ORDER BY Region ASC
+    """
+    return sql_statement
+
+
+def ex8(conn, sales_fact=False, rollup=False):
+    # Sum customer sales by Quarter and year
+    # Output Columns: Quarter,Year,CustomerID,Total
+    # HINT: Use "WITH"
+    # Hint: Round the the total
+    # HINT: YOU MUST CAST YEAR TO TYPE INTEGER!!!!
+
+    # WRITE YOUR CODE HERE
+    if rollup:
+        sql_statement = """
+    SELECT Quarter, Year, CustomerID, ROUND(Total) AS Total
+    FROM CustomerQuarterTotal
+    ORDER BY Year, Quarter, CustomerID
+    """
+        return sql_statement
+
+    if sales_fact:
+        sql_statement = """
+    SELECT Quarter, Year, CustomerID, ROUND(SUM(LineTotal)) AS Total
+    FROM SalesFact
+    GROUP BY Year, Quarter, CustomerID
+    ORDER BY Year, Quarter, CustomerID
+    """
+        return sql_statement
+
+    sql_statement = """
+    WITH CustomerSales AS (
+        SELECT 
+            CASE 
+                WHEN CAST(SUBSTR(od.OrderDate, 6, 2) AS INTEGER) IN (1, 2, 3) THEN 'Q1'
+                WHEN CAST(SUBSTR(od.OrderDate, 6, 2) AS INTEGER) IN (4, 5, 6) THEN 'Q2'
+                WHEN CAST(SUBSTR(od.OrderDate, 6, 2) AS INTEGER) IN (7, 8, 9) THEN 'Q3'
+                ELSE 'Q4'
+            END AS Quarter,
+            CAST(SUBSTR(od.OrderDate, 1, 4) AS INTEGER) AS Year,
+            od.CustomerID,
+            ROUND(SUM(od.QuantityOrdered * p.ProductUnitPrice)) AS Total
+        FROM 
+            OrderDetail od
+            JOIN Product p ON od.ProductID = p.ProductID
+        GROUP BY 
+            Quarter, Year, od.CustomerID
+    )
+    SELECT Quarter, Year, CustomerID, Total
+    FROM CustomerSales
+    ORDER BY Year, Quarter, CustomerID
+    """
+    return sql_statement
+
+
+def ex9(conn, sales_fact=False):
+    # Rank the customer sales by Quarter and year, but only select the top 5 customers!
+    # Output Columns: Quarter, Year, CustomerID, Total
+    # HINT: Use "WITH"
+    # Hint: Round the the total
+    # HINT: YOU MUST CAST YEAR TO TYPE INTEGER!!!!
+    # HINT: You can have multiple CTE tables;
+    # WITH table1 AS (), table2 AS ()
+    # WRITE YOUR CODE HERE
+    if sales_fact:
+        sql_statement = """
+    WITH CustomerSales AS (
+        SELECT Quarter, Year, CustomerID, ROUND(SUM(LineTotal)) AS Total
+        FROM SalesFact
+        GROUP BY Year, Quarter, CustomerID
+    ),
+    RankedSales AS (
+        SELECT 
+            Quarter, 
+            Year, 
+            CustomerID, 
+            Total,
+            RANK() OVER (PARTITION BY Quarter, Year ORDER BY Total DESC) AS CustomerRank
+        FROM 
+            CustomerSales
+    )
+    SELECT Quarter, Year, CustomerID, Total, CustomerRank
+    FROM RankedSales
+    WHERE CustomerRank <= 5
+    ORDER BY Year, Quarter, CustomerRank
+    """
+        return sql_statement
+
+    sql_statement = """
+    WITH CustomerSales AS (
+        SELECT 
+            CASE 
+                WHEN CAST(SUBSTR(od.OrderDate, 6, 2) AS INTEGER) IN (1, 2, 3) THEN 'Q1'
+                WHEN CAST(SUBSTR(od.OrderDate, 6, 2) AS INTEGER) IN (4, 5, 6) THEN 'Q2'
+                WHEN CAST(SUBSTR(od.OrderDate, 6, 2) AS INTEGER) IN (7, 8, 9) THEN 'Q3'
+                ELSE 'Q4'
+            END AS Quarter,
+            CAST(SUBSTR(od.OrderDate, 1, 4) AS INTEGER) AS Year,
+            od.CustomerID,
+            ROUND(SUM(od.QuantityOrdered * p.ProductUnitPrice)) AS Total
+        FROM 
+            OrderDetail od
+            JOIN Product p ON od.ProductID = p.ProductID
+        GROUP BY 
+            Quarter, Year, od.CustomerID
+    ),
+    RankedSales AS (
+        SELECT 
+            Quarter, 
+            Year, 
+            CustomerID, 
+            Total,
+            RANK() OVER (PARTITION BY Quarter, Year ORDER BY Total DESC) AS CustomerRank
+        FROM 
+            CustomerSales
+    )
+    SELECT Quarter, Year, CustomerID, Total, CustomerRank
+    FROM RankedSales
+    WHERE CustomerRank <= 5
+    ORDER BY Year, Quarter, CustomerRank
+    """
+    return sql_statement
+
+
+def ex10(conn, sales_fact=False, rollup=False):
+    # Rank the monthy sales
+    # Output Columns: Quarter, Year, CustomerID, Total
+    # HINT: Use "WITH"
+    # Hint: Round the the total
+
+    # WRITE YOUR CODE HERE
+    if rollup:
+        sql_statement = """
+    SELECT 
+        CASE Month
+            WHEN 1 THEN 'January'
+            WHEN 2 THEN 'February'
+            WHEN 3 THEN 'March'
+            WHEN 4 THEN 'April'
+            WHEN 5 THEN 'May'
+            WHEN 6 THEN 'June'
+            WHEN 7 THEN 'July'
+            WHEN 8 THEN 'August'
+            WHEN 9 THEN 'September'
+            WHEN 10 THEN 'October'
+            WHEN 11 THEN 'November'
+            WHEN 12 THEN 'December'
+        END AS Month,
+        Total,
+        ROW_NUMBER() OVER (ORDER BY Total DESC) AS TotalRank
+    FROM MonthTotal
+    ORDER BY Total DESC
+    """
+        return sql_statement
+
+    if sales_fact:
+        sql_statement = """
+    WITH MonthlySales AS (
+        SELECT 
+            SUM(ROUND(LineTotal, 0)) AS Total,
+            Month AS MonthNumber
+        FROM SalesFact
+        GROUP BY Month
+    )
+    SELECT 
+        CASE MonthNumber
+            WHEN 1 THEN 'January'
+            WHEN 2 THEN 'February'
+            WHEN 3 THEN 'March'
+            WHEN 4 THEN 'April'
+            WHEN 5 THEN 'May'
+            WHEN 6 THEN 'June'
+            WHEN 7 THEN 'July'
+            WHEN 8 THEN 'August'
+            WHEN 9 THEN 'September'
+            WHEN 10 THEN 'October'
+            WHEN 11 THEN 'November'
+            WHEN 12 THEN 'December'
+        END AS Month,
+        Total,
+        ROW_NUMBER() OVER (ORDER BY Total DESC) AS TotalRank
+    FROM MonthlySales
+    ORDER BY Total DESC
+    """
+        return sql_statement
+
+    sql_statement = """
+    WITH MonthlySales AS (
+        SELECT 
+            SUM(ROUND(Product.ProductUnitPrice * OrderDetail.QuantityOrdered, 0)) AS Total,
+            CASE CAST(SUBSTR(OrderDetail.OrderDate, 6, 2) AS INTEGER)
+                WHEN 1 THEN 'January'
+                WHEN 2 THEN 'February'
+                WHEN 3 THEN 'March'
+                WHEN 4 THEN 'April'
+                WHEN 5 THEN 'May'
+                WHEN 6 THEN 'June'
+                WHEN 7 THEN 'July'
+                WHEN 8 THEN 'August'
+                WHEN 9 THEN 'September'
+                WHEN 10 THEN 'October'
+                WHEN 11 THEN 'November'
+                WHEN 12 THEN 'December'
+            END AS Month
+        FROM OrderDetail
+        JOIN Product ON OrderDetail.ProductID = Product.ProductID
+        GROUP BY Month
+    )
+    SELECT 
+        Month,
+        Total,
+        ROW_NUMBER() OVER (ORDER BY Total DESC) AS TotalRank
+    FROM MonthlySales
+    ORDER BY Total DESC
+    """
+    return sql_statement
+
+
+def ex11(conn, rollup=False):
     # Find the MaxDaysWithoutOrder for each customer
     # Output Columns:
     # CustomerID,
@@ -698,46 +2799,1838 @@ def ex11(conn):
     # HINT: Use "WITH"; I created two CTE tables
     # HINT: Use Lag
     # WRITE YOUR CODE HERE
+    if rollup:
+        # Ties come out in descending CustomerID, the order the window query returns them in.
+        sql_statement = """
+    SELECT
+        g.CustomerID,
+        c.FirstName,
+        c.LastName,
+        co.Country,
+        g.OrderDate,
+        g.PreviousOrderDate,
+        g.MaxDaysWithoutOrder
+    FROM
+        CustomerOrderGap g
+        JOIN Customer c ON g.CustomerID = c.CustomerID
+        JOIN Country co ON c.CountryID = co.CountryID
+    WHERE
+        g.MaxDaysWithoutOrder IS NOT NULL
+    ORDER BY
+        g.MaxDaysWithoutOrder DESC, g.CustomerID DESC
+    """
+        return sql_statement
+
     sql_statement = """
     WITH OrderDates AS (
         SELECT
-            CustomerID,
-            OrderDate,
-            LAG(OrderDate) OVER (PARTITION BY CustomerID ORDER BY OrderDate) AS PreviousOrderDate
-        FROM
-            OrderDetail
+            CustomerID,
+            OrderDate,
+            LAG(OrderDate) OVER (PARTITION BY CustomerID ORDER BY OrderDate) AS PreviousOrderDate
+        FROM
+            OrderDetail
+    ),
+    DaysBetweenOrders AS (
+        SELECT
+            od.CustomerID,
+            c.FirstName,
+            c.LastName,
+            co.country AS Country,
+            od.OrderDate,
+            od.PreviousOrderDate,
+            JULIANDAY(od.OrderDate) - JULIANDAY(od.PreviousOrderDate) AS DaysBetweenOrders
+        FROM
+            OrderDates od
+            JOIN Customer c ON od.CustomerID = c.CustomerID
+            JOIN Country co ON c.CountryID = co.CountryID
+        WHERE
+            od.PreviousOrderDate IS NOT NULL
+    )
+    SELECT
+        CustomerID,
+        FirstName,
+        LastName,
+        Country,
+        OrderDate,
+        PreviousOrderDate,
+        MAX(DaysBetweenOrders) AS MaxDaysWithoutOrder
+    FROM
+        DaysBetweenOrders
+    GROUP BY
+        CustomerID
+    ORDER BY
+        MaxDaysWithoutOrder DESC
+    """
+    return sql_statement
+
+
+### Query API
+
+QUERY_STATEMENT_CACHE_SIZE = 256
+
+EX1_SQL = """
+    SELECT 
+        Customer.FirstName || ' ' || Customer.LastName AS Name, 
+        Product.ProductName, 
+        OrderDetail.OrderDate, 
+        Product.ProductUnitPrice, 
+        OrderDetail.QuantityOrdered, 
+        ROUND(Product.ProductUnitPrice * OrderDetail.QuantityOrdered, 2) AS Total
+    FROM 
+        OrderDetail
+    JOIN 
+        Customer ON OrderDetail.CustomerID = Customer.CustomerID
+    JOIN 
+        Product ON OrderDetail.ProductID = Product.ProductID
+    WHERE 
+        OrderDetail.CustomerID = ?
+    ORDER BY
+        OrderDetail.OrderID
+    """
+
+EX2_SQL = """
+    SELECT 
+        (Customer.FirstName || ' ' || Customer.LastName) AS Name,
+        ROUND(SUM(Product.ProductUnitPrice * OrderDetail.QuantityOrdered), 2) AS Total
+    FROM 
+        OrderDetail
+    JOIN 
+        Customer ON OrderDetail.CustomerID = Customer.CustomerID
+    JOIN 
+        Product ON OrderDetail.ProductID = Product.ProductID
+    WHERE 
+        OrderDetail.CustomerID = ?
+    GROUP BY
+        Customer.CustomerID
+    """
+
+
+def ex1_query(conn, customer_name):
+    """
+    Return the ex1 statement with its parameters. The SQL text is constant, so the
+    connection's statement cache prepares it only once.
+    """
+    customer_id = lookup_customer_id(conn, customer_name)
+    return EX1_SQL, (customer_id,)
+
+
+def ex2_query(conn, CustomerName):
+    """
+    Return the ex2 statement with its parameters, resolving the name through the cached
+    Customer dictionary of conn's database so the total is a point lookup on OrderDetail.CustomerID.
+    """
+    customer_id = lookup_customer_id(conn, CustomerName)
+    return EX2_SQL, (customer_id,)
+
+
+class QueryRunner:
+    """
+    Run parameterized queries against one database through a single reusable cursor.
+    The connection keeps up to cached_statements prepared statements, so repeated
+    per-customer lookups skip SQL parsing entirely.
+    """
+
+    def __init__(self, normalized_database_filename, cached_statements=QUERY_STATEMENT_CACHE_SIZE):
+        self.normalized_database_filename = normalized_database_filename
+        self.conn = create_connection(normalized_database_filename, cached_statements=cached_statements)
+        self.cur = self.conn.cursor()
+
+    def run(self, sql_statement, parameters=(), query_name=None):
+        """
+        Execute a statement with its parameters and return all rows.
+        """
+        return run_query(self.conn, sql_statement, parameters, query_name, self.cur)
+
+    def ex1(self, customer_name):
+        return self.run(*ex1_query(self.conn, customer_name), query_name='ex1')
+
+    def ex2(self, customer_name):
+        return self.run(*ex2_query(self.conn, customer_name), query_name='ex2')
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+### Export
+
+EXPORT_BATCH_SIZE = 10000
+
+EXPORT_COMPRESSION_OPENERS = {
+    None: open,
+    'gzip': gzip.open,
+    'bz2': bz2.open,
+    'xz': lzma.open,
+}
+
+EXPORT_COMPRESSION_SUFFIXES = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz'}
+
+EXPORT_FORMAT_SUFFIXES = {'.csv': 'csv', '.jsonl': 'jsonl', '.parquet': 'parquet'}
+
+
+def export_query_statement(conn, query_name, customer_name=None):
+    """
+    Return (sql, parameters) for an exN query by name; ex1 and ex2 need a customer_name.
+    """
+    if query_name in ('ex1', 'ex2'):
+        if customer_name is None:
+            raise ValueError(f"{query_name} needs a customer name")
+        query = ex1_query if query_name == 'ex1' else ex2_query
+        return query(conn, customer_name)
+    queries = {'ex3': ex3, 'ex4': ex4, 'ex5': ex5, 'ex6': ex6, 'ex7': ex7,
+               'ex8': ex8, 'ex9': ex9, 'ex10': ex10, 'ex11': ex11}
+    if query_name not in queries:
+        raise ValueError(f"Unknown query: {query_name}")
+    return queries[query_name](conn), ()
+
+
+def export_format_from_filename(output_filename):
+    """
+    Infer (format, compression) from names like ex3.csv, ex1.jsonl.gz or ex9.parquet.
+    """
+    stem, suffix = os.path.splitext(output_filename.lower())
+    compression = EXPORT_COMPRESSION_SUFFIXES.get(suffix)
+    if compression is not None:
+        stem, suffix = os.path.splitext(stem)
+    return EXPORT_FORMAT_SUFFIXES.get(suffix, 'csv'), compression
+
+
+def iter_batches(cur, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Yield the remaining rows of an executed cursor in lists of at most batch_size rows.
+    """
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
+
+
+def write_csv_batches(file, columns, batches):
+    """
+    Write a header and the batches to an open text file in the format of the ex*.csv files.
+    """
+    writer = csv.writer(file, lineterminator='\n')
+    writer.writerow(columns)
+    rows = 0
+    for batch in batches:
+        writer.writerows(batch)
+        rows += len(batch)
+    return rows
+
+
+def write_jsonl_batches(file, columns, batches):
+    """
+    Write every row as one JSON object keyed by column name per line.
+    """
+    rows = 0
+    for batch in batches:
+        file.write(''.join([json.dumps(dict(zip(columns, row))) + '\n' for row in batch]))
+        rows += len(batch)
+    return rows
+
+
+def result_value_types(column_count, batches):
+    """
+    Find the Python type of every result column from its first non-NULL value, reading ahead
+    over as many batches as that takes; an int column becomes float if a float shows up in
+    the batches read. Returns (types, batches): None for a column that is NULL in every row,
+    and the batches read ahead chained back in front of the rest.
+    """
+    value_types = [None] * column_count
+    read_ahead = []
+    for batch in batches:
+        read_ahead.append(batch)
+        for i in range(column_count):
+            if value_types[i] not in (None, int):
+                continue
+            for row in batch:
+                value = row[i]
+                if value is not None and (value_types[i] is None or isinstance(value, float)):
+                    value_types[i] = type(value)
+                    if value_types[i] is not int:
+                        break
+        if None not in value_types:
+            break
+    return value_types, itertools.chain(read_ahead, batches)
+
+
+def write_parquet_batches(output_filename, columns, batches, compression=None):
+    """
+    Write the batches as Parquet row groups. Requires pyarrow.
+    SQLite declares no types for computed columns, so the schema comes from the values, read
+    ahead past leading NULLs by result_value_types; a column that is NULL throughout gets the
+    null type.
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet export requires pyarrow (pip install pyarrow)")
+
+    arrow_types = {int: pyarrow.int64(), float: pyarrow.float64(), str: pyarrow.string(), bytes: pyarrow.binary()}
+    value_types, batches = result_value_types(len(columns), batches)
+    schema = pyarrow.schema([(column, arrow_types[value_type] if value_type else pyarrow.null())
+                             for column, value_type in zip(columns, value_types)])
+    rows = 0
+    writer = pyarrow.parquet.ParquetWriter(output_filename, schema, compression=compression or 'snappy')
+    try:
+        for batch in batches:
+            data = {column: [row[i] for row in batch] for i, column in enumerate(columns)}
+            writer.write_table(pyarrow.Table.from_pydict(data, schema=schema))
+            rows += len(batch)
+    finally:
+        writer.close()
+    return rows
+
+
+def export_query(conn, sql_statement, output_filename, parameters=(), export_format=None, compression=None,
+                 batch_size=EXPORT_BATCH_SIZE):
+    """
+    Stream the result of a query to a CSV, JSON Lines or Parquet file in fetchmany batches,
+    so only one batch is in memory at a time. The format and compression default to the
+    file name (ex3.csv, ex1.jsonl.gz, ...); CSV and JSON Lines accept gzip, bz2 and xz,
+    Parquet its own codecs (snappy, gzip, zstd, ...).
+    Returns (rows, seconds).
+    """
+    inferred_format, inferred_compression = export_format_from_filename(output_filename)
+    export_format = export_format or inferred_format
+    compression = compression or inferred_compression
+
+    start = time.perf_counter()
+    cur = conn.cursor()
+    cur.execute(sql_statement, parameters)
+    columns = [description[0] for description in cur.description]
+    batches = iter_batches(cur, batch_size)
+
+    if export_format == 'parquet':
+        rows = write_parquet_batches(output_filename, columns, batches, compression)
+    elif export_format in ('csv', 'jsonl'):
+        if compression not in EXPORT_COMPRESSION_OPENERS:
+            raise ValueError(f"Unsupported compression for {export_format}: {compression}")
+        with EXPORT_COMPRESSION_OPENERS[compression](output_filename, 'wt', newline='', encoding='utf-8') as file:
+            if export_format == 'csv':
+                rows = write_csv_batches(file, columns, batches)
+            else:
+                rows = write_jsonl_batches(file, columns, batches)
+    else:
+        raise ValueError(f"Unsupported export format: {export_format}")
+    return rows, time.perf_counter() - start
+
+
+def export_results(normalized_database_filename, query_name, output_filename, customer_name=None, **options):
+    """
+    Export one exN result from a normalized database and print its rows/sec.
+    options are passed on to export_query. Returns (rows, seconds).
+    """
+    conn = create_connection(normalized_database_filename)
+    try:
+        sql_statement, parameters = export_query_statement(conn, query_name, customer_name)
+        rows, seconds = export_query(conn, sql_statement, output_filename, parameters, **options)
+    finally:
+        conn.close()
+    print_load_report({output_filename: (rows, seconds)})
+    return rows, seconds
+
+
+### Result Cache
+
+RESULT_CACHE_MAX_ENTRIES = 256
+RESULT_CACHE_MAX_ROWS = 1000000
+
+_data_versions = {}
+
+
+def bump_data_version(normalized_database_filename):
+    """
+    Mark the data of a database as changed; every loading step calls this after writing.
+    """
+    key = os.path.abspath(normalized_database_filename)
+    _data_versions[key] = _data_versions.get(key, 0) + 1
+
+
+def read_change_counter(filename):
+    """
+    Return the file change counter from the header of an SQLite database, or None if there is
+    no header yet. Every commit in rollback-journal mode increments it.
+    """
+    try:
+        with open(filename, 'rb') as file:
+            header = file.read(28)
+    except FileNotFoundError:
+        return None
+    return header[24:28] if len(header) == 28 else None
+
+
+def data_version(normalized_database_filename):
+    """
+    Return the data-version stamp of a database without touching SQLite: the in-process
+    version bumped by the loaders plus the file change counter and the size and mtime of the
+    database and its WAL file, which also catch writes made by other processes. The counter
+    tells apart commits that land within one mtime tick and leave the size unchanged.
+    """
+    path = os.path.abspath(normalized_database_filename)
+    stamp = [_data_versions.get(path, 0), read_change_counter(path)]
+    for filename in (path, path + '-wal'):
+        try:
+            stat = os.stat(filename)
+        except FileNotFoundError:
+            stamp.append(None)
+            continue
+        # readers create an empty WAL file when they open the database; that is not a change
+        stamp.append((stat.st_ino, stat.st_size, stat.st_mtime_ns) if stat.st_size else None)
+    return tuple(stamp)
+
+
+class ResultCache:
+    """
+    LRU cache of exN results keyed on (database, query, customer). Each entry remembers the
+    data-version stamp it was computed under and is only served while the stamp is unchanged.
+    Eviction keeps at most max_entries results and max_rows rows in total.
+    """
+
+    def __init__(self, max_entries=RESULT_CACHE_MAX_ENTRIES, max_rows=RESULT_CACHE_MAX_ROWS):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.entries = collections.OrderedDict()
+        self.rows = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, stamp):
+        """
+        Return the cached rows for a key computed under stamp, or None.
+        The rows are shared between callers and must be treated as read-only.
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != stamp:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, stamp, rows):
+        """
+        Store the rows of a key computed under stamp, evicting the least recently used results.
+        """
+        if len(rows) > self.max_rows:
+            return
+        with self._lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.rows -= len(previous[1])
+            self.entries[key] = (stamp, rows)
+            self.rows += len(rows)
+            while len(self.entries) > self.max_entries or self.rows > self.max_rows:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.rows -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.rows = 0
+
+    def stats(self):
+        """
+        Return the hit and miss counters and the current size.
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries), 'rows': self.rows}
+
+
+_result_cache = ResultCache()
+
+
+def get_result_cache():
+    """
+    Return the process-wide result cache.
+    """
+    return _result_cache
+
+
+def cached_query(normalized_database_filename, query_name, customer_name=None, result_cache=None):
+    """
+    Return the rows of an exN query by name ('ex1' ... 'ex11'), serving them from the result
+    cache while the data version of the database is unchanged. ex1 and ex2 are cached per
+    customer. A cache hit does not open a connection.
+    """
+    result_cache = result_cache or _result_cache
+    key = (os.path.abspath(normalized_database_filename), query_name, customer_name)
+    stamp = data_version(normalized_database_filename)
+    rows = result_cache.get(key, stamp)
+    if rows is None:
+        conn = create_connection(normalized_database_filename)
+        try:
+            sql_statement, parameters = export_query_statement(conn, query_name, customer_name)
+            rows = run_query(conn, sql_statement, parameters, query_name)
+        finally:
+            conn.close()
+        result_cache.put(key, stamp, rows)
+    return rows
+
+
+### Query Service
+
+QUERY_SERVICE_POOL_SIZE = 4
+QUERY_SERVICE_TIMEOUT = 10.0
+
+
+def create_readonly_connection(db_file, cached_statements=QUERY_STATEMENT_CACHE_SIZE):
+    """
+    Open a read-only connection that may be used from any thread (one thread at a time).
+    """
+    uri = 'file:' + os.path.abspath(db_file).replace('?', '%3f').replace('#', '%23') + '?mode=ro'
+    return sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=cached_statements)
+
+
+class QueryService:
+    """
+    asyncio front-end for the exN queries over a pool of read-only connections to an
+    existing database; a missing file raises FileNotFoundError instead of being created.
+    The journal mode is left to the caller: once the database is in WAL mode (PRAGMA
+    journal_mode = WAL, which persists in the file) readers never block on a loader.
+    Queries run in pool_size worker threads, one pooled connection each; at most
+    max_concurrency queries are admitted at a time, and a query that exceeds timeout
+    seconds is interrupted and raises TimeoutError. With a result_cache, exN results are
+    served from it while the data version of the database is unchanged.
+    """
+
+    def __init__(self, normalized_database_filename, pool_size=QUERY_SERVICE_POOL_SIZE, max_concurrency=None,
+                 timeout=QUERY_SERVICE_TIMEOUT, result_cache=None):
+        self.normalized_database_filename = normalized_database_filename
+        self.result_cache = result_cache
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency or pool_size
+        if not os.path.isfile(normalized_database_filename):
+            raise FileNotFoundError(f"No database file {normalized_database_filename}")
+
+        self._connections = queue.Queue()
+        try:
+            for _ in range(pool_size):
+                self._connections.put(create_readonly_connection(normalized_database_filename))
+        except Error:
+            while not self._connections.empty():
+                self._connections.get().close()
+            raise
+        self._pool_size = pool_size
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=pool_size,
+                                                               thread_name_prefix='query-service')
+        self._semaphore = None
+        self._lock = threading.Lock()
+
+    def _execute(self, query_name, customer_name, sql_statement, parameters, state):
+        conn = self._connections.get()
+        try:
+            with self._lock:
+                if state.get('cancelled'):
+                    raise TimeoutError('query cancelled before it started')
+                state['conn'] = conn
+            if query_name is not None:
+                sql_statement, parameters = export_query_statement(conn, query_name, customer_name)
+            return run_query(conn, sql_statement, parameters, query_name)
+        finally:
+            with self._lock:
+                state.pop('conn', None)
+            self._connections.put(conn)
+
+    async def _submit(self, query_name, customer_name, sql_statement, parameters, timeout):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        timeout = self.timeout if timeout is None else timeout
+        state = {}
+        async with self._semaphore:
+            future = asyncio.get_running_loop().run_in_executor(
+                self._executor, self._execute, query_name, customer_name, sql_statement, parameters, state)
+            try:
+                return await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                with self._lock:
+                    state['cancelled'] = True
+                    if 'conn' in state:
+                        state['conn'].interrupt()
+                raise TimeoutError(f"query exceeded {timeout}s")
+
+    async def run(self, sql_statement, parameters=(), timeout=None):
+        """
+        Execute a statement on a pooled connection and return all rows.
+        """
+        return await self._submit(None, None, sql_statement, parameters, timeout)
+
+    async def query(self, query_name, customer_name=None, timeout=None):
+        """
+        Run an exN query by name ('ex1' ... 'ex11'); ex1 and ex2 need a customer_name.
+        """
+        if self.result_cache is None:
+            return await self._submit(query_name, customer_name, None, (), timeout)
+
+        key = (os.path.abspath(self.normalized_database_filename), query_name, customer_name)
+        stamp = data_version(self.normalized_database_filename)
+        rows = self.result_cache.get(key, stamp)
+        if rows is None:
+            rows = await self._submit(query_name, customer_name, None, (), timeout)
+            self.result_cache.put(key, stamp, rows)
+        return rows
+
+    async def ex1(self, customer_name, timeout=None):
+        return await self.query('ex1', customer_name, timeout)
+
+    async def ex2(self, customer_name, timeout=None):
+        return await self.query('ex2', customer_name, timeout)
+
+    async def ex3(self, timeout=None):
+        return await self.query('ex3', timeout=timeout)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for _ in range(self._pool_size):
+            self._connections.get().close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+
+### Columnar Backend
+
+MONTH_NAMES = ('January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October',
+               'November', 'December')
+COLUMNAR_QUERY_NAMES = ('ex3', 'ex4', 'ex5', 'ex6', 'ex7', 'ex8', 'ex9', 'ex10', 'ex11')
+
+
+def require_numpy():
+    if np is None:
+        raise ImportError("The columnar backend requires numpy (pip install numpy)")
+
+
+class ColumnarTables:
+    """
+    OrderDetail and its dimension tables as NumPy arrays, loaded once and shared by the
+    columnar exN kernels. The order columns are in OrderID order, the order SQLite scans
+    OrderDetail in, so per-group sums add the same floats in the same order as SUM().
+    Dimension attributes are arrays indexed by their integer primary key.
+    """
+    __slots__ = ('order_customer_ids', 'order_dates', 'line_totals',
+                 'customer_first_names', 'customer_last_names', 'customer_country_ids',
+                 'country_names', 'country_region_ids', 'region_names')
+
+    def __init__(self, conn):
+        require_numpy()
+        cur = conn.cursor()
+        order_count = cur.execute("SELECT COUNT(*) FROM OrderDetail").fetchone()[0]
+        orders = np.fromiter(
+            cur.execute("""
+                SELECT CustomerID, ProductID, QuantityOrdered, CAST(REPLACE(OrderDate, '-', '') AS INTEGER)
+                FROM OrderDetail ORDER BY OrderID
+            """),
+            dtype=[('customer', 'i8'), ('product', 'i8'), ('quantity', 'i8'), ('date', 'i8')], count=order_count)
+        self.order_customer_ids = orders['customer']
+        # dates as YYYYMMDD integers
+        self.order_dates = orders['date']
+
+        _, unit_prices = self.dimension(cur, "SELECT ProductID, ProductUnitPrice FROM Product")
+        self.line_totals = unit_prices.astype(np.float64)[orders['product']] * orders['quantity']
+
+        _, self.customer_first_names, self.customer_last_names, self.customer_country_ids = self.dimension(
+            cur, "SELECT CustomerID, FirstName, LastName, CountryID FROM Customer")
+        _, self.country_names, self.country_region_ids = self.dimension(
+            cur, "SELECT CountryID, Country, RegionID FROM Country")
+        _, self.region_names = self.dimension(cur, "SELECT RegionID, Region FROM Region")
+
+    @staticmethod
+    def dimension(cur, sql_statement):
+        """
+        Return the primary keys of a dimension table and every other column as an array
+        indexed by primary key (object arrays for text, int64 for foreign keys).
+        """
+        rows = cur.execute(sql_statement).fetchall()
+        keys = [row[0] for row in rows]
+        size = max(keys, default=0) + 1
+        columns = [keys]
+        for values in list(zip(*rows))[1:]:
+            integer = all(isinstance(value, int) for value in values)
+            column = np.zeros(size, dtype=np.int64) if integer else np.empty(size, dtype=object)
+            column[keys] = values
+            columns.append(column)
+        return columns
+
+    def order_country_ids(self):
+        return self.customer_country_ids[self.order_customer_ids]
+
+    def order_years(self):
+        return self.order_dates // 10000
+
+    def order_months(self):
+        return self.order_dates // 100 % 100
+
+    def order_quarters(self):
+        """
+        Quarter index 0-3 for each order line; like the SQL, any month past September is Q4.
+        """
+        return np.minimum((self.order_months() - 1) // 3, 3)
+
+
+def round_like_sqlite(values, digits=0):
+    """
+    ROUND(value, digits) for an array of floats with SQLite's results. Rounding to a whole
+    number is the same half-away-from-zero expression SQLite evaluates; other digits go
+    through SQLite itself, whose printf-based rounding Python's round() does not reproduce.
+    """
+    if digits == 0:
+        magnitude = np.floor(np.abs(values) + 0.5)
+        rounded = np.where(values < 0, -magnitude, magnitude)
+        # doubles this large are already whole numbers
+        return np.where(np.abs(values) < 2.0 ** 52, rounded, values)
+    with contextlib.closing(sqlite3.connect(':memory:')) as conn:
+        conn.execute("CREATE TABLE RoundInput (Value REAL)")
+        conn.executemany("INSERT INTO RoundInput VALUES (?)", ((value,) for value in values.tolist()))
+        rounded = conn.execute("SELECT ROUND(Value, ?) FROM RoundInput ORDER BY rowid", (digits,)).fetchall()
+    return np.array([row[0] for row in rounded], dtype=np.float64)
+
+
+def group_totals(group_codes, line_totals, group_count):
+    """
+    Sum line_totals per group code. bincount adds in array order, as SQLite's SUM() does.
+    Returns (codes of the groups that have rows, their totals).
+    """
+    totals = np.bincount(group_codes, weights=line_totals, minlength=group_count)
+    present = np.flatnonzero(np.bincount(group_codes, minlength=group_count))
+    return present, totals[present]
+
+
+def name_codes(names):
+    """
+    Code every name in an object array by its position in sorted order, so grouping on the
+    codes visits groups in the order SQLite's GROUP BY on the text column does.
+    Returns (codes, sorted distinct names).
+    """
+    distinct = sorted({name for name in names.tolist() if name is not None})
+    position = {name: code for code, name in enumerate(distinct)}
+    return np.array([position.get(name, 0) for name in names.tolist()], dtype=np.int64), distinct
+
+
+def partition_rank(partitions, values):
+    """
+    RANK() for rows already sorted by partition and then by value: rows with equal values
+    share a rank and the next distinct value skips ahead, restarting at 1 per partition.
+    """
+    positions = np.arange(len(values))
+    partition_starts = np.r_[True, partitions[1:] != partitions[:-1]]
+    value_starts = partition_starts | np.r_[True, values[1:] != values[:-1]]
+    first_in_partition = np.maximum.accumulate(np.where(partition_starts, positions, 0))
+    first_with_value = np.maximum.accumulate(np.where(value_starts, positions, 0))
+    return first_with_value - first_in_partition + 1
+
+
+def descending(values):
+    """
+    Indices that sort values largest first, ties in the reverse of their current order:
+    that is the order SQLite's sorter returns tied rows in when it sorts the rows coming
+    straight out of a GROUP BY (a window over a grouped CTE sees them in group order).
+    """
+    return len(values) - 1 - np.argsort(-values[::-1], kind='stable')
+
+
+def columnar_ex3(tables):
+    customer_ids, totals = group_totals(tables.order_customer_ids, tables.line_totals,
+                                        len(tables.customer_first_names))
+    totals = round_like_sqlite(totals, 2)
+    order = descending(totals)
+    names = tables.customer_first_names[customer_ids] + ' ' + tables.customer_last_names[customer_ids]
+    return list(zip(names[order].tolist(), totals[order].tolist()))
+
+
+def columnar_ex4(tables):
+    order_region_ids = tables.country_region_ids[tables.order_country_ids()]
+    region_ids, totals = group_totals(order_region_ids, tables.line_totals, len(tables.region_names))
+    totals = round_like_sqlite(totals, 2)
+    order = descending(totals)
+    return list(zip(tables.region_names[region_ids][order].tolist(), totals[order].tolist()))
+
+
+def columnar_ex5(tables):
+    country_codes, country_names = name_codes(tables.country_names)
+    codes, totals = group_totals(country_codes[tables.order_country_ids()], tables.line_totals, len(country_names))
+    totals = round_like_sqlite(totals)
+    order = descending(totals)
+    return list(zip(np.array(country_names, dtype=object)[codes][order].tolist(), totals[order].tolist()))
+
+
+def country_totals_by_region(tables):
+    """
+    Totals grouped by (Region, Country) name in GROUP BY order.
+    Returns (region names, country names, region codes, unrounded totals) per group.
+    """
+    country_region_names = tables.region_names[tables.country_region_ids]
+    pair_names = np.empty(len(tables.country_names), dtype=object)
+    pair_names[:] = [None if country is None else (region, country)
+                     for region, country in zip(country_region_names.tolist(), tables.country_names.tolist())]
+    pair_codes, pairs = name_codes(pair_names)
+    codes, totals = group_totals(pair_codes[tables.order_country_ids()], tables.line_totals, len(pairs))
+    region_names = np.array([pairs[code][0] for code in codes.tolist()], dtype=object)
+    country_names = np.array([pairs[code][1] for code in codes.tolist()], dtype=object)
+    region_codes, _ = name_codes(region_names)
+    return region_names, country_names, region_codes, totals
+
+
+def ranked_within_region(tables, rank_rounded):
+    region_names, country_names, region_codes, totals = country_totals_by_region(tables)
+    rounded = round_like_sqlite(totals)
+    rank_values = rounded if rank_rounded else totals
+    # ex6 ranks over the CountryTotals CTE and keeps tied countries in name order; ex7's window
+    # sorts the GROUP BY rows themselves, which returns them in reverse name order
+    groups = np.arange(len(totals))
+    order = np.lexsort((groups if rank_rounded else -groups, -rank_values, region_codes))
+    ranks = partition_rank(region_codes[order], rank_values[order])
+    return region_names[order], country_names[order], rounded[order], ranks
+
+
+def columnar_ex6(tables):
+    region_names, country_names, totals, ranks = ranked_within_region(tables, rank_rounded=True)
+    return list(zip(region_names.tolist(), country_names.tolist(), totals.tolist(), ranks.tolist()))
+
+
+def columnar_ex7(tables):
+    # ex7 ranks on the unrounded sum
+    region_names, country_names, totals, ranks = ranked_within_region(tables, rank_rounded=False)
+    top = ranks == 1
+    return list(zip(region_names[top].tolist(), country_names[top].tolist(), totals[top].tolist(),
+                    ranks[top].tolist()))
+
+
+def customer_quarter_totals(tables):
+    """
+    Rounded totals grouped by (Quarter, Year, CustomerID) in GROUP BY order.
+    Returns (quarter indexes, years, customer IDs, totals) per group.
+    """
+    years = tables.order_years()
+    first_year = int(years.min(initial=0))
+    year_count = int(years.max(initial=0)) - first_year + 1
+    customer_count = len(tables.customer_first_names)
+    keys = (tables.order_quarters() * year_count + (years - first_year)) * customer_count + tables.order_customer_ids
+    group_keys, group_codes = np.unique(keys, return_inverse=True)
+    _, totals = group_totals(group_codes.ravel(), tables.line_totals, len(group_keys))
+    customer_ids = group_keys % customer_count
+    quarters, years = np.divmod(group_keys // customer_count, year_count)
+    return quarters, years + first_year, customer_ids, round_like_sqlite(totals)
+
+
+def quarter_rows(quarters, years, customer_ids, totals, *extra):
+    return list(zip([f'Q{quarter + 1}' for quarter in quarters.tolist()],
+                    years.tolist(), customer_ids.tolist(), totals.tolist(), *(column.tolist() for column in extra)))
+
+
+def columnar_ex8(tables):
+    quarters, years, customer_ids, totals = customer_quarter_totals(tables)
+    order = np.lexsort((customer_ids, quarters, years))
+    return quarter_rows(quarters[order], years[order], customer_ids[order], totals[order])
+
+
+def columnar_ex9(tables):
+    quarters, years, customer_ids, totals = customer_quarter_totals(tables)
+    # RANK() OVER (PARTITION BY Quarter, Year ORDER BY Total DESC); groups are in CustomerID order within a partition
+    order = np.lexsort((customer_ids, -totals, years, quarters))
+    quarters, years, customer_ids, totals = quarters[order], years[order], customer_ids[order], totals[order]
+    ranks = partition_rank(quarters * (years.max(initial=0) + 1) + years, totals)
+    top = np.flatnonzero(ranks <= 5)
+    top = top[np.lexsort((customer_ids[top], ranks[top], quarters[top], years[top]))]
+    return quarter_rows(quarters[top], years[top], customer_ids[top], totals[top], ranks[top])
+
+
+def columnar_ex10(tables):
+    month_codes, names = name_codes(np.array(MONTH_NAMES, dtype=object)[tables.order_months() - 1])
+    codes, totals = group_totals(month_codes, round_like_sqlite(tables.line_totals), len(names))
+    # ROW_NUMBER() runs over the MonthlySales CTE, so tied months stay in month name order
+    order = np.argsort(-totals, kind='stable')
+    return list(zip(np.array(names, dtype=object)[codes][order].tolist(), totals[order].tolist(),
+                    range(1, len(order) + 1)))
+
+
+def columnar_ex11(tables):
+    dates = tables.order_dates
+    distinct_dates, date_codes = np.unique(dates, return_inverse=True)
+    date_codes = date_codes.ravel()
+    date_strings = np.array([f'{date // 10000:04d}-{date // 100 % 100:02d}-{date % 100:02d}'
+                             for date in distinct_dates.tolist()], dtype=object)
+    day_numbers = np.array([datetime.date(date // 10000, date // 100 % 100, date % 100).toordinal()
+                            for date in distinct_dates.tolist()], dtype=np.float64)[date_codes]
+
+    # LAG(OrderDate) OVER (PARTITION BY CustomerID ORDER BY OrderDate)
+    order = np.lexsort((date_codes, tables.order_customer_ids))
+    customer_ids = tables.order_customer_ids[order]
+    has_previous = np.flatnonzero(customer_ids[1:] == customer_ids[:-1]) + 1
+    gaps = day_numbers[order][has_previous] - day_numbers[order][has_previous - 1]
+    gap_customer_ids = customer_ids[has_previous]
+
+    # MAX() per customer takes the bare columns from the first row holding the maximum
+    by_gap = np.lexsort((has_previous, -gaps, gap_customer_ids))
+    firsts = by_gap[np.r_[True, gap_customer_ids[by_gap][1:] != gap_customer_ids[by_gap][:-1]]]
+    firsts = firsts[descending(gaps[firsts])]
+
+    rows = has_previous[firsts]
+    customers = gap_customer_ids[firsts]
+    return list(zip(customers.tolist(),
+                    tables.customer_first_names[customers].tolist(),
+                    tables.customer_last_names[customers].tolist(),
+                    tables.country_names[tables.customer_country_ids[customers]].tolist(),
+                    date_strings[date_codes[order][rows]].tolist(),
+                    date_strings[date_codes[order][rows - 1]].tolist(),
+                    gaps[firsts].tolist()))
+
+
+COLUMNAR_KERNELS = {
+    'ex3': columnar_ex3,
+    'ex4': columnar_ex4,
+    'ex5': columnar_ex5,
+    'ex6': columnar_ex6,
+    'ex7': columnar_ex7,
+    'ex8': columnar_ex8,
+    'ex9': columnar_ex9,
+    'ex10': columnar_ex10,
+    'ex11': columnar_ex11,
+}
+
+
+def run_columnar_queries(normalized_database_filename, query_names=COLUMNAR_QUERY_NAMES, max_workers=None):
+    """
+    Load the tables into arrays once and compute the given exN results with the columnar
+    kernels, which run concurrently on a thread pool; NumPy releases the GIL inside its
+    array operations, so independent kernels use separate cores.
+    Returns {query_name: rows} with the same rows, in the same order, as the SQL queries.
+    """
+    require_numpy()
+    unknown = [query_name for query_name in query_names if query_name not in COLUMNAR_KERNELS]
+    if unknown:
+        raise ValueError(f"No columnar kernel for: {', '.join(unknown)}")
+
+    conn = create_connection(normalized_database_filename)
+    try:
+        with phase('columnar.load'):
+            tables = ColumnarTables(conn)
+    finally:
+        conn.close()
+
+    max_workers = max_workers or min(len(query_names), os.cpu_count() or 1)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {query_name: executor.submit(COLUMNAR_KERNELS[query_name], tables) for query_name in query_names}
+        return {query_name: future.result() for query_name, future in futures.items()}
+
+
+def rows_match(actual_rows, expected_rows, tolerance=1e-6):
+    """
+    Compare result rows cell by cell: numbers within tolerance, everything else as text,
+    so rows read back from a CSV file compare equal to the typed rows of a query.
+    Returns the index of the first differing row, or None when they all match.
+    """
+    for index, (actual, expected) in enumerate(itertools.zip_longest(actual_rows, expected_rows)):
+        if actual is None or expected is None or len(actual) != len(expected):
+            return index
+        for actual_value, expected_value in zip(actual, expected):
+            if isinstance(actual_value, float):
+                try:
+                    if abs(actual_value - float(expected_value)) <= tolerance:
+                        continue
+                except (TypeError, ValueError):
+                    pass
+                return index
+            if str(actual_value) != str(expected_value):
+                return index
+    return None
+
+
+def check_columnar_backend(normalized_database_filename, expected_directory=None, tolerance=1e-6):
+    """
+    Compare the columnar results for ex3-ex11 with the SQL queries on the same database and,
+    if expected_directory is given, with the exN.csv files in it.
+    Returns {query_name: [description of each mismatch]}, empty lists meaning all agree.
+    """
+    columnar_results = run_columnar_queries(normalized_database_filename)
+    conn = create_connection(normalized_database_filename)
+    mismatches = {}
+    try:
+        for query_name, rows in columnar_results.items():
+            mismatches[query_name] = []
+            sql_statement, parameters = export_query_statement(conn, query_name)
+            row = rows_match(rows, conn.execute(sql_statement, parameters).fetchall(), tolerance)
+            if row is not None:
+                mismatches[query_name].append(f"differs from SQLite at row {row}")
+            if expected_directory is not None:
+                with open(os.path.join(expected_directory, f'{query_name}.csv'), newline='') as file:
+                    expected = list(csv.reader(file))[1:]
+                row = rows_match(rows, expected, tolerance)
+                if row is not None:
+                    mismatches[query_name].append(f"differs from {query_name}.csv at row {row}")
+    finally:
+        conn.close()
+
+    for query_name, problems in mismatches.items():
+        print(f"{query_name}: {'OK' if not problems else '; '.join(problems)}")
+    return mismatches
+
+
+### Pipeline Runner
+
+PIPELINE_VERSION = 1
+
+# table -> (step that writes it, tables it reads)
+PIPELINE_STEPS = {
+    'Region': ('step1', ()),
+    'Country': ('step3', ('Region',)),
+    'Customer': ('step5', ('Country',)),
+    'ProductCategory': ('step7', ()),
+    'Product': ('step9', ('ProductCategory',)),
+    'OrderDetail': ('step11', ('Customer', 'Product')),
+}
+
+PIPELINE_STATE_SQL = '''
+CREATE TABLE IF NOT EXISTS PipelineState (
+    TableName TEXT PRIMARY KEY,
+    Fingerprint TEXT NOT NULL,
+    Seconds REAL NOT NULL
+);
+'''
+
+
+def pipeline_step_function(table_name):
+    return {
+        'Region': step1_create_region_table,
+        'Country': step3_create_country_table,
+        'Customer': step5_create_customer_table,
+        'ProductCategory': step7_create_productcategory_table,
+        'Product': step9_create_product_table,
+        'OrderDetail': step11_create_orderdetail_table,
+    }[table_name]
+
+
+def pipeline_branches(steps=PIPELINE_STEPS):
+    """
+    Split the DAG into independent branches and the join steps that need several of them.
+    A branch is a connected group of steps with at most one input each, e.g.
+    Region -> Country -> Customer; steps in different branches never share a table.
+    """
+    joins = [table for table, (_, requires) in steps.items() if len(requires) > 1]
+    branch_of = {}
+    branches = []
+    for table, (_, requires) in steps.items():
+        if table in joins:
+            continue
+        parent = requires[0] if requires else None
+        if parent in branch_of:
+            branch_of[table] = branch_of[parent]
+            branches[branch_of[table]].append(table)
+        else:
+            branch_of[table] = len(branches)
+            branches.append([table])
+    return branches, joins
+
+
+def source_fingerprint(data_filename):
+    """
+    Return a digest of the source file contents.
+    """
+    digest = hashlib.sha1()
+    with open(data_filename, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def step_fingerprints(source_digest, steps=PIPELINE_STEPS):
+    """
+    Fingerprint every step from the source digest and the fingerprints of its inputs,
+    so a change upstream invalidates everything that depends on it.
+    """
+    fingerprints = {}
+
+    def fingerprint(table):
+        if table not in fingerprints:
+            step_name, requires = steps[table]
+            parts = [str(PIPELINE_VERSION), table, step_name, source_digest] + [fingerprint(r) for r in requires]
+            fingerprints[table] = hashlib.sha1('|'.join(parts).encode()).hexdigest()
+        return fingerprints[table]
+
+    for table in steps:
+        fingerprint(table)
+    return fingerprints
+
+
+def read_pipeline_state(conn):
+    """
+    Return {table: (fingerprint, seconds)} for the tables whose recorded state is still valid.
+    """
+    conn.execute(PIPELINE_STATE_SQL)
+    state = {}
+    for table, fingerprint, seconds in conn.execute("SELECT TableName, Fingerprint, Seconds FROM PipelineState"):
+        if table_exists(conn, table):
+            state[table] = (fingerprint, seconds)
+    return state
+
+
+def clear_pipeline_state(conn, table_names=None):
+    """
+    Forget the recorded pipeline state of tables that a loader rewrote outside of a pipeline
+    run, every table by default, so the next run_pipeline rebuilds them instead of skipping
+    them. Committing is left to the caller, so the state goes with the load it describes.
+    """
+    if not table_exists(conn, 'PipelineState'):
+        return
+    if table_names is None:
+        conn.execute("DELETE FROM PipelineState")
+    else:
+        conn.executemany("DELETE FROM PipelineState WHERE TableName = ?", [(table,) for table in table_names])
+
+
+def run_branch(data_filename, staging_filename, tables):
+    """
+    Run the steps of one branch in order into a staging database; returns {table: seconds}.
+    """
+    timings = {}
+    for table in tables:
+        start = time.perf_counter()
+        pipeline_step_function(table)(data_filename, staging_filename)
+        timings[table] = time.perf_counter() - start
+    return timings
+
+
+def copy_staged_tables(conn, staging_filename, tables):
+    """
+    Replace tables of the target database with their staged copies and rebuild their indexes.
+    """
+    conn.execute("ATTACH DATABASE ? AS staging", (staging_filename,))
+    try:
+        for table in tables:
+            # qualified: with staging attached, an unqualified name may resolve to the staged table
+            create_table(conn, TABLE_SCHEMAS[table], drop_table_name=f'main.{table}')
+            conn.execute(f"INSERT INTO main.{table} SELECT * FROM staging.{table}")
+            create_query_indexes(conn, table)
+            # commit per table: create_table can only switch foreign keys off outside a transaction
+            conn.commit()
+    finally:
+        conn.rollback()
+        conn.execute("DETACH DATABASE staging")
+
+
+def remove_database_files(db_file):
+    for suffix in ('', '-journal', '-wal', '-shm'):
+        if os.path.exists(db_file + suffix):
+            os.remove(db_file + suffix)
+
+
+@instrumented('pipeline')
+def run_pipeline(data_filename, normalized_database_filename='normalized.db', force=False, concurrent_branches=True):
+    """
+    Build the normalized database by running the step DAG. Independent branches run
+    concurrently, each into its own staging database, and are copied into the target when
+    they finish; the join steps then run on the target. A step is skipped when its table
+    exists and its fingerprint (source contents plus upstream fingerprints) matches the
+    last run. Returns the report printed by print_pipeline_report.
+    """
+    wall_start = time.perf_counter()
+    fingerprints = step_fingerprints(source_fingerprint(data_filename))
+    conn = create_connection(normalized_database_filename)
+    state = {} if force else read_pipeline_state(conn)
+    conn.close()
+
+    to_run = set()
+    for table, (_, requires) in PIPELINE_STEPS.items():
+        recorded = state.get(table)
+        if recorded is None or recorded[0] != fingerprints[table] or any(r in to_run for r in requires):
+            to_run.add(table)
+
+    branches, joins = pipeline_branches()
+    # a staging database starts empty, so a branch with any stale step is rebuilt from its first step
+    pending = [branch for branch in branches if any(table in to_run for table in branch)]
+    to_run.update(table for branch in pending for table in branch)
+    to_run.update(table for table in joins if any(r in to_run for r in PIPELINE_STEPS[table][1]))
+    timings = {}
+    branch_wall_seconds = 0.0
+
+    parse_seconds = 0.0
+    if to_run:
+        start = time.perf_counter()
+        load_data_file(data_filename, include_orders=False)
+        parse_seconds = time.perf_counter() - start
+    if pending:
+        staging = {i: f"{normalized_database_filename}.staging{i}.db" for i in range(len(pending))}
+        for staging_filename in staging.values():
+            remove_database_files(staging_filename)
+        try:
+            workers = len(pending) if concurrent_branches else 1
+            start = time.perf_counter()
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(run_branch, data_filename, staging[i], tables): i
+                           for i, tables in enumerate(pending)}
+                results = {futures[future]: future.result() for future in concurrent.futures.as_completed(futures)}
+            branch_wall_seconds = time.perf_counter() - start
+            conn = create_connection(normalized_database_filename)
+            try:
+                for i, tables in enumerate(pending):
+                    start = time.perf_counter()
+                    copy_staged_tables(conn, staging[i], tables)
+                    timings.update(results[i])
+                    timings['copy ' + '/'.join(tables)] = time.perf_counter() - start
+            finally:
+                conn.close()
+            invalidate_dimension_cache(normalized_database_filename)
+        finally:
+            for staging_filename in staging.values():
+                invalidate_dimension_cache(staging_filename)
+                remove_database_files(staging_filename)
+
+    for table in joins:
+        if table in to_run:
+            start = time.perf_counter()
+            pipeline_step_function(table)(data_filename, normalized_database_filename)
+            timings[table] = time.perf_counter() - start
+
+    conn = create_connection(normalized_database_filename)
+    try:
+        conn.execute(PIPELINE_STATE_SQL)
+        # skipped steps are recorded again too: step11 on the target clears the state of OrderDetail
+        conn.executemany("INSERT OR REPLACE INTO PipelineState (TableName, Fingerprint, Seconds) VALUES (?, ?, ?)",
+                         [(table, fingerprints[table], timings[table] if table in timings else state[table][1])
+                          for table in PIPELINE_STEPS])
+        conn.commit()
+    finally:
+        conn.close()
+
+    branch_seconds = sum(timings[table] for branch in pending for table in branch)
+    report = {
+        'ran': {table: timings[table] for table in PIPELINE_STEPS if table in timings},
+        'skipped': {table: state[table][1] for table in PIPELINE_STEPS if table not in to_run},
+        'parse_seconds': parse_seconds,
+        'wall_seconds': time.perf_counter() - wall_start,
+        'concurrency_saved_seconds': branch_seconds - branch_wall_seconds if concurrent_branches else 0.0,
+    }
+    report['skip_saved_seconds'] = sum(report['skipped'].values())
+    print_pipeline_report(report)
+    return report
+
+
+def print_pipeline_report(report):
+    """
+    Print the steps that ran or were skipped and the wall-clock time saved against running
+    every step serially.
+    """
+    for table, (step_name, _) in PIPELINE_STEPS.items():
+        if table in report['ran']:
+            print(f"{step_name:7} {table:16} ran in {report['ran'][table]:.3f}s")
+        else:
+            print(f"{step_name:7} {table:16} skipped (unchanged, last run {report['skipped'][table]:.3f}s)")
+    saved = report['concurrency_saved_seconds'] + report['skip_saved_seconds']
+    print(f"Source parsed once in {report['parse_seconds']:.3f}s")
+    print(f"Wall clock {report['wall_seconds']:.3f}s; saved {saved:.3f}s against serial execution "
+          f"({report['concurrency_saved_seconds']:.3f}s from concurrent branches, "
+          f"{report['skip_saved_seconds']:.3f}s from skipped steps).")
+
+
+### Order Partitions
+
+ORDER_PARTITION_GRANULARITIES = ('year', 'quarter')
+# bounds used for an open start or end date
+FIRST_ORDER_DATE = '0000-01-01'
+LAST_ORDER_DATE = '9999-12-31'
+
+# Manifest of the partition files in the main database; the dates bound the partition key,
+# not the orders actually present.
+ORDER_PARTITION_TABLE_SQL = '''
+CREATE TABLE IF NOT EXISTS OrderPartition (
+    PartitionKey TEXT PRIMARY KEY,
+    FirstOrderDate TEXT NOT NULL,
+    LastOrderDate TEXT NOT NULL,
+    FileName TEXT NOT NULL,
+    Rows INTEGER NOT NULL
+);
+'''
+
+# Months of OrderDetail written since the partitions were, recorded by the triggers below.
+# A full load recreates OrderDetail, which drops the triggers, so every partition is then out
+# of date; changed_order_months tells the two cases apart.
+ORDER_PARTITION_CHANGE_SQL = '''
+CREATE TABLE IF NOT EXISTS OrderPartitionChange (
+    OrderMonth TEXT PRIMARY KEY
+) WITHOUT ROWID;
+'''
+
+ORDER_PARTITION_TRIGGERS = {
+    'trg_OrderDetail_PartitionInsert': '''
+    CREATE TRIGGER IF NOT EXISTS trg_OrderDetail_PartitionInsert AFTER INSERT ON OrderDetail
+    BEGIN
+        INSERT OR IGNORE INTO OrderPartitionChange VALUES (SUBSTR(NEW.OrderDate, 1, 7));
+    END;
+    ''',
+    'trg_OrderDetail_PartitionUpdate': '''
+    CREATE TRIGGER IF NOT EXISTS trg_OrderDetail_PartitionUpdate AFTER UPDATE ON OrderDetail
+    BEGIN
+        INSERT OR IGNORE INTO OrderPartitionChange VALUES (SUBSTR(OLD.OrderDate, 1, 7));
+        INSERT OR IGNORE INTO OrderPartitionChange VALUES (SUBSTR(NEW.OrderDate, 1, 7));
+    END;
+    ''',
+    'trg_OrderDetail_PartitionDelete': '''
+    CREATE TRIGGER IF NOT EXISTS trg_OrderDetail_PartitionDelete AFTER DELETE ON OrderDetail
+    BEGIN
+        INSERT OR IGNORE INTO OrderPartitionChange VALUES (SUBSTR(OLD.OrderDate, 1, 7));
+    END;
+    ''',
+}
+
+# OrderDetail inside a partition file; the foreign keys cannot point into the main database.
+PARTITION_ORDERDETAIL_SQL = '''
+CREATE TABLE OrderDetail (
+    OrderID INTEGER PRIMARY KEY,
+    CustomerID INTEGER NOT NULL,
+    ProductID INTEGER NOT NULL,
+    OrderDate TEXT NOT NULL,
+    QuantityOrdered INTEGER NOT NULL
+);
+'''
+
+# Per-partition aggregates. They run on a partition file with the main database attached for
+# the dimension tables, and only over the orders between the two date parameters.
+PARTITION_PARTIAL_SQL = {
+    'Customer': ('CustomerID INTEGER, Total REAL', '''
+    SELECT od.CustomerID, SUM(p.ProductUnitPrice * od.QuantityOrdered)
+    FROM OrderDetail od
+    JOIN Product p ON od.ProductID = p.ProductID
+    WHERE od.OrderDate BETWEEN ? AND ?
+    GROUP BY od.CustomerID
+    '''),
+    'Region': ('RegionID INTEGER, Total REAL', '''
+    SELECT co.RegionID, SUM(p.ProductUnitPrice * od.QuantityOrdered)
+    FROM OrderDetail od
+    JOIN Product p ON od.ProductID = p.ProductID
+    JOIN Customer c ON od.CustomerID = c.CustomerID
+    JOIN Country co ON c.CountryID = co.CountryID
+    WHERE od.OrderDate BETWEEN ? AND ?
+    GROUP BY co.RegionID
+    '''),
+    'Country': ('Country TEXT, Total REAL', '''
+    SELECT co.Country, SUM(p.ProductUnitPrice * od.QuantityOrdered)
+    FROM OrderDetail od
+    JOIN Customer c ON od.CustomerID = c.CustomerID
+    JOIN Product p ON od.ProductID = p.ProductID
+    JOIN Country co ON c.CountryID = co.CountryID
+    WHERE od.OrderDate BETWEEN ? AND ?
+    GROUP BY co.Country
+    '''),
+    'RegionCountry': ('Region TEXT, Country TEXT, Total REAL', '''
+    SELECT r.Region, co.Country, SUM(od.QuantityOrdered * p.ProductUnitPrice)
+    FROM OrderDetail od
+    JOIN Customer c ON od.CustomerID = c.CustomerID
+    JOIN Country co ON c.CountryID = co.CountryID
+    JOIN Region r ON co.RegionID = r.RegionID
+    JOIN Product p ON od.ProductID = p.ProductID
+    WHERE od.OrderDate BETWEEN ? AND ?
+    GROUP BY r.Region, co.Country
+    '''),
+    'CustomerQuarter': ('Quarter TEXT, Year INTEGER, CustomerID INTEGER, Total REAL', '''
+    SELECT
+        CASE
+            WHEN CAST(SUBSTR(od.OrderDate, 6, 2) AS INTEGER) IN (1, 2, 3) THEN 'Q1'
+            WHEN CAST(SUBSTR(od.OrderDate, 6, 2) AS INTEGER) IN (4, 5, 6) THEN 'Q2'
+            WHEN CAST(SUBSTR(od.OrderDate, 6, 2) AS INTEGER) IN (7, 8, 9) THEN 'Q3'
+            ELSE 'Q4'
+        END AS Quarter,
+        CAST(SUBSTR(od.OrderDate, 1, 4) AS INTEGER) AS Year,
+        od.CustomerID,
+        SUM(od.QuantityOrdered * p.ProductUnitPrice)
+    FROM OrderDetail od
+    JOIN Product p ON od.ProductID = p.ProductID
+    WHERE od.OrderDate BETWEEN ? AND ?
+    GROUP BY Quarter, Year, od.CustomerID
+    '''),
+    'Month': ('Month TEXT, Total REAL', f'''
+    SELECT
+        CASE CAST(SUBSTR(od.OrderDate, 6, 2) AS INTEGER)
+            {' '.join(f"WHEN {number} THEN '{name}'" for number, name in enumerate(MONTH_NAMES, 1))}
+        END AS Month,
+        SUM(ROUND(p.ProductUnitPrice * od.QuantityOrdered, 0))
+    FROM OrderDetail od
+    JOIN Product p ON od.ProductID = p.ProductID
+    WHERE od.OrderDate BETWEEN ? AND ?
+    GROUP BY Month
+    '''),
+}
+
+# query -> (partial aggregate, merge over the PartialTotal rows of every partition). The merges
+# keep the shape of the exN queries, so ranks and the order of tied rows come out the same.
+PARTITION_MERGE_SQL = {
+    'ex3': ('Customer', '''
+    SELECT (c.FirstName || ' ' || c.LastName) AS Name, ROUND(SUM(pt.Total), 2) AS Total
+    FROM PartialTotal pt
+    JOIN Customer c ON pt.CustomerID = c.CustomerID
+    GROUP BY c.CustomerID
+    ORDER BY Total DESC
+    '''),
+    'ex4': ('Region', '''
+    SELECT r.Region, ROUND(SUM(pt.Total), 2) AS Total
+    FROM PartialTotal pt
+    JOIN Region r ON pt.RegionID = r.RegionID
+    GROUP BY r.RegionID
+    ORDER BY Total DESC
+    '''),
+    'ex5': ('Country', '''
+    SELECT Country, ROUND(SUM(Total), 0) AS Total
+    FROM PartialTotal
+    GROUP BY Country
+    ORDER BY Total DESC
+    '''),
+    'ex6': ('RegionCountry', '''
+    WITH CountryTotals AS (
+        SELECT Region, Country, ROUND(SUM(Total)) AS CountryTotal
+        FROM PartialTotal
+        GROUP BY Region, Country
+    )
+    SELECT Region, Country, CountryTotal, RANK() OVER (PARTITION BY Region ORDER BY CountryTotal DESC) AS TotalRank
+    FROM CountryTotals
+    ORDER BY Region ASC, CountryTotal DESC
+    '''),
+    'ex7': ('RegionCountry', '''
+    WITH CountryTotals AS (
+        SELECT
+            Region,
+            Country,
+            ROUND(SUM(Total)) AS CountryTotal,
+            RANK() OVER (PARTITION BY Region ORDER BY SUM(Total) DESC) AS CountryRegionalRank
+        FROM PartialTotal
+        GROUP BY Region, Country
+    )
+    SELECT Region, Country, CountryTotal, CountryRegionalRank
+    FROM CountryTotals
+    WHERE CountryRegionalRank = 1
+    ORDER BY Region ASC
+    '''),
+    'ex8': ('CustomerQuarter', '''
+    WITH CustomerSales AS (
+        SELECT Quarter, Year, CustomerID, ROUND(SUM(Total)) AS Total
+        FROM PartialTotal
+        GROUP BY Quarter, Year, CustomerID
+    )
+    SELECT Quarter, Year, CustomerID, Total
+    FROM CustomerSales
+    ORDER BY Year, Quarter, CustomerID
+    '''),
+    'ex9': ('CustomerQuarter', '''
+    WITH CustomerSales AS (
+        SELECT Quarter, Year, CustomerID, ROUND(SUM(Total)) AS Total
+        FROM PartialTotal
+        GROUP BY Quarter, Year, CustomerID
     ),
-    DaysBetweenOrders AS (
-        SELECT
-            od.CustomerID,
-            c.FirstName,
-            c.LastName,
-            co.country AS Country,
-            od.OrderDate,
-            od.PreviousOrderDate,
-            JULIANDAY(od.OrderDate) - JULIANDAY(od.PreviousOrderDate) AS DaysBetweenOrders
-        FROM
-            OrderDates od
-            JOIN Customer c ON od.CustomerID = c.CustomerID
-            JOIN Country co ON c.CountryID = co.CountryID
-        WHERE
-            od.PreviousOrderDate IS NOT NULL
+    RankedSales AS (
+        SELECT Quarter, Year, CustomerID, Total,
+               RANK() OVER (PARTITION BY Quarter, Year ORDER BY Total DESC) AS CustomerRank
+        FROM CustomerSales
     )
-    SELECT
-        CustomerID,
-        FirstName,
-        LastName,
-        Country,
-        OrderDate,
-        PreviousOrderDate,
-        MAX(DaysBetweenOrders) AS MaxDaysWithoutOrder
-    FROM
-        DaysBetweenOrders
-    GROUP BY
-        CustomerID
-    ORDER BY
-        MaxDaysWithoutOrder DESC
+    SELECT Quarter, Year, CustomerID, Total, CustomerRank
+    FROM RankedSales
+    WHERE CustomerRank <= 5
+    ORDER BY Year, Quarter, CustomerRank
+    '''),
+    'ex10': ('Month', '''
+    WITH MonthlySales AS (
+        SELECT SUM(Total) AS Total, Month
+        FROM PartialTotal
+        GROUP BY Month
+    )
+    SELECT Month, Total, ROW_NUMBER() OVER (ORDER BY Total DESC) AS TotalRank
+    FROM MonthlySales
+    ORDER BY Total DESC
+    '''),
+}
+
+
+def order_partition_key(order_date, granularity='year'):
     """
-    return sql_statement
+    Partition key of a YYYY-MM-DD order date: '2013' by year, '2013Q2' by quarter.
+    """
+    if granularity == 'year':
+        return order_date[:4]
+    if granularity == 'quarter':
+        return f"{order_date[:4]}Q{(int(order_date[5:7]) + 2) // 3}"
+    raise ValueError(f"Unknown partition granularity: {granularity}")
+
+
+def order_partition_bounds(partition_key):
+    """
+    (first, last) YYYY-MM-DD bounds of a partition key; every date of the key compares between them.
+    """
+    year, _, quarter = partition_key.partition('Q')
+    if not (len(year) == 4 and year.isdigit() and quarter in ('', '1', '2', '3', '4')) or partition_key.endswith('Q'):
+        raise ValueError(f"Invalid partition key: {partition_key}")
+    if not quarter:
+        return f'{year}-01-01', f'{year}-12-31'
+    last_month = 3 * int(quarter)
+    return f'{year}-{last_month - 2:02d}-01', f'{year}-{last_month:02d}-31'
+
+
+def order_partition_filename(normalized_database_filename, partition_key):
+    return f'{normalized_database_filename}.orders{partition_key}.db'
+
+
+def order_partition_granularity(conn):
+    """
+    Granularity of the partitions in the manifest, read from their keys; 'year' if there are none.
+    """
+    row = conn.execute("SELECT PartitionKey FROM OrderPartition LIMIT 1").fetchone()
+    return 'quarter' if row is not None and 'Q' in row[0] else 'year'
+
+
+def changed_order_months(conn):
+    """
+    The YYYY-MM months whose OrderDetail rows changed since the partitions were written, or
+    None if OrderDetail was recreated since then and every partition is out of date.
+    """
+    triggers = {row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'OrderDetail'")}
+    if not triggers >= set(ORDER_PARTITION_TRIGGERS) or not table_exists(conn, 'OrderPartitionChange'):
+        return None
+    return [row[0] for row in conn.execute("SELECT OrderMonth FROM OrderPartitionChange ORDER BY OrderMonth")]
+
+
+def read_order_partitions(conn, start_date=None, end_date=None):
+    """
+    The manifest rows (key, first date, last date, file name) in key order, pruned to the
+    partitions that can hold orders between start_date and end_date.
+    """
+    if not table_exists(conn, 'OrderPartition'):
+        return []
+    return conn.execute("""
+        SELECT PartitionKey, FirstOrderDate, LastOrderDate, FileName
+        FROM OrderPartition
+        WHERE LastOrderDate >= ? AND FirstOrderDate <= ?
+        ORDER BY PartitionKey
+        """, (start_date or FIRST_ORDER_DATE, end_date or LAST_ORDER_DATE)).fetchall()
+
+
+def write_order_partition(conn, normalized_database_filename, partition_key, rows=None):
+    """
+    Write one partition file and its manifest row. rows are (OrderID, CustomerID, ProductID,
+    OrderDate, QuantityOrdered) tuples; by default the partition's orders are copied from
+    OrderDetail in the main database. The file is built beside the old one and then renamed
+    over it, so queries never see a half-written partition. Returns the number of rows.
+    """
+    first_date, last_date = order_partition_bounds(partition_key)
+    partition_filename = order_partition_filename(normalized_database_filename, partition_key)
+    building_filename = partition_filename + '.building'
+    remove_database_files(building_filename)
+
+    partition_conn = sqlite3.connect(building_filename)
+    try:
+        partition_conn.execute(PARTITION_ORDERDETAIL_SQL)
+        if rows is None:
+            partition_conn.execute("ATTACH DATABASE ? AS source", (normalized_database_filename,))
+            partition_conn.execute("""
+                INSERT INTO main.OrderDetail
+                SELECT OrderID, CustomerID, ProductID, OrderDate, QuantityOrdered
+                FROM source.OrderDetail
+                WHERE OrderDate BETWEEN ? AND ?
+                ORDER BY OrderID
+                """, (first_date, last_date))
+        else:
+            insert_in_chunks(partition_conn.cursor(), 'INSERT INTO OrderDetail VALUES (?, ?, ?, ?, ?)', rows)
+        partition_rows = partition_conn.execute("SELECT COUNT(*) FROM main.OrderDetail").fetchone()[0]
+        partition_conn.commit()
+    finally:
+        partition_conn.close()
+
+    if partition_rows:
+        os.replace(building_filename, partition_filename)
+        conn.execute("INSERT OR REPLACE INTO OrderPartition VALUES (?, ?, ?, ?, ?)",
+                     (partition_key, first_date, last_date, os.path.basename(partition_filename), partition_rows))
+    else:
+        remove_database_files(building_filename)
+        remove_database_files(partition_filename)
+        conn.execute("DELETE FROM OrderPartition WHERE PartitionKey = ?", (partition_key,))
+    return partition_rows
+
+
+def write_order_partitions(normalized_database_filename, granularity='year'):
+    """
+    Split OrderDetail into one database file per year or quarter next to the main database,
+    replacing any earlier partitions. OrderDetail itself is left in place for ex1, ex2, ex11
+    and the loaders, and triggers on it record the months written afterwards, so that
+    refresh_order_partitions can rewrite just those partitions. Returns {partition key: rows}.
+    """
+    conn = create_connection(normalized_database_filename)
+    try:
+        # holds off other writers, so OrderDetail cannot change between the copies and the manifest
+        conn.execute("BEGIN IMMEDIATE")
+        for partition_key, _, _, _ in read_order_partitions(conn):
+            remove_database_files(order_partition_filename(normalized_database_filename, partition_key))
+        create_table(conn, ORDER_PARTITION_TABLE_SQL, drop_table_name='OrderPartition')
+        create_table(conn, ORDER_PARTITION_CHANGE_SQL, drop_table_name='OrderPartitionChange')
+        for create_trigger_sql in ORDER_PARTITION_TRIGGERS.values():
+            conn.execute(create_trigger_sql)
+        months = [row[0] for row in conn.execute("SELECT DISTINCT SUBSTR(OrderDate, 1, 7) FROM OrderDetail")]
+        partition_keys = sorted({order_partition_key(month + '-01', granularity) for month in months})
+        partition_rows = {}
+        for partition_key in partition_keys:
+            with phase('partition', key=partition_key):
+                partition_rows[partition_key] = write_order_partition(conn, normalized_database_filename,
+                                                                      partition_key)
+        conn.commit()
+    finally:
+        conn.close()
+    return partition_rows
+
+
+def rebuild_order_partition(normalized_database_filename, partition_key):
+    """
+    Rebuild a single partition from its orders in OrderDetail without touching the others,
+    and clear its months from the recorded changes. Returns the number of rows.
+    """
+    first_date, last_date = order_partition_bounds(partition_key)
+    conn = create_connection(normalized_database_filename)
+    try:
+        if not table_exists(conn, 'OrderPartition'):
+            raise ValueError(f"{normalized_database_filename} has no order partitions; run write_order_partitions")
+        conn.execute("BEGIN IMMEDIATE")
+        if table_exists(conn, 'OrderPartitionChange'):
+            conn.execute("DELETE FROM OrderPartitionChange WHERE OrderMonth BETWEEN ? AND ?",
+                         (first_date[:7], last_date[:7]))
+        with phase('partition', key=partition_key):
+            partition_rows = write_order_partition(conn, normalized_database_filename, partition_key)
+        conn.commit()
+    finally:
+        conn.close()
+    return partition_rows
+
+
+def refresh_order_partitions(normalized_database_filename):
+    """
+    Bring the order partitions up to date after OrderDetail changed: rewrite the partitions of
+    the months written since, or all of them if OrderDetail was recreated. The loaders call
+    this after they commit; it does nothing for a database without partitions.
+    Returns {partition key: rows} of the rewritten partitions.
+    """
+    conn = create_connection(normalized_database_filename)
+    try:
+        if not table_exists(conn, 'OrderPartition'):
+            return {}
+        granularity = order_partition_granularity(conn)
+        conn.execute("BEGIN IMMEDIATE")
+        months = changed_order_months(conn)
+        partition_rows = {}
+        if months is not None:
+            conn.execute("DELETE FROM OrderPartitionChange")
+            for partition_key in sorted({order_partition_key(month + '-01', granularity) for month in months}):
+                with phase('partition', key=partition_key):
+                    partition_rows[partition_key] = write_order_partition(conn, normalized_database_filename,
+                                                                          partition_key)
+        conn.commit()
+    finally:
+        conn.close()
+    if months is None:
+        return write_order_partitions(normalized_database_filename, granularity)
+    return partition_rows
+
+
+def partition_partial_totals(normalized_database_filename, partition_filename, partial_sql, start_date, end_date):
+    """
+    Run a partial aggregate on one partition file over its own read-only connection.
+    """
+    conn = create_readonly_connection(partition_filename)
+    try:
+        uri = 'file:' + os.path.abspath(normalized_database_filename).replace('?', '%3f').replace('#', '%23')
+        conn.execute("ATTACH DATABASE ? AS dimensions", (uri + '?mode=ro',))
+        return run_query(conn, partial_sql, (start_date, end_date), query_name='partition')
+    finally:
+        conn.close()
+
+
+def partitioned_query(normalized_database_filename, query_name, start_date=None, end_date=None, max_workers=None):
+    """
+    Run ex3-ex10 over the order partitions, optionally only for orders between start_date and
+    end_date (YYYY-MM-DD, inclusive). Partitions outside the dates are never opened; the rest
+    compute their partial aggregates concurrently, one connection each, and the partial totals
+    are merged in partition order by the same grouping, ranking and ordering as the exN query.
+    ex8-ex10 return exactly the exN rows. ex3-ex7 add each group's per-partition sums instead of
+    all its lines in order, so their totals may differ in the last bits of the floats.
+    Raises ValueError if OrderDetail changed within the dates since the partitions were written.
+    """
+    if query_name not in PARTITION_MERGE_SQL:
+        raise ValueError(f"No partitioned form of {query_name}")
+    partial_name, merge_sql = PARTITION_MERGE_SQL[query_name]
+    partial_columns, partial_sql = PARTITION_PARTIAL_SQL[partial_name]
+
+    conn = create_connection(normalized_database_filename)
+    try:
+        partitions = read_order_partitions(conn, start_date, end_date)
+        if not partitions and not table_exists(conn, 'OrderPartition'):
+            raise ValueError(f"{normalized_database_filename} has no order partitions; run write_order_partitions")
+        months = changed_order_months(conn)
+        if months is None or any((start_date or FIRST_ORDER_DATE)[:7] <= month <= (end_date or LAST_ORDER_DATE)[:7]
+                                 for month in months):
+            raise ValueError(f"The order partitions of {normalized_database_filename} are out of date; "
+                             f"run refresh_order_partitions (refresh-partitions)")
+        directory = os.path.dirname(normalized_database_filename)
+        jobs = [(os.path.join(directory, file_name), max(first_date, start_date or FIRST_ORDER_DATE),
+                 min(last_date, end_date or LAST_ORDER_DATE))
+                for _, first_date, last_date, file_name in partitions]
+
+        max_workers = max_workers or max(1, min(len(jobs), os.cpu_count() or 1))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            partials = executor.map(
+                lambda job: partition_partial_totals(normalized_database_filename, job[0], partial_sql, job[1], job[2]),
+                jobs)
+            conn.execute(f"CREATE TEMP TABLE PartialTotal ({partial_columns})")
+            placeholders = ', '.join('?' * len(partial_columns.split(',')))
+            for rows in partials:
+                conn.executemany(f"INSERT INTO PartialTotal VALUES ({placeholders})", rows)
+        return run_query(conn, merge_sql, query_name=query_name)
+    finally:
+        conn.close()
+
+
+def check_order_partitions(normalized_database_filename, tolerance=1e-6):
+    """
+    Compare ex3-ex10 over the partitions with the exN queries on OrderDetail.
+    Returns {query_name: index of the first differing row, or None}.
+    """
+    conn = create_connection(normalized_database_filename)
+    try:
+        expected = {query_name: conn.execute(export_query_statement(conn, query_name)[0]).fetchall()
+                    for query_name in PARTITION_MERGE_SQL}
+    finally:
+        conn.close()
+    mismatches = {query_name: rows_match(partitioned_query(normalized_database_filename, query_name), rows, tolerance)
+                  for query_name, rows in expected.items()}
+    for query_name, row in mismatches.items():
+        print(f"{query_name}: {'OK' if row is None else f'differs at row {row}'}")
+    return mismatches
+
+
+### Command Line
+
+def cli(argv=None):
+    """
+    Command-line entry point: python main.py <command> ...
+    """
+    parser = argparse.ArgumentParser(prog='main.py', description='Data normalization and SQL query project.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    check_parser = subparsers.add_parser('check-rollups', help='verify the rollup tables against OrderDetail')
+    check_parser.add_argument('database', nargs='?', default='normalized.db')
+
+    export_parser = subparsers.add_parser('export', help='stream an exN result to CSV, JSON Lines or Parquet')
+    export_parser.add_argument('query', help='ex1 ... ex11')
+    export_parser.add_argument('output', help='output file; the extension selects format and compression')
+    export_parser.add_argument('--database', default='normalized.db')
+    export_parser.add_argument('--customer', help='customer name for ex1 and ex2')
+    export_parser.add_argument('--format', choices=['csv', 'jsonl', 'parquet'])
+    export_parser.add_argument('--compression', help='gzip, bz2 or xz; for parquet a Parquet codec')
+    export_parser.add_argument('--batch-size', type=int, default=EXPORT_BATCH_SIZE)
+
+    columnar_parser = subparsers.add_parser('check-columnar',
+                                            help='verify the columnar ex3-ex11 results against SQLite')
+    columnar_parser.add_argument('database', nargs='?', default='normalized.db')
+    columnar_parser.add_argument('--expected', metavar='DIRECTORY',
+                                 help='also compare with the ex3.csv ... ex11.csv files in this directory')
+
+    rebuild_parser = subparsers.add_parser('rebuild-rollups', help='rebuild the rollup tables from OrderDetail')
+    rebuild_parser.add_argument('database', nargs='?', default='normalized.db')
+
+    partition_parser = subparsers.add_parser('partition', help='split OrderDetail into per-year or per-quarter files')
+    partition_parser.add_argument('database', nargs='?', default='normalized.db')
+    partition_parser.add_argument('--by', choices=ORDER_PARTITION_GRANULARITIES, default='year')
+
+    rebuild_partition_parser = subparsers.add_parser('rebuild-partition', help='rebuild one order partition')
+    rebuild_partition_parser.add_argument('partition_key', help='for example 2013 or 2013Q2')
+    rebuild_partition_parser.add_argument('database', nargs='?', default='normalized.db')
+
+    refresh_partitions_parser = subparsers.add_parser('refresh-partitions',
+                                                      help='rewrite the partitions whose orders changed')
+    refresh_partitions_parser.add_argument('database', nargs='?', default='normalized.db')
+
+    check_partitions_parser = subparsers.add_parser('check-partitions',
+                                                    help='verify ex3-ex10 over the partitions against OrderDetail')
+    check_partitions_parser.add_argument('database', nargs='?', default='normalized.db')
+
+    load_parser = subparsers.add_parser('load', help='append a source file in checkpointed batches, '
+                                                     'quarantining malformed lines; resumes after a crash')
+    load_parser.add_argument('data_file')
+    load_parser.add_argument('database', nargs='?', default='normalized.db')
+    load_parser.add_argument('--checkpoint-mb', type=float, default=LOAD_CHECKPOINT_BYTES / (1 << 20),
+                             help='source megabytes committed per checkpoint')
+    load_parser.add_argument('--restart', action='store_true', help='ignore the checkpoint and start over')
+
+    run_parser = subparsers.add_parser('run', help='build the normalized database by running the step DAG')
+    run_parser.add_argument('data_file')
+    run_parser.add_argument('database', nargs='?', default='normalized.db')
+    run_parser.add_argument('--force', action='store_true', help='rerun every step even if its inputs are unchanged')
+    run_parser.add_argument('--serial', action='store_true', help='run the independent branches one after another')
+    run_parser.add_argument('--events', help='append instrumentation events to this file as JSON lines')
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        with contextlib.ExitStack() as stack:
+            if args.events:
+                events_file = stack.enter_context(open(args.events, 'a'))
+                stack.enter_context(event_listener(json_lines_listener(events_file)))
+            try:
+                run_pipeline(args.data_file, args.database, force=args.force, concurrent_branches=not args.serial)
+            except (Error, OSError) as e:
+                print(f"Error during pipeline run: {e}")
+                return 1
+        return 0
+    if args.command == 'load':
+        try:
+            resumable_load(args.data_file, args.database, int(args.checkpoint_mb * (1 << 20)), restart=args.restart)
+        except (Error, OSError) as e:
+            print(f"Error during load: {e}")
+            return 1
+        return 0
+    if args.command == 'check-rollups':
+        mismatches = check_rollups(args.database)
+        return 1 if mismatches is None or any(mismatches.values()) else 0
+    if args.command == 'rebuild-rollups':
+        try:
+            rebuild_rollups(args.database)
+        except Error as e:
+            print(f"Error during rollup rebuild: {e}")
+            return 1
+        return 0
+    if args.command in ('partition', 'rebuild-partition', 'refresh-partitions', 'check-partitions'):
+        try:
+            if args.command in ('partition', 'refresh-partitions'):
+                partitions = (write_order_partitions(args.database, args.by) if args.command == 'partition'
+                              else refresh_order_partitions(args.database))
+                for partition_key, rows in partitions.items():
+                    print(f"{order_partition_filename(args.database, partition_key)}: {rows} rows")
+            elif args.command == 'rebuild-partition':
+                rows = rebuild_order_partition(args.database, args.partition_key)
+                print(f"{order_partition_filename(args.database, args.partition_key)}: {rows} rows")
+            else:
+                mismatches = check_order_partitions(args.database)
+                return 1 if any(row is not None for row in mismatches.values()) else 0
+        except (Error, OSError, ValueError) as e:
+            print(f"Error during {args.command}: {e}")
+            return 1
+        return 0
+    if args.command == 'check-columnar':
+        try:
+            mismatches = check_columnar_backend(args.database, args.expected)
+        except (Error, OSError, ImportError) as e:
+            print(f"Error during columnar check: {e}")
+            return 1
+        return 1 if any(mismatches.values()) else 0
+    if args.command == 'export':
+        try:
+            export_results(args.database, args.query, args.output, args.customer, export_format=args.format,
+                           compression=args.compression, batch_size=args.batch_size)
+        except (Error, ValueError, ImportError) as e:
+            print(f"Error during export: {e}")
+            return 1
+    return 0
 
 
+if __name__ == '__main__':
+    sys.exit(cli())
@@ -0,0 +1,112 @@
+import datetime
+import os
+import sqlite3
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import main  # noqa: E402
+from synthetic import write_source_file  # noqa: E402
+
+NORMALIZED_TABLES = ('Region', 'Country', 'Customer', 'ProductCategory', 'Product', 'OrderDetail')
+
+
+@pytest.fixture(autouse=True)
+def fresh_caches():
+    """
+    Every test starts without a cached parse or cached dimension dictionaries.
+    """
+    main.clear_parsed_data_cache()
+    main._dimension_caches.clear()
+    yield
+    main.clear_parsed_data_cache()
+    main._dimension_caches.clear()
+
+
+@pytest.fixture(scope='session')
+def source_files(tmp_path_factory):
+    """
+    A synthetic source file and a copy holding only its first half, as {'full': path, 'half': path}.
+    """
+    directory = tmp_path_factory.mktemp('source')
+    full = str(directory / 'full.csv')
+    write_source_file(full, 1200, 150, products=40, years=3, seed=7)
+    with open(full) as file:
+        lines = file.readlines()
+    half = str(directory / 'half.csv')
+    with open(half, 'w') as file:
+        file.writelines(lines[:1 + (len(lines) - 1) // 2])
+    return {'full': full, 'half': half}
+
+
+@pytest.fixture
+def database(tmp_path):
+    return str(tmp_path / 'normalized.db')
+
+
+def read_tables(database_filename, table_names=NORMALIZED_TABLES):
+    """
+    Return {table: every row ordered by its primary key}.
+    """
+    conn = sqlite3.connect(database_filename)
+    try:
+        return {table: conn.execute(f"SELECT * FROM {table} ORDER BY 1").fetchall() for table in table_names}
+    finally:
+        conn.close()
+
+
+def order_lines(database_filename):
+    """
+    Return the sorted order lines with their names resolved, independent of surrogate IDs.
+    """
+    conn = sqlite3.connect(database_filename)
+    try:
+        return sorted(conn.execute('''
+        SELECT c.FirstName, c.LastName, p.ProductName, od.OrderDate, od.QuantityOrdered
+        FROM OrderDetail od
+        JOIN Customer c ON od.CustomerID = c.CustomerID
+        JOIN Product p ON od.ProductID = p.ProductID
+        ''').fetchall())
+    finally:
+        conn.close()
+
+
+def reference_tables(data_filename):
+    """
+    The normalized tables as the original step-by-step implementation builds them: each
+    dimension sorted and numbered from 1, and OrderDetail in file order.
+    """
+    with open(data_filename) as file:
+        next(file)
+        records = [line.strip().split('\t') for line in file]
+
+    regions = sorted({r[4] for r in records})
+    countries = sorted({(r[3], r[4]) for r in records})
+    customers = sorted({(r[0].split()[0], ' '.join(r[0].split()[1:]), r[1], r[2], r[3]) for r in records})
+    categories = sorted({pair for r in records for pair in zip(r[6].split(';'), r[7].split(';'))})
+    products = sorted({(name, float(price), category) for r in records
+                       for name, category, price in zip(r[5].split(';'), r[6].split(';'), r[8].split(';'))})
+
+    region_ids = {region: i for i, region in enumerate(regions, 1)}
+    country_ids = {country: i for i, (country, _) in enumerate(countries, 1)}
+    customer_ids = {f"{c[0]} {c[1]}".strip(): i for i, c in enumerate(customers, 1)}
+    category_ids = {category: i for i, (category, _) in enumerate(categories, 1)}
+    product_ids = {p[0]: i for i, p in enumerate(products, 1)}
+
+    orders = []
+    for r in records:
+        for product, quantity, order_date in zip(r[5].split(';'), r[9].split(';'), r[10].split(';')):
+            orders.append((len(orders) + 1, customer_ids[r[0]], product_ids[product],
+                           datetime.datetime.strptime(order_date, '%Y%m%d').strftime('%Y-%m-%d'), int(quantity)))
+    return {
+        'Region': [(i, region) for region, i in region_ids.items()],
+        'Country': [(i, c, region_ids[r]) for i, (c, r) in enumerate(countries, 1)],
+        'Customer': [(i, c[0], c[1], c[2], c[3], country_ids[c[4]]) for i, c in enumerate(customers, 1)],
+        'ProductCategory': [(i, c, d) for i, (c, d) in enumerate(categories, 1)],
+        'Product': [(i, p[0], p[1], category_ids[p[2]]) for i, p in enumerate(products, 1)],
+        'OrderDetail': orders,
+    }
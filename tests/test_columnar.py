@@ -0,0 +1,16 @@
+import pytest
+
+import main
+
+pytest.importorskip('numpy')
+
+
+def test_columnar_backend_matches(source_files, database):
+    main.normalize_data_file(source_files['full'], database)
+    assert not any(main.check_columnar_backend(database).values())
+
+
+def test_columnar_backend_matches_after_append(source_files, database):
+    main.normalize_data_file(source_files['half'], database)
+    main.incremental_load(source_files['full'], database)
+    assert not any(main.check_columnar_backend(database).values())
@@ -0,0 +1,46 @@
+import sqlite3
+
+import main
+
+
+def test_repeated_lookups_are_hits(source_files, database):
+    main.normalize_data_file(source_files['full'], database)
+    cache = main.get_dimension_cache(database)
+    customers = main.step6_create_customer_to_customerid_dictionary(database)
+    conn = main.create_connection(database)
+    try:
+        customer = min(customers)
+        for _ in range(3):
+            conn.execute(main.ex1(conn, customer)).fetchall()
+    finally:
+        conn.close()
+    assert main.step6_create_customer_to_customerid_dictionary(database) is customers
+    assert cache.stats() == {'hits': {'Customer': 4}, 'misses': {'Customer': 1}}
+
+
+def test_rewriting_step_invalidates_its_table(source_files, database):
+    main.normalize_data_file(source_files['half'], database)
+    cache = main.get_dimension_cache(database)
+    main.step2_create_region_to_regionid_dictionary(database)
+    main.step6_create_customer_to_customerid_dictionary(database)
+    main.step5_create_customer_table(source_files['half'], database)
+    main.step2_create_region_to_regionid_dictionary(database)
+    main.step6_create_customer_to_customerid_dictionary(database)
+    assert cache.stats()['misses'] == {'Region': 2, 'Country': 1, 'Customer': 2}
+
+
+def test_write_from_another_connection_reloads(source_files, database):
+    main.normalize_data_file(source_files['full'], database)
+    cache = main.get_dimension_cache(database)
+    regions = main.step2_create_region_to_regionid_dictionary(database)
+    region = min(regions)
+    conn = sqlite3.connect(database)
+    try:
+        conn.execute("UPDATE Region SET Region = ? WHERE Region = ?", (region + ' Renamed', region))
+        conn.commit()
+    finally:
+        conn.close()
+    reloaded = main.step2_create_region_to_regionid_dictionary(database)
+    assert reloaded[region + ' Renamed'] == regions[region]
+    assert region not in reloaded
+    assert cache.stats() == {'hits': {}, 'misses': {'Region': 2}}
@@ -0,0 +1,67 @@
+import bz2
+import csv
+import gzip
+import json
+import lzma
+
+import pytest
+
+import main
+
+OPENERS = {'gz': gzip.open, 'bz2': bz2.open, 'xz': lzma.open}
+# NULL in the leading rows of Quantity and in every row of Missing
+SPARSE_SQL = '''
+SELECT OrderID, CASE WHEN OrderID > 25 THEN QuantityOrdered END AS Quantity,
+       CASE WHEN OrderID > 25 THEN QuantityOrdered * 0.5 ELSE QuantityOrdered END AS Half,
+       NULL AS Missing, OrderDate
+FROM OrderDetail
+ORDER BY OrderID
+'''
+
+
+@pytest.fixture
+def conn(source_files, database):
+    main.normalize_data_file(source_files['full'], database)
+    conn = main.create_connection(database)
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize('suffix', ['', '.gz', '.bz2', '.xz'])
+def test_csv_export(conn, tmp_path, suffix):
+    output = str(tmp_path / f'ex1.csv{suffix}')
+    sql_statement, parameters = main.export_query_statement(conn, 'ex1', 'First5 Last5')
+    expected = conn.execute(sql_statement, parameters).fetchall()
+    assert main.export_query(conn, sql_statement, output, parameters, batch_size=7)[0] == len(expected)
+    opener = OPENERS.get(suffix[1:], open)
+    with opener(output, 'rt', newline='', encoding='utf-8') as file:
+        header, *rows = list(csv.reader(file))
+    assert header == ['Name', 'ProductName', 'OrderDate', 'ProductUnitPrice', 'QuantityOrdered', 'Total']
+    assert rows == [[str(value) for value in row] for row in expected]
+
+
+def test_jsonl_export(conn, tmp_path):
+    output = str(tmp_path / 'ex4.jsonl.gz')
+    expected = conn.execute(main.ex4(conn)).fetchall()
+    main.export_query(conn, main.ex4(conn), output)
+    with gzip.open(output, 'rt', encoding='utf-8') as file:
+        assert [tuple(json.loads(line).values()) for line in file] == expected
+
+
+@pytest.mark.parametrize('compression', [None, 'gzip', 'zstd'])
+def test_parquet_export(conn, tmp_path, compression):
+    pyarrow_parquet = pytest.importorskip('pyarrow.parquet')
+    output = str(tmp_path / 'sparse.parquet')
+    expected = conn.execute(SPARSE_SQL).fetchall()
+    main.export_query(conn, SPARSE_SQL, output, compression=compression, batch_size=10)
+    table = pyarrow_parquet.read_table(output)
+    assert [str(field.type) for field in table.schema] == ['int64', 'int64', 'double', 'null', 'string']
+    assert [tuple(row.values()) for row in table.to_pylist()] == expected
+
+
+def test_empty_parquet_export(conn, tmp_path):
+    pyarrow_parquet = pytest.importorskip('pyarrow.parquet')
+    output = str(tmp_path / 'ex1.parquet')
+    sql_statement, parameters = main.export_query_statement(conn, 'ex1', 'Nobody Here')
+    assert main.export_query(conn, sql_statement, output, parameters)[0] == 0
+    assert pyarrow_parquet.read_table(output).column_names[:2] == ['Name', 'ProductName']
@@ -0,0 +1,55 @@
+import pytest
+
+import main
+from conftest import read_tables
+
+
+@pytest.fixture
+def profiling():
+    main.set_profiling(cpu=True, memory=True)
+    yield
+    main.set_profiling()
+
+
+def test_phase_events(source_files, database):
+    events = []
+    with main.event_listener(events.append):
+        main.normalize_data_file(source_files['full'], database)
+        conn = main.create_connection(database)
+        try:
+            rows = main.execute_sql_statement(main.ex3(conn), conn, query_name='ex3')
+        finally:
+            conn.close()
+
+    paths = [event['path'] for event in events]
+    assert paths.count('normalize') == 1
+    assert 'normalize/write/insert' in paths
+    writes = {event['table']: event['counters']['rows'] for event in events if event['path'] == 'normalize/write'}
+    assert writes['OrderDetail'] == len(read_tables(database, ('OrderDetail',))['OrderDetail'])
+    query = next(event for event in events if event['name'] == 'query')
+    assert query['query'] == 'ex3'
+    assert query['counters']['rows'] == len(rows)
+    assert query['counters']['vm_steps'] > 0
+    assert all('profile' not in event and 'peak_traced_bytes' not in event for event in events)
+
+
+def test_profiles_the_outermost_phase_once(source_files, database, profiling):
+    events = []
+    with main.event_listener(events.append):
+        main.run_pipeline(source_files['full'], database)
+
+    profiled = [event for event in events if 'profile' in event or 'peak_traced_bytes' in event]
+    assert [event['path'] for event in profiled] == ['pipeline']
+    assert profiled[0]['profile'] and profiled[0]['peak_traced_bytes'] > 0
+    # the branch steps run on worker threads inside the pipeline phase
+    assert {'step1', 'step7'} <= {event['path'] for event in events}
+
+
+def test_profiles_every_top_level_phase(source_files, database, profiling):
+    events = []
+    with main.event_listener(events.append):
+        main.normalize_data_file(source_files['half'], database)
+        main.incremental_load(source_files['full'], database)
+
+    profiled = [event['path'] for event in events if 'profile' in event]
+    assert profiled == ['normalize', 'incremental_load']
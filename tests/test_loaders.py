@@ -0,0 +1,160 @@
+import sqlite3
+
+import pytest
+
+import main
+from conftest import NORMALIZED_TABLES, order_lines, read_tables, reference_tables
+
+
+def run_steps(data_filename, database_filename, stream=False):
+    main.step1_create_region_table(data_filename, database_filename)
+    main.step3_create_country_table(data_filename, database_filename)
+    main.step5_create_customer_table(data_filename, database_filename)
+    main.step7_create_productcategory_table(data_filename, database_filename)
+    main.step9_create_product_table(data_filename, database_filename)
+    main.step11_create_orderdetail_table(data_filename, database_filename, stream=stream)
+
+
+LOADERS = {
+    'steps': run_steps,
+    'steps_stream': lambda data, db: run_steps(data, db, stream=True),
+    'normalize': main.normalize_data_file,
+    'normalize_stream': lambda data, db: main.normalize_data_file(data, db, stream_orders=True),
+    'normalize_bulk': lambda data, db: main.normalize_data_file(data, db, bulk=True),
+    'normalize_parallel': lambda data, db: main.normalize_data_file(data, db, workers=2),
+    'pipeline': main.run_pipeline,
+}
+
+
+@pytest.mark.parametrize('loader', LOADERS)
+def test_loader_matches_reference(source_files, database, loader):
+    LOADERS[loader](source_files['full'], database)
+    assert read_tables(database) == reference_tables(source_files['full'])
+
+
+@pytest.mark.parametrize('loader', ['steps', 'normalize', 'normalize_bulk'])
+def test_reload_over_existing_database(source_files, database, loader):
+    main.normalize_data_file(source_files['half'], database, build_sales_fact=True, build_rollups=True)
+    LOADERS[loader](source_files['full'], database)
+    assert read_tables(database) == reference_tables(source_files['full'])
+    assert not any(main.check_rollups(database).values())
+
+
+def test_reload_over_incremental_database(source_files, database):
+    main.incremental_load(source_files['full'], database)
+    main.normalize_data_file(source_files['full'], database)
+    assert read_tables(database) == reference_tables(source_files['full'])
+
+
+def test_incremental_load_is_idempotent(source_files, database):
+    first = main.incremental_load(source_files['full'], database)
+    tables = read_tables(database)
+    assert first == len(tables['OrderDetail'])
+    assert main.incremental_load(source_files['full'], database) == 0
+    assert read_tables(database) == tables
+
+
+def test_incremental_load_appends_delta(source_files, database, tmp_path):
+    main.incremental_load(source_files['half'], database)
+    main.incremental_load(source_files['full'], database)
+    single = str(tmp_path / 'single.db')
+    main.incremental_load(source_files['full'], single)
+    assert order_lines(database) == order_lines(single)
+
+
+def test_incremental_load_after_full_load(source_files, database, tmp_path):
+    main.normalize_data_file(source_files['half'], database)
+    main.incremental_load(source_files['full'], database)
+    single = str(tmp_path / 'single.db')
+    main.incremental_load(source_files['full'], single)
+    assert order_lines(database) == order_lines(single)
+
+
+def test_full_load_replaces_loaded_lines(source_files, database, tmp_path):
+    main.incremental_load(source_files['full'], database)
+    main.normalize_data_file(source_files['half'], database)
+    main.incremental_load(source_files['full'], database)
+    single = str(tmp_path / 'single.db')
+    main.incremental_load(source_files['full'], single)
+    assert order_lines(database) == order_lines(single)
+
+
+@pytest.fixture
+def repeated_file(source_files, tmp_path):
+    """
+    The full source file followed by a second copy of its first 100 lines and a third of its first line.
+    """
+    with open(source_files['full']) as file:
+        header, *lines = file.read().splitlines()
+    repeated = str(tmp_path / 'repeated.csv')
+    with open(repeated, 'w') as file:
+        file.write('\n'.join([header] + lines + lines[:100] + lines[:1]) + '\n')
+    return repeated
+
+
+def test_incremental_load_keeps_repeated_lines(repeated_file, database, tmp_path):
+    assert main.incremental_load(repeated_file, database) == len(read_tables(database)['OrderDetail'])
+    assert main.incremental_load(repeated_file, database) == 0
+    full = str(tmp_path / 'full.db')
+    main.normalize_data_file(repeated_file, full)
+    assert order_lines(database) == order_lines(full)
+    assert main.incremental_load(repeated_file, full) == 0
+
+
+def test_incremental_load_appends_another_copy(source_files, repeated_file, database, tmp_path):
+    main.normalize_data_file(source_files['full'], database)
+    main.incremental_load(repeated_file, database)
+    full = str(tmp_path / 'full.db')
+    main.normalize_data_file(repeated_file, full)
+    assert order_lines(database) == order_lines(full)
+
+
+def test_digest_only_loaded_lines_are_converted(source_files, database):
+    main.normalize_data_file(source_files['full'], database)
+    conn = sqlite3.connect(database)
+    try:
+        conn.execute("CREATE TABLE LoadedDigest (LineDigest BLOB PRIMARY KEY) WITHOUT ROWID")
+        conn.execute("INSERT INTO LoadedDigest SELECT LineDigest FROM LoadedSourceLine")
+        conn.execute("DROP TABLE LoadedSourceLine")
+        conn.execute("ALTER TABLE LoadedDigest RENAME TO LoadedSourceLine")
+        conn.commit()
+    finally:
+        conn.close()
+    assert main.incremental_load(source_files['full'], database) == 0
+
+
+@pytest.mark.parametrize('loader', ['steps', 'pipeline'])
+def test_step_loads_record_loaded_lines(source_files, database, loader):
+    LOADERS[loader](source_files['full'], database)
+    assert main.incremental_load(source_files['full'], database) == 0
+
+
+@pytest.mark.parametrize('bulk', [False, True])
+def test_failed_reload_leaves_database_unchanged(source_files, database, bulk, monkeypatch):
+    main.normalize_data_file(source_files['full'], database, build_sales_fact=True)
+    tables = read_tables(database, NORMALIZED_TABLES + ('SalesFact', 'LoadedSourceLine'))
+
+    def fail(conn):
+        raise sqlite3.IntegrityError('injected failure')
+
+    monkeypatch.setattr(main, 'write_sales_fact_table', fail)
+    main.normalize_data_file(source_files['half'], database, bulk=bulk)
+    assert read_tables(database, NORMALIZED_TABLES + ('SalesFact', 'LoadedSourceLine')) == tables
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_failed_step11_leaves_database_unchanged(source_files, database, tmp_path, stream):
+    run_steps(source_files['full'], database, stream=True)
+    tables = read_tables(database, NORMALIZED_TABLES + ('LoadedSourceLine',))
+    with open(source_files['full']) as file:
+        lines = file.read().splitlines()
+    fields = lines[-1].split('\t')
+    fields[10] = ';'.join(['20131340'] * len(fields[10].split(';')))
+    bad = str(tmp_path / 'bad.csv')
+    with open(bad, 'w') as file:
+        file.write('\n'.join(lines[:-1] + ['\t'.join(fields)]) + '\n')
+
+    with pytest.raises(ValueError):
+        main.step11_create_orderdetail_table(bad, database, stream=stream)
+    assert read_tables(database, NORMALIZED_TABLES + ('LoadedSourceLine',)) == tables
+    assert main.incremental_load(source_files['full'], database) == 0
@@ -0,0 +1,44 @@
+import datetime
+
+import pytest
+
+import main
+
+DATES = [
+    '20130101', '20131231', '20120229', '19991231', '99991231', '10000101',
+    # out of range
+    '20130229', '20130230', '20130431', '20131301', '20130001', '20130100', '20131340', '20130132', '00000101',
+    # not zero-padded, or not eight digits
+    '201311', '2013115', '2013011', '201301011', '2013 1 5', '2013-1-5', '0999 1 1', '09990101',
+    # not plain ASCII digits
+    '', '2013010a', ' 2013011', '+2013011', '２０１３０１０１', '2013０101', '20130101\n',
+]
+
+
+def strptime_result(order_date):
+    try:
+        return datetime.datetime.strptime(order_date, '%Y%m%d').strftime('%Y-%m-%d')
+    except ValueError:
+        return ValueError
+
+
+def convert_result(order_date):
+    try:
+        return main.convert_order_date(order_date)
+    except ValueError:
+        return ValueError
+
+
+@pytest.mark.parametrize('order_date', DATES)
+def test_matches_strptime(order_date):
+    expected = strptime_result(order_date)
+    # the second call is served from the memo when the first one succeeded
+    assert convert_result(order_date) == expected
+    assert convert_result(order_date) == expected
+
+
+def test_every_day_of_a_leap_and_a_common_year():
+    day = datetime.date(2011, 12, 25)
+    while day.year < 2013:
+        day += datetime.timedelta(days=1)
+        assert main.convert_order_date(day.strftime('%Y%m%d')) == day.isoformat()
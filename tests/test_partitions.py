@@ -0,0 +1,64 @@
+import sqlite3
+
+import pytest
+
+import main
+
+
+def run_steps(data_filename, database_filename):
+    for step in (main.step1_create_region_table, main.step3_create_country_table, main.step5_create_customer_table,
+                 main.step7_create_productcategory_table, main.step9_create_product_table,
+                 main.step11_create_orderdetail_table):
+        step(data_filename, database_filename)
+
+
+RELOADS = {
+    'normalize': main.normalize_data_file,
+    'incremental': main.incremental_load,
+    'resumable': main.resumable_load,
+    'steps': run_steps,
+}
+
+
+@pytest.mark.parametrize('granularity', main.ORDER_PARTITION_GRANULARITIES)
+def test_partitioned_queries_match(source_files, database, granularity):
+    main.normalize_data_file(source_files['full'], database)
+    main.write_order_partitions(database, granularity)
+    assert all(row is None for row in main.check_order_partitions(database).values())
+
+
+def test_rebuilt_partition_matches(source_files, database):
+    main.normalize_data_file(source_files['full'], database)
+    partitions = main.write_order_partitions(database, 'year')
+    partition_key = sorted(partitions)[1]
+    assert main.rebuild_order_partition(database, partition_key) == partitions[partition_key]
+    assert all(row is None for row in main.check_order_partitions(database).values())
+
+
+@pytest.mark.parametrize('loader', RELOADS)
+def test_loaders_refresh_partitions(source_files, database, loader):
+    main.normalize_data_file(source_files['half'], database)
+    main.write_order_partitions(database, 'quarter')
+    RELOADS[loader](source_files['full'], database)
+    assert all(row is None for row in main.check_order_partitions(database).values())
+
+
+def test_outside_write_marks_partitions_out_of_date(source_files, database):
+    main.normalize_data_file(source_files['full'], database)
+    partitions = main.write_order_partitions(database, 'year')
+    first_year, last_year = min(partitions), max(partitions)
+    conn = sqlite3.connect(database)
+    try:
+        conn.execute("UPDATE OrderDetail SET QuantityOrdered = QuantityOrdered + 1 "
+                     "WHERE OrderID = (SELECT MIN(OrderID) FROM OrderDetail WHERE OrderDate LIKE ?)",
+                     (last_year + '%',))
+        conn.commit()
+    finally:
+        conn.close()
+
+    with pytest.raises(ValueError, match='out of date'):
+        main.partitioned_query(database, 'ex4')
+    assert main.partitioned_query(database, 'ex4', end_date=f'{first_year}-12-31')
+    assert main.refresh_order_partitions(database) == {last_year: partitions[last_year]}
+    assert all(row is None for row in main.check_order_partitions(database).values())
+    assert main.refresh_order_partitions(database) == {}
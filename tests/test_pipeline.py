@@ -0,0 +1,29 @@
+import pytest
+
+import main
+from conftest import read_tables, reference_tables
+
+
+def test_unchanged_source_skips_every_step(source_files, database):
+    main.run_pipeline(source_files['full'], database)
+    report = main.run_pipeline(source_files['full'], database)
+    assert report['ran'] == {}
+    assert read_tables(database) == reference_tables(source_files['full'])
+
+
+@pytest.mark.parametrize('loader', [main.normalize_data_file, main.incremental_load, main.resumable_load])
+def test_pipeline_reruns_after_another_loader(source_files, database, loader):
+    main.run_pipeline(source_files['half'], database)
+    loader(source_files['full'], database)
+    report = main.run_pipeline(source_files['half'], database)
+    assert set(report['ran']) == set(main.PIPELINE_STEPS)
+    assert read_tables(database) == reference_tables(source_files['half'])
+
+
+def test_pipeline_reruns_a_rewritten_step(source_files, database):
+    main.run_pipeline(source_files['full'], database)
+    main.step7_create_productcategory_table(source_files['full'], database)
+    report = main.run_pipeline(source_files['full'], database)
+    assert set(report['ran']) == {'ProductCategory', 'Product', 'OrderDetail'}
+    assert main.run_pipeline(source_files['full'], database)['ran'] == {}
+    assert read_tables(database) == reference_tables(source_files['full'])
@@ -0,0 +1,130 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import main
+
+main_directory = os.path.dirname(os.path.abspath(main.__file__))
+
+
+@pytest.fixture
+def elsewhere(source_files, tmp_path, monkeypatch):
+    """
+    A database that is not called normalized.db, queried from a directory whose normalized.db
+    holds different customers, as {'database': path, 'customer': name}.
+    """
+    database = str(tmp_path / 'sales.db')
+    main.normalize_data_file(source_files['full'], database)
+    cwd = tmp_path / 'cwd'
+    cwd.mkdir()
+    monkeypatch.chdir(cwd)
+    main.normalize_data_file(source_files['half'], 'normalized.db')
+    conn = main.create_connection(database)
+    try:
+        customer = conn.execute("SELECT FirstName || ' ' || LastName FROM Customer ORDER BY CustomerID DESC").fetchone()[0]
+    finally:
+        conn.close()
+    return {'database': database, 'customer': customer}
+
+
+def expected_rows(database, customer_name, total=False):
+    conn = main.create_connection(database)
+    try:
+        if total:
+            return conn.execute('''
+            SELECT c.FirstName || ' ' || c.LastName, ROUND(SUM(p.ProductUnitPrice * od.QuantityOrdered), 2)
+            FROM OrderDetail od JOIN Customer c ON od.CustomerID = c.CustomerID JOIN Product p ON od.ProductID = p.ProductID
+            WHERE c.FirstName || ' ' || c.LastName = ? GROUP BY c.CustomerID
+            ''', (customer_name,)).fetchall()
+        return conn.execute('''
+        SELECT c.FirstName || ' ' || c.LastName, p.ProductName, od.OrderDate, p.ProductUnitPrice, od.QuantityOrdered,
+               ROUND(p.ProductUnitPrice * od.QuantityOrdered, 2)
+        FROM OrderDetail od JOIN Customer c ON od.CustomerID = c.CustomerID JOIN Product p ON od.ProductID = p.ProductID
+        WHERE c.FirstName || ' ' || c.LastName = ? ORDER BY od.OrderID
+        ''', (customer_name,)).fetchall()
+    finally:
+        conn.close()
+
+
+def test_ex1_ex2_use_the_connection(elsewhere):
+    database, customer = elsewhere['database'], elsewhere['customer']
+    conn = main.create_connection(database)
+    try:
+        assert conn.execute(main.ex1(conn, customer)).fetchall() == expected_rows(database, customer)
+        assert conn.execute(main.ex2(conn, customer)).fetchall() == expected_rows(database, customer, total=True)
+    finally:
+        conn.close()
+
+
+def test_ex2_leaves_no_database_behind(source_files, tmp_path, monkeypatch):
+    database = str(tmp_path / 'sales.db')
+    main.normalize_data_file(source_files['full'], database)
+    monkeypatch.chdir(tmp_path)
+    conn = main.create_connection(database)
+    try:
+        assert conn.execute(main.ex2(conn, 'Nobody Here')).fetchall() == []
+    finally:
+        conn.close()
+    assert not os.path.exists(tmp_path / 'normalized.db')
+
+
+def test_ex1_in_memory(source_files, database):
+    main.normalize_data_file(source_files['full'], database)
+    source = main.create_connection(database)
+    conn = main.create_connection(':memory:')
+    try:
+        source.backup(conn)
+        customer = conn.execute("SELECT FirstName || ' ' || LastName FROM Customer").fetchone()[0]
+        assert conn.execute(main.ex1(conn, customer)).fetchall() == expected_rows(database, customer)
+        assert conn.execute(main.ex1(conn, 'Nobody Here')).fetchall() == []
+    finally:
+        conn.close()
+        source.close()
+
+
+def test_query_api_uses_the_connection(elsewhere, tmp_path):
+    database, customer = elsewhere['database'], elsewhere['customer']
+    with main.QueryRunner(database) as runner:
+        assert runner.ex1(customer) == expected_rows(database, customer)
+        assert runner.ex2(customer) == expected_rows(database, customer, total=True)
+    assert main.cached_query(database, 'ex2', customer, main.ResultCache()) == expected_rows(database, customer, True)
+    output = str(tmp_path / 'ex1.csv')
+    main.export_results(database, 'ex1', output, customer)
+    with open(output) as file:
+        assert len(file.readlines()) == 1 + len(expected_rows(database, customer))
+
+
+def test_query_plan_report_uses_its_database(source_files, tmp_path, monkeypatch):
+    database = str(tmp_path / 'sales.db')
+    main.normalize_data_file(source_files['full'], database)
+    monkeypatch.chdir(tmp_path)
+    report = main.query_plan_report(database)
+    assert list(report) == [f'ex{n}' for n in range(1, 12)]
+    assert any('CustomerID' in line for line in report['ex1']['after'])
+    assert not os.path.exists(tmp_path / 'normalized.db')
+
+
+def test_lookup_follows_reload_by_another_process(source_files, database):
+    main.normalize_data_file(source_files['full'], database)
+    with main.QueryRunner(database) as runner:
+        before = runner.ex2('First5 Last5')
+    result_cache = main.ResultCache()
+    main.cached_query(database, 'ex2', 'First5 Last5', result_cache)
+
+    subprocess.run([sys.executable, '-c', 'import sys, main; main.normalize_data_file(sys.argv[1], sys.argv[2])',
+                    source_files['half'], database], cwd=main_directory, check=True, capture_output=True)
+
+    expected = expected_rows(database, 'First5 Last5', total=True)
+    assert expected and expected != before
+    with main.QueryRunner(database) as runner:
+        assert runner.ex2('First5 Last5') == expected
+    assert main.cached_query(database, 'ex2', 'First5 Last5', result_cache) == expected
+    conn = main.create_connection(database)
+    try:
+        conn.execute("UPDATE Customer SET FirstName = 'Renamed' WHERE FirstName = 'First5' AND LastName = 'Last5'")
+        assert conn.execute(main.ex2(conn, 'Renamed Last5')).fetchall() == [('Renamed Last5', expected[0][1])]
+        conn.rollback()
+    finally:
+        conn.close()
@@ -0,0 +1,71 @@
+import asyncio
+import os
+import sqlite3
+
+import pytest
+
+import main
+
+ENDLESS_SQL = "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT COUNT(*) FROM c"
+
+
+@pytest.fixture
+def loaded(source_files, database):
+    main.normalize_data_file(source_files['full'], database)
+    return database
+
+
+def direct(database, query_name, customer_name=None):
+    conn = main.create_connection(database)
+    try:
+        sql_statement, parameters = main.export_query_statement(conn, query_name, customer_name)
+        return conn.execute(sql_statement, parameters).fetchall()
+    finally:
+        conn.close()
+
+
+def test_concurrent_queries(loaded):
+    customers = ['First1 Last1', 'First7 Last7', 'First40 Last40']
+
+    async def run():
+        async with main.QueryService(loaded, pool_size=2, max_concurrency=4) as service:
+            return await asyncio.gather(service.ex3(), *[service.ex1(c) for c in customers],
+                                        *[service.ex2(c) for c in customers], service.query('ex9'))
+
+    results = asyncio.run(run())
+    assert results == ([direct(loaded, 'ex3')] + [direct(loaded, 'ex1', c) for c in customers]
+                       + [direct(loaded, 'ex2', c) for c in customers] + [direct(loaded, 'ex9')])
+
+
+def test_timeout_interrupts_and_keeps_the_pool(loaded):
+    async def run():
+        async with main.QueryService(loaded, pool_size=1, max_concurrency=2) as service:
+            running = service.run(ENDLESS_SQL, timeout=0.2)
+            queued = service.run("SELECT 1", timeout=0.05)
+            outcomes = await asyncio.gather(running, queued, return_exceptions=True)
+            return outcomes, await service.ex3()
+
+    outcomes, rows = asyncio.run(run())
+    assert all(isinstance(outcome, TimeoutError) for outcome in outcomes)
+    assert rows == direct(loaded, 'ex3')
+
+
+def test_pool_is_read_only_and_keeps_the_journal_mode(loaded):
+    async def run():
+        async with main.QueryService(loaded, pool_size=1) as service:
+            return await service.run("DELETE FROM Region")
+
+    with pytest.raises(sqlite3.OperationalError, match='readonly'):
+        asyncio.run(run())
+    conn = sqlite3.connect(loaded)
+    try:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'delete'
+    finally:
+        conn.close()
+
+
+def test_missing_database_is_not_created(tmp_path):
+    database = str(tmp_path / 'missing.db')
+    with pytest.raises(FileNotFoundError):
+        main.QueryService(database)
+    assert not os.path.exists(database)
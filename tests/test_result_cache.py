@@ -0,0 +1,46 @@
+import sqlite3
+
+import main
+
+
+def test_step11_reload_makes_entries_unservable(source_files, database):
+    main.normalize_data_file(source_files['full'], database)
+    result_cache = main.ResultCache()
+    before = main.cached_query(database, 'ex3', result_cache=result_cache)
+    assert main.cached_query(database, 'ex3', result_cache=result_cache) is before
+
+    main.step11_create_orderdetail_table(source_files['half'], database)
+    conn = sqlite3.connect(database)
+    try:
+        expected = conn.execute(main.ex3(conn)).fetchall()
+    finally:
+        conn.close()
+    assert expected != before
+    assert main.cached_query(database, 'ex3', result_cache=result_cache) == expected
+    assert result_cache.stats() == {'hits': 1, 'misses': 2, 'entries': 1, 'rows': len(expected)}
+
+
+def test_least_recently_used_entries_are_evicted():
+    result_cache = main.ResultCache(max_entries=2)
+    result_cache.put('a', 1, [(1,)])
+    result_cache.put('b', 1, [(2,)])
+    assert result_cache.get('a', 1) == [(1,)]
+    result_cache.put('c', 1, [(3,)])
+    assert result_cache.get('b', 1) is None
+    assert result_cache.get('a', 1) == [(1,)]
+    assert result_cache.get('c', 1) == [(3,)]
+    assert result_cache.stats()['entries'] == 2
+
+
+def test_row_bound_evicts_and_skips_large_results():
+    result_cache = main.ResultCache(max_rows=5)
+    result_cache.put('a', 1, [(1,)] * 2)
+    result_cache.put('b', 1, [(2,)] * 2)
+    result_cache.put('c', 1, [(3,)] * 2)
+    assert result_cache.get('a', 1) is None
+    assert result_cache.stats()['rows'] == 4
+    result_cache.put('d', 1, [(4,)] * 6)
+    assert result_cache.get('d', 1) is None
+    assert result_cache.get('b', 1) and result_cache.get('c', 1)
+    result_cache.put('b', 1, [(5,)])
+    assert result_cache.stats() == {'hits': 2, 'misses': 2, 'entries': 2, 'rows': 3}
@@ -0,0 +1,119 @@
+import sqlite3
+
+import pytest
+
+import main
+from conftest import order_lines
+
+BAD_LINES = {
+    3: lambda fields: fields[:7],
+    10: lambda fields: fields[:9] + [fields[9] + ';4', fields[10]],
+    25: lambda fields: fields[:9] + ['x' + fields[9], fields[10]],
+    40: lambda fields: fields[:10] + ['20131340;' * fields[10].count(';') + '20131340'],
+    55: lambda fields: [fields[0].replace(' ', '  ', 1)] + fields[1:],
+}
+
+
+class Crash(Exception):
+    pass
+
+
+@pytest.fixture
+def mixed_files(source_files, tmp_path):
+    """
+    The full source file with BAD_LINES corrupted, and the same file without those lines.
+    """
+    with open(source_files['full']) as file:
+        header, *lines = file.read().splitlines()
+    mixed = [header]
+    good = [header]
+    for number, line in enumerate(lines, 1):
+        if number in BAD_LINES:
+            mixed.append('\t'.join(BAD_LINES[number](line.split('\t'))))
+        else:
+            mixed.append(line)
+            good.append(line)
+    files = {'mixed': str(tmp_path / 'mixed.csv'), 'good': str(tmp_path / 'good.csv')}
+    for name, contents in (('mixed', mixed), ('good', good)):
+        with open(files[name], 'w') as file:
+            file.write('\n'.join(contents) + '\n')
+    return files
+
+
+def quarantined(database_filename):
+    conn = sqlite3.connect(database_filename)
+    try:
+        return [row[0] for row in conn.execute("SELECT LineNumber FROM QuarantinedSourceLine ORDER BY LineNumber")]
+    finally:
+        conn.close()
+
+
+def test_bad_lines_are_quarantined(mixed_files, database, tmp_path):
+    main.resumable_load(mixed_files['mixed'], database, checkpoint_bytes=20000)
+    assert quarantined(database) == [number + 1 for number in sorted(BAD_LINES)]
+    reference = str(tmp_path / 'reference.db')
+    main.incremental_load(mixed_files['good'], reference)
+    assert order_lines(database) == order_lines(reference)
+
+
+def test_resume_after_crash(mixed_files, database, tmp_path, monkeypatch):
+    append_parsed_lines = main.append_parsed_lines
+    batches = []
+
+    def crash_on_third_batch(conn, parsed, chunk_size):
+        batches.append(len(parsed['orders']))
+        if len(batches) == 3:
+            raise Crash()
+        return append_parsed_lines(conn, parsed, chunk_size)
+
+    monkeypatch.setattr(main, 'append_parsed_lines', crash_on_third_batch)
+    with pytest.raises(Crash):
+        main.resumable_load(mixed_files['mixed'], database, checkpoint_bytes=20000)
+    monkeypatch.setattr(main, 'append_parsed_lines', append_parsed_lines)
+
+    conn = sqlite3.connect(database)
+    committed = conn.execute("SELECT COUNT(*) FROM OrderDetail").fetchone()[0]
+    conn.close()
+    assert committed == sum(batches[:2])
+
+    resumed = main.resumable_load(mixed_files['mixed'], database, checkpoint_bytes=20000)
+    assert committed + resumed == len(order_lines(database))
+    assert main.resumable_load(mixed_files['mixed'], database, checkpoint_bytes=20000) == 0
+    reference = str(tmp_path / 'reference.db')
+    main.incremental_load(mixed_files['good'], reference)
+    assert order_lines(database) == order_lines(reference)
+    assert quarantined(database) == [number + 1 for number in sorted(BAD_LINES)]
+
+
+def test_resume_keeps_repeated_lines(mixed_files, database, tmp_path, monkeypatch):
+    with open(mixed_files['good']) as file:
+        header, *lines = file.read().splitlines()
+    repeated = str(tmp_path / 'repeated.csv')
+    with open(repeated, 'w') as file:
+        file.write('\n'.join([header] + lines + lines[:100]) + '\n')
+    append_parsed_lines = main.append_parsed_lines
+    batches = []
+
+    def crash_on_third_batch(conn, parsed, chunk_size):
+        batches.append(len(parsed['orders']))
+        if len(batches) == 3:
+            raise Crash()
+        return append_parsed_lines(conn, parsed, chunk_size)
+
+    monkeypatch.setattr(main, 'append_parsed_lines', crash_on_third_batch)
+    with pytest.raises(Crash):
+        main.resumable_load(repeated, database, checkpoint_bytes=20000)
+    monkeypatch.setattr(main, 'append_parsed_lines', append_parsed_lines)
+
+    main.resumable_load(repeated, database, checkpoint_bytes=20000)
+    reference = str(tmp_path / 'reference.db')
+    main.normalize_data_file(repeated, reference)
+    assert order_lines(database) == order_lines(reference)
+
+
+def test_restart_ignores_checkpoint(mixed_files, database):
+    main.resumable_load(mixed_files['mixed'], database, checkpoint_bytes=20000)
+    lines = order_lines(database)
+    assert main.resumable_load(mixed_files['mixed'], database, checkpoint_bytes=20000, restart=True) == 0
+    assert order_lines(database) == lines
+    assert len(quarantined(database)) == len(BAD_LINES)
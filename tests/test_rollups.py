@@ -0,0 +1,48 @@
+import pytest
+
+import main
+
+
+@pytest.fixture
+def rollup_database(source_files, database):
+    """
+    Rollups built over half of the source, with the rest appended through the trigger.
+    """
+    main.normalize_data_file(source_files['half'], database, build_sales_fact=True, build_rollups=True)
+    main.incremental_load(source_files['full'], database)
+    return database
+
+
+def test_rollups_follow_appends(rollup_database):
+    assert not any(main.check_rollups(rollup_database).values())
+
+
+def test_rebuilt_rollups_are_consistent(rollup_database):
+    main.rebuild_rollups(rollup_database)
+    assert not any(main.check_rollups(rollup_database).values())
+
+
+@pytest.mark.parametrize('query', [main.ex3, main.ex4, main.ex5, main.ex8, main.ex10])
+def test_rollup_queries_match(rollup_database, query):
+    conn = main.create_connection(rollup_database)
+    try:
+        expected = conn.execute(query(conn)).fetchall()
+        assert main.rows_match(conn.execute(query(conn, rollup=True)).fetchall(), expected) is None
+        assert main.rows_match(conn.execute(query(conn, sales_fact=True)).fetchall(), expected) is None
+    finally:
+        conn.close()
+
+
+def test_ex11_rollup_matches(rollup_database):
+    conn = main.create_connection(rollup_database)
+    try:
+        assert conn.execute(main.ex11(conn, rollup=True)).fetchall() == conn.execute(main.ex11(conn)).fetchall()
+    finally:
+        conn.close()
+
+
+def test_check_rollups_without_rollups(source_files, database, capsys):
+    main.normalize_data_file(source_files['full'], database)
+    assert main.check_rollups(database) is None
+    assert 'No rollups in this database' in capsys.readouterr().out
+    assert main.cli(['check-rollups', database]) == 1